@@ -1,11 +1,19 @@
 import yaml
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from logic.db import get_mongo
+from logic.db import get_async_mongo, get_mongo
 from api.v1.crawler import router as crawler_router
 from api.v1.index import router as index_router
-from logic.boolean_index import get_boolean_index
+from logic.boolean_index import configure_boolean_index, get_boolean_index
 
+# db config keys of the async client's connection pool.
+POOL_OPTIONS = {
+    "pool_max_size": "maxPoolSize",
+    "pool_min_size": "minPoolSize",
+    "pool_max_idle_ms": "maxIdleTimeMS",
+    "pool_wait_timeout_ms": "waitQueueTimeoutMS",
+    "timeout_ms": "timeoutMS",
+}
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -20,10 +28,21 @@ async def lifespan(app: FastAPI):
         database=cfg["db"]["database"],
         collection=cfg["db"]["collection"],
     )
+    async_client, _ = get_async_mongo(
+        mongo_uri=cfg["db"]["mongo_uri"],
+        database=cfg["db"]["database"],
+        collection=cfg["db"]["collection"],
+        pool={option: cfg["db"][key] for key, option in POOL_OPTIONS.items() if key in cfg["db"]},
+    )
+    configure_boolean_index(cfg.get("index", {}), cfg["db"])
     index = get_boolean_index()
     yield
     
+    if index is not None:
+        index.save_snapshot()
+        index.close()
     client.close()
+    await async_client.close()
     
     
 def create_app() -> FastAPI:
@@ -1,6 +1,6 @@
 from fastapi import APIRouter
 
-from logic.managers import CrawlerManager, RQSchedulerManager, RQWorkerManager
+from logic.managers import CrawlerManager
 
 router = APIRouter(
     tags=["crawler"],
@@ -8,12 +8,8 @@ router = APIRouter(
 
 @router.post("/start")
 async def start_crawler():
-    return {"RQSchedulerManager": RQSchedulerManager.start(config_path="/app/config/config.yaml"),
-        "RQWorkerManager": RQWorkerManager.start(config_path="/app/config/config.yaml"),
-        "CrawlerManager": CrawlerManager.start(config_path="/app/config/config.yaml")}
+    return {"CrawlerManager": CrawlerManager.start(config_path="/app/config/config.yaml")}
 
 @router.post("/stop")
 async def stop_crawler():
-    return {"RQSchedulerManager": RQSchedulerManager.stop(),
-        "RQWorkerManager": RQWorkerManager.stop(),
-        "CrawlerManager": CrawlerManager.stop()}
\ No newline at end of file
+    return {"CrawlerManager": CrawlerManager.stop()}
\ No newline at end of file
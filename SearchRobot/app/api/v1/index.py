@@ -1,40 +1,84 @@
-from fastapi import APIRouter, Depends
-from pydantic import BaseModel
-from logic.boolean_index import get_boolean_index
+from typing import Annotated, Literal
+from fastapi import APIRouter, Depends, HTTPException, Path, Query
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
+from cpp.boolean_index_cpp import MAX_DOC_ID
+from logic.boolean_index import MongoBooleanIndex, get_boolean_index, get_boolean_index_async
 
 router = APIRouter(
     tags=["index"],
 )    
 
 @router.get("/search")
-async def search(query: str, offset: int = 0, limit: int = 100, index = Depends(get_boolean_index)):
-    search_result = index.search(query, offset, limit)
-    return {"index": search_result}
+async def search(query: str = "",
+                 offset: Annotated[int, Query(ge=0, le=MongoBooleanIndex.MAX_OFFSET)] = 0,
+                 limit: Annotated[int, Query(ge=0, le=MongoBooleanIndex.MAX_LIMIT)] = 100,
+                 mode: Literal["boolean", "ranked"] = "boolean",
+                 cursor: str | None = None,
+                 index = Depends(get_boolean_index_async)):
+    try:
+        search_result = await index.search_async(query, offset, limit, mode, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Plain dicts of str/int/float: no need for FastAPI's encoder walk.
+    return JSONResponse({"index": search_result["results"], "next_cursor": search_result["next_cursor"]})
+
+@router.get("/search/cache")
+def get_cache_stats(index = Depends(get_boolean_index)):
+    return index.cache_stats()
+
+@router.get("/index/sync")
+def get_sync_stats(index = Depends(get_boolean_index)):
+    return {"sync": index.sync_stats()}
+
+@router.get("/index/segments")
+def get_segment_stats(index = Depends(get_boolean_index)):
+    return {"segments": index.segment_stats()}
+
+@router.get("/search/explain")
+def explain(query: str, index = Depends(get_boolean_index)):
+    return index.explain(query)
 
 @router.get("/documents/count")
-async def get_documents_count(index = Depends(get_boolean_index)):
+def get_documents_count(index = Depends(get_boolean_index)):
     return {"count": index.get_document_count()}
 
 @router.get("/terms/count")
-async def get_terms_count(index = Depends(get_boolean_index)):
+def get_terms_count(index = Depends(get_boolean_index)):
     return {"count": index.get_term_count()}
 
 @router.get("/document/{doc_id}/terms/")
-async def get_document_terms(doc_id: int, index = Depends(get_boolean_index)):
+def get_document_terms(doc_id: int, index = Depends(get_boolean_index)):
     return {"terms": index.get_document_terms(doc_id)}
 
 @router.post("/document/{doc_id}")
-async def add(doc_id: int, terms: list[str], index = Depends(get_boolean_index)):
+def add(doc_id: Annotated[int, Path(ge=0, le=MAX_DOC_ID)], terms: list[str], index = Depends(get_boolean_index)):
     index.add_document(doc_id, terms)
     return {"index": "ok"}
 
 @router.delete("/document/{doc_id}")
-async def remove(doc_id: int, terms: list[str], index = Depends(get_boolean_index)):
-    index.remove_document(doc_id, terms)
+def remove(doc_id: Annotated[int, Path(ge=0, le=MAX_DOC_ID)], index = Depends(get_boolean_index)):
+    index.remove_document(doc_id)
     return {"index": "ok"}
 
+class BatchOperation(BaseModel):
+    op: Literal["add", "replace", "remove"]
+    doc_id: int = Field(ge=0, le=MAX_DOC_ID)
+    terms: list[str] = []
+    url: str | None = None
+    title: str | None = None
+    domain: str | None = None
+
+@router.post("/documents/batch")
+def apply_batch(ops: list[BatchOperation], index = Depends(get_boolean_index)):
+    index.apply_batch([op.model_dump() for op in ops])
+    return {"index": "ok", "applied": len(ops)}
+
 @router.delete("/documents")
-async def clear(index = Depends(get_boolean_index)):
+def clear(index = Depends(get_boolean_index)):
     index.clear()
     return {"index": "ok"}
 
+@router.post("/index/snapshot")
+def save_snapshot(index = Depends(get_boolean_index)):
+    return {"index": "ok" if index.save_snapshot() else "disabled"}
@@ -0,0 +1,194 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import string
+import time
+from itertools import accumulate
+from typing import Literal
+import httpx
+from fastapi import APIRouter, FastAPI, HTTPException
+from pymongo import AsyncMongoClient, MongoClient
+from bench.corpus import percentile
+from bench.mongo_standin import page_docs, serve
+from cpp.text_processor_cpp import process_query
+from api.v1.index import router as index_router
+from logic.boolean_index import MongoBooleanIndex, get_boolean_index_async
+
+
+def word_vocabulary(size):
+    # Words the query processor keeps as they are, most frequent first.
+    words = []
+    rank = 0
+    while len(words) < size:
+        word, r = "", rank
+        while True:
+            word = string.ascii_lowercase[r % 26] + word
+            r //= 26
+            if not r:
+                break
+        if process_query("zq" + word)["terms"] == ["zq" + word]:
+            words.append("zq" + word)
+        rank += 1
+    return words, list(accumulate(1.0 / rank for rank in range(1, size + 1)))
+
+
+def word_corpus(docs, vocab, doc_len, seed=42):
+    rnd = random.Random(seed)
+    words, cum_weights = word_vocabulary(vocab)
+    for doc_id in range(1, docs + 1):
+        yield doc_id, rnd.choices(words, cum_weights=cum_weights, k=doc_len)
+
+
+def word_queries(count, distinct, seed):
+    # count queries drawn from distinct ones by a Zipf law, like a query
+    # log where a few searches are very popular.
+    rnd = random.Random(seed)
+    words, _ = word_vocabulary(200)
+    head = words[:50]
+    shapes = [
+        lambda: (f"{rnd.choice(head)} or {rnd.choice(head)}", "boolean"),
+        lambda: (f"{rnd.choice(head)} and {rnd.choice(head)}", "boolean"),
+        lambda: (f"{rnd.choice(head)} {rnd.choice(words)}", "ranked"),
+    ]
+    pool = [rnd.choice(shapes)() for _ in range(distinct)]
+    cum_weights = list(accumulate(1.0 / rank for rank in range(1, distinct + 1)))
+    return rnd.choices(pool, cum_weights=cum_weights, k=count)
+
+
+class ColdDocStore:
+    # A document store that never has the documents, so every result is
+    # read from Mongo, as right after a deploy or for a store-less index.
+    def get_many(self, doc_ids):
+        return {}
+
+    def set(self, doc_id, url, title, domain):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+def threadpool_app(index):
+    # The search handler as it was: a sync def on the threadpool, reading
+    # with the blocking client.
+    router = APIRouter()
+
+    @router.get("/search")
+    def search(query: str = "", offset: int = 0, limit: int = 100,
+               mode: Literal["boolean", "ranked"] = "boolean",
+               cursor: str | None = None):
+        try:
+            search_result = index.search(query, offset, limit, mode, cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {"index": search_result["results"], "next_cursor": search_result["next_cursor"]}
+
+    app = FastAPI()
+    app.include_router(router)
+    return app
+
+
+def async_app(index):
+    app = FastAPI()
+    app.include_router(index_router)
+    async def current_index():
+        return index
+
+    app.dependency_overrides[get_boolean_index_async] = current_index
+    return app
+
+
+async def run_load(app, queries, rate, limit, seed=5):
+    # Open loop: requests arrive at rate per second (Poisson) whatever the
+    # latency, as from many independent users; returns the latencies and
+    # the most requests that were in flight at once.
+    rnd = random.Random(seed)
+    samples = []
+    in_flight = [0, 0]
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://api") as client:
+        async def request(query, mode):
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+            started = time.perf_counter()
+            response = await client.get("/search", params={"query": query, "mode": mode, "limit": limit})
+            response.raise_for_status()
+            samples.append((time.perf_counter() - started) * 1000)
+            in_flight[0] -= 1
+
+        tasks = []
+        next_at = time.perf_counter()
+        for query, mode in queries:
+            next_at += rnd.expovariate(rate)
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+            tasks.append(asyncio.ensure_future(request(query, mode)))
+        await asyncio.gather(*tasks)
+    return samples, in_flight[1]
+
+
+async def main_async(args, uri):
+    pool = {"maxPoolSize": args.pool_size, "minPoolSize": min(10, args.pool_size)}
+    client = MongoClient(uri, **pool)
+    async_client = AsyncMongoClient(uri, **pool)
+    collection = client["search"]["documents"]
+    index = MongoBooleanIndex(
+        collection,
+        async_collection=async_client["search"]["documents"],
+        search_threads=args.search_threads,
+        store_positions=True,
+    )
+    index.docs = ColdDocStore()
+    print(f"{index.get_document_count()} docs, Mongo latency {args.latency_ms} ms "
+          f"(+{args.tail_ms} ms for {args.tail_rate:.0%}), {os.cpu_count()} cpus")
+    apps = [("threadpool", threadpool_app(index)), ("async", async_app(index))]
+    try:
+        for rate in [int(r) for r in args.rates.split(",")]:
+            queries = word_queries(int(rate * args.duration), args.distinct, seed=rate)
+            for name, app in apps:
+                # Connections to Mongo are opened on demand: warm up first.
+                await run_load(app, queries[:rate], rate, args.limit)
+                shared = index.coalescer.shared
+                samples, peak = await run_load(app, queries, rate, args.limit)
+                print(f"{rate:4d} req/s {name:>10}: p50 {percentile(samples, 50):7.1f} ms   "
+                      f"p99 {percentile(samples, 99):7.1f} ms   up to {peak:4d} in flight   "
+                      f"coalesced {index.coalescer.shared - shared}")
+    finally:
+        index.close()
+        client.close()
+        await async_client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search API latency under concurrency, threadpool handler vs async path")
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--doc-len", type=int, default=60)
+    parser.add_argument("--port", type=int, default=27018)
+    parser.add_argument("--latency-ms", type=float, default=10.0)
+    parser.add_argument("--tail-ms", type=float, default=0.0)
+    parser.add_argument("--tail-rate", type=float, default=0.01)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load per rate")
+    parser.add_argument("--distinct", type=int, default=300, help="distinct queries in the load")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--rates", default="100,200,300", help="request rates per second")
+    parser.add_argument("--pool-size", type=int, default=100)
+    parser.add_argument("--search-threads", type=int, default=None)
+    args = parser.parse_args()
+
+    docs = list(page_docs(word_corpus(args.docs, 20000, args.doc_len)))
+    server = multiprocessing.Process(
+        target=serve,
+        args=(docs, "127.0.0.1", args.port, args.latency_ms / 1000, args.tail_ms / 1000, args.tail_rate),
+        daemon=True,
+    )
+    server.start()
+    try:
+        time.sleep(0.5)
+        asyncio.run(main_async(args, f"mongodb://127.0.0.1:{args.port}/?directConnection=true"))
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import argparse
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from bench.corpus import percentile, zipf_corpus
+from bench.postings import load_index_class
+
+
+def make_queries(count, seed):
+    rnd = random.Random(seed)
+    head = [f"t{rank}" for rank in range(1, 51)]
+    shapes = [
+        lambda: [rnd.choice(head), "or", rnd.choice(head)],
+        lambda: [rnd.choice(head), "and", rnd.choice(head)],
+        lambda: [rnd.choice(head), "not", rnd.choice(head)],
+    ]
+    return [rnd.choice(shapes)() for _ in range(count)]
+
+
+def run_readers(index, queries, threads, duration):
+    stop = time.perf_counter() + duration
+    counts = [0] * threads
+
+    def reader(slot):
+        i = slot
+        while time.perf_counter() < stop:
+            index.search(queries[i % len(queries)])
+            i += threads
+            counts[slot] += 1
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(reader, range(threads)))
+    return sum(counts) / duration
+
+
+def probe_latency(index, queries, threads, probes):
+    # Latency of a cheap call while every other thread runs heavy queries.
+    done = threading.Event()
+
+    def reader(slot):
+        i = slot
+        while not done.is_set():
+            index.search(queries[i % len(queries)])
+            i += threads
+
+    samples = []
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for slot in range(threads):
+            pool.submit(reader, slot)
+        time.sleep(0.05)
+        for _ in range(probes):
+            started = time.perf_counter()
+            index.get_document_count()
+            samples.append((time.perf_counter() - started) * 1000)
+            time.sleep(0.002)
+        done.set()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BooleanIndex query throughput with concurrent readers")
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--vocab", type=int, default=50000)
+    parser.add_argument("--doc-len", type=int, default=120)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=3.0, help="seconds per thread count")
+    parser.add_argument("--threads", default="1,2,4,8")
+    parser.add_argument("--module-dir", help="directory with an alternative boolean_index_cpp build")
+    args = parser.parse_args()
+
+    index = load_index_class(args.module_dir)()
+    for doc_id, terms in zipf_corpus(args.docs, args.vocab, args.doc_len):
+        index.add_document(doc_id, terms)
+    queries = make_queries(args.queries, seed=7)
+    print(f"{args.docs} docs, {index.get_term_count()} terms, {os.cpu_count()} cpus")
+
+    base = None
+    for threads in [int(t) for t in args.threads.split(",")]:
+        qps = run_readers(index, queries, threads, args.duration)
+        base = base or qps
+        samples = probe_latency(index, queries, threads, 200)
+        print(f"{threads:>2} threads: {qps:9.1f} qps  x{qps / base:4.2f}   "
+              f"count() p50 {percentile(samples, 50):7.3f} ms  p99 {percentile(samples, 99):7.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+import random
+from itertools import accumulate
+
+
+def zipf_vocabulary(size: int):
+    terms = [f"t{rank}" for rank in range(1, size + 1)]
+    cum_weights = list(accumulate(1.0 / rank for rank in range(1, size + 1)))
+    return terms, cum_weights
+
+
+def zipf_corpus(docs: int, vocab_size: int, doc_len: int, seed: int = 42):
+    rnd = random.Random(seed)
+    terms, cum_weights = zipf_vocabulary(vocab_size)
+    for doc_id in range(1, docs + 1):
+        yield doc_id, rnd.choices(terms, cum_weights=cum_weights, k=doc_len)
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
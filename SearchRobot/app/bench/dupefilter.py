@@ -0,0 +1,82 @@
+import argparse
+import hashlib
+import time
+from redis import Redis
+from logic.bloom import RedisBloomFilter
+
+CHUNK = 10000
+
+
+def fingerprints(count, seed):
+    for i in range(count):
+        yield hashlib.sha1(f"{seed}:https://www.example.com/news/{i}.html".encode()).hexdigest()
+
+
+def key_bytes(redis, keys):
+    return sum(redis.memory_usage(key, samples=0) or 0 for key in keys)
+
+
+def fill_set(redis, key, count):
+    started = time.perf_counter()
+    batch = []
+    for fp in fingerprints(count, "set"):
+        batch.append(fp)
+        if len(batch) == CHUNK:
+            redis.sadd(key, *batch)
+            batch = []
+    if batch:
+        redis.sadd(key, *batch)
+    return time.perf_counter() - started
+
+
+def fill_bloom(bloom, count):
+    started = time.perf_counter()
+    false_positives = 0
+    batch = []
+    for fp in fingerprints(count, "bloom"):
+        batch.append(fp)
+        if len(batch) == CHUNK:
+            false_positives += bloom.add_many(batch).count(False)
+            batch = []
+    false_positives += bloom.add_many(batch).count(False)
+    return time.perf_counter() - started, false_positives
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Redis memory of the set dupefilter against the Bloom filter one")
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15")
+    parser.add_argument("--urls", type=int, default=1_000_000)
+    parser.add_argument("--capacity", type=int, default=1_000_000)
+    parser.add_argument("--error-rate", type=float, default=0.001)
+    args = parser.parse_args()
+
+    redis = Redis.from_url(args.redis_url)
+    set_key = "bench:dupefilter:set"
+    bloom = RedisBloomFilter(redis, "bench:dupefilter:bloom", args.capacity, args.error_rate)
+    redis.delete(set_key)
+    bloom.clear()
+    millions = args.urls / 1e6
+
+    elapsed = fill_set(redis, set_key, args.urls)
+    set_bytes = key_bytes(redis, [set_key])
+    print(f"set:   {set_bytes / millions / 2**20:7.1f} MB per million urls  ({args.urls / elapsed:8.0f} adds/s)")
+
+    elapsed, false_positives = fill_bloom(bloom, args.urls)
+    stats = bloom.stats()
+    bloom_bytes = key_bytes(redis, [bloom.key] + [f"{bloom.key}:{i}" for i in range(stats['layers'])])
+    print(
+        f"bloom: {bloom_bytes / millions / 2**20:7.1f} MB per million urls  ({args.urls / elapsed:8.0f} adds/s)"
+        f"  {stats['layers']} layers, {false_positives} false positives ({false_positives / args.urls:.4%})"
+    )
+
+    started = time.perf_counter()
+    for fp in fingerprints(2000, "single"):
+        bloom.add(fp)
+    print(f"bloom, one request per call: {(time.perf_counter() - started) / 2000 * 1e6:.0f} us")
+
+    redis.delete(set_key)
+    bloom.clear()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import argparse
+import multiprocessing
+import os
+import re
+import time
+import yaml
+from concurrent.futures import ProcessPoolExecutor
+from bs4 import BeautifulSoup
+from logic.extractor import ContentExtractor, init_worker, extract_page
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+CONFIG = os.path.join(os.path.dirname(__file__), "..", "config", "config.yaml")
+
+
+# The extraction ExtractContentPipeline did before the lxml extractor.
+def soup_extract(html, domain):
+    soup = BeautifulSoup(html, "html.parser")
+    title_tag = soup.find("title")
+    title = title_tag.string.strip() if title_tag and title_tag.string else ""
+    if domain == "www.sport-express.ru":
+        main_content = soup.find(class_="se-material-page__body")
+        content = main_content.get_text(separator="\n", strip=True) if main_content else ""
+    elif domain == "www.championat.com":
+        main_content = soup.find(class_="page-main")
+        content = main_content.get_text(separator="\n", strip=True) if main_content else ""
+    elif domain == "www.sovsport.ru":
+        main_content = soup.find(id="content-column")
+        content = ""
+        if main_content:
+            prefixes = ["news-by-id_navigation", "news-by-id_header", "content-controller_text-editor"]
+            pattern = re.compile(rf'^({"|".join(re.escape(p) for p in prefixes)})')
+            for elem in main_content.find_all(class_=pattern):
+                content += elem.get_text(separator="\n", strip=True) + "\n"
+    else:
+        content = soup.get_text(separator="\n", strip=True)
+    return {"title": title, "content": content}
+
+
+def load_pages(fixtures):
+    pages = []
+    for name in sorted(os.listdir(fixtures)):
+        if name.endswith(".html"):
+            with open(os.path.join(fixtures, name), encoding="utf-8") as f:
+                pages.append((name[:-len(".html")], f.read()))
+    return pages
+
+
+def timed(fn, pages, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for domain, html in pages:
+            fn(html, domain)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTML extraction speed over saved pages of the configured sites")
+    parser.add_argument("--fixtures", default=FIXTURES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--pool-pages", type=int, default=600)
+    parser.add_argument("--workers", default="1,2,4")
+    args = parser.parse_args()
+
+    with open(CONFIG) as f:
+        sites = yaml.safe_load(f)["extraction"]["sites"]
+    extractor = ContentExtractor(sites)
+    pages = load_pages(args.fixtures)
+    print(f"{len(pages)} pages, {os.cpu_count()} cpus")
+
+    for domain, html in pages:
+        old = soup_extract(html, domain)
+        new = extractor.extract(html, domain)
+        same = old["title"] == new["title"] and old["content"] == new["content"]
+        single = [(domain, html)]
+        soup_s = timed(soup_extract, single, args.repeat)
+        lxml_s = timed(extractor.extract, single, args.repeat)
+        print(
+            f"{domain:<22} {len(html) / 1024:6.0f} KB  bs4 {soup_s * 1000:7.2f} ms"
+            f"  lxml {lxml_s * 1000:6.2f} ms  x{soup_s / lxml_s:5.1f}  same={same}"
+        )
+
+    batch = [pages[i % len(pages)] for i in range(args.pool_pages)]
+    elapsed = timed(extractor.extract, batch, 1)
+    print(f"in process: {len(batch) / elapsed:8.0f} pages/s")
+    for workers in [int(w) for w in args.workers.split(",")]:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(sites,),
+        ) as pool:
+            list(pool.map(extract_page, [html for _, html in pages], [domain for domain, _ in pages]))
+            started = time.perf_counter()
+            list(pool.map(extract_page, [html for _, html in batch], [domain for domain, _ in batch], chunksize=1))
+            elapsed = time.perf_counter() - started
+        print(f"{workers} workers:  {len(batch) / elapsed:8.0f} pages/s")
+
+
+if __name__ == "__main__":
+    main()
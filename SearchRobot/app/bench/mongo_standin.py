@@ -0,0 +1,210 @@
+import argparse
+import asyncio
+import itertools
+import random
+import struct
+from datetime import datetime
+import bson
+
+OP_REPLY = 1
+OP_QUERY = 2004
+OP_MSG = 2013
+HEADER = struct.Struct("<iiii")
+BATCH_SIZE = 1000
+
+
+class MongoStandIn:
+    # Just enough of a mongod for the index and the API: the handshake and
+    # find/getMore over in-memory collections, with doc_id $in and equality
+    # filters. docs is the pages collection, whatever its name; collections
+    # holds any others by name. Every reply is delayed by latency seconds,
+    # and by tail seconds for a tail_rate share of them, like a loaded server.
+    def __init__(self, docs, latency=0.0, tail=0.0, tail_rate=0.0, seed=1, collections=None):
+        self.docs = docs
+        self.collections = collections or {}
+        self.by_doc_id = {doc["doc_id"]: doc for doc in docs}
+        self.latency = latency
+        self.tail = tail
+        self.tail_rate = tail_rate
+        self.rnd = random.Random(seed)
+        self.cursors = {}
+        self.cursor_ids = itertools.count(1)
+        self.connections = itertools.count(1)
+        self.stats = {"connections": 0, "finds": 0}
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self._connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def _connection(self, reader, writer):
+        self.stats["connections"] += 1
+        connection_id = next(self.connections)
+        try:
+            while True:
+                header = await reader.readexactly(HEADER.size)
+                length, request_id, _, op_code = HEADER.unpack(header)
+                body = await reader.readexactly(length - HEADER.size)
+                if op_code == OP_QUERY:
+                    reply = self._op_query(body, connection_id)
+                    writer.write(self._op_reply(request_id, reply))
+                elif op_code == OP_MSG:
+                    command = self._op_msg_command(body)
+                    if command is None:
+                        continue
+                    reply = self._command(command, connection_id)
+                    if command.get("find") or command.get("getMore"):
+                        await self._delay()
+                    writer.write(self._op_msg(request_id, reply))
+                else:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _delay(self):
+        delay = self.latency
+        if self.tail and self.rnd.random() < self.tail_rate:
+            delay += self.tail
+        if delay:
+            await asyncio.sleep(delay)
+
+    # Wire protocol
+
+    def _op_query(self, body, connection_id):
+        # Only the legacy handshake still comes as OP_QUERY.
+        name_end = body.index(b"\0", 4)
+        query_start = name_end + 1 + 8
+        query = bson.decode(body[query_start:query_start + struct.unpack_from("<i", body, query_start)[0]])
+        return self._command(query, connection_id)
+
+    def _op_reply(self, request_id, doc):
+        payload = bson.encode(doc)
+        body = struct.pack("<iqii", 0, 0, 0, 1) + payload
+        return HEADER.pack(HEADER.size + len(body), 0, request_id, OP_REPLY) + body
+
+    def _op_msg_command(self, body):
+        flags = struct.unpack_from("<I", body)[0]
+        end = len(body) - (4 if flags & 1 else 0)
+        command = None
+        pos = 4
+        while pos < end:
+            kind = body[pos]
+            pos += 1
+            size = struct.unpack_from("<i", body, pos)[0]
+            if kind == 0:
+                command = bson.decode(body[pos:pos + size])
+            else:
+                # Document sequences (inserts) are not needed here.
+                pass
+            pos += size
+        # moreToCome: the client expects no reply.
+        if flags & 2:
+            return None
+        return command
+
+    def _op_msg(self, request_id, doc):
+        body = struct.pack("<IB", 0, 0) + bson.encode(doc)
+        return HEADER.pack(HEADER.size + len(body), 0, request_id, OP_MSG) + body
+
+    # Commands
+
+    def _command(self, command, connection_id):
+        name = next(iter(command)).lower()
+        if name in ("hello", "ismaster"):
+            return {
+                "ismaster": True, "isWritablePrimary": True, "helloOk": True,
+                "maxBsonObjectSize": 16 * 1024 * 1024, "maxMessageSizeBytes": 48000000,
+                "maxWriteBatchSize": 100000, "localTime": datetime.now(),
+                "logicalSessionTimeoutMinutes": 30, "connectionId": connection_id,
+                "minWireVersion": 0, "maxWireVersion": 21, "readOnly": False, "ok": 1.0,
+            }
+        if name == "find":
+            return self._find(command)
+        if name == "getmore":
+            return self._get_more(command)
+        if name == "killcursors":
+            for cursor_id in command.get("cursors", []):
+                self.cursors.pop(cursor_id, None)
+            return {"cursorsKilled": command.get("cursors", []), "ok": 1.0}
+        if name in ("ping", "endsessions", "buildinfo"):
+            return {"version": "7.0.0", "ok": 1.0}
+        return {"ok": 0.0, "errmsg": f"no such command: '{name}'", "code": 59, "codeName": "CommandNotFound"}
+
+    def _matches(self, doc, filter_):
+        for field, condition in filter_.items():
+            value = doc.get(field)
+            if isinstance(condition, dict):
+                if "$in" in condition and value not in condition["$in"]:
+                    return False
+            elif value != condition:
+                return False
+        return True
+
+    def _project(self, doc, projection):
+        if not projection:
+            return doc
+        return {field: doc[field] for field in ("_id", *projection) if field in doc and projection.get(field, 1)}
+
+    def _find(self, command):
+        self.stats["finds"] += 1
+        filter_ = command.get("filter", {})
+        docs = self.collections.get(command["find"], self.docs)
+        ids = filter_.get("doc_id", {}).get("$in") if isinstance(filter_.get("doc_id"), dict) else None
+        if ids is not None and len(filter_) == 1 and docs is self.docs:
+            candidates = (self.by_doc_id[doc_id] for doc_id in ids if doc_id in self.by_doc_id)
+        else:
+            candidates = (doc for doc in docs if self._matches(doc, filter_))
+        projection = command.get("projection")
+        results = iter([self._project(doc, projection) for doc in candidates])
+        ns = f"{command['$db']}.{command['find']}"
+        return self._batch(ns, results, command.get("batchSize", BATCH_SIZE), "firstBatch")
+
+    def _get_more(self, command):
+        ns, results = self.cursors.pop(command["getMore"], (None, iter(())))
+        return self._batch(ns, results, command.get("batchSize", BATCH_SIZE), "nextBatch")
+
+    def _batch(self, ns, results, batch_size, key):
+        batch = list(itertools.islice(results, batch_size or BATCH_SIZE))
+        cursor_id = 0
+        if len(batch) == (batch_size or BATCH_SIZE):
+            cursor_id = next(self.cursor_ids)
+            self.cursors[cursor_id] = (ns, results)
+        return {"cursor": {"id": bson.Int64(cursor_id), "ns": ns, key: batch}, "ok": 1.0}
+
+
+def page_docs(corpus):
+    for doc_id, terms in corpus:
+        yield {
+            "_id": bson.ObjectId(),
+            "doc_id": doc_id,
+            "url": f"https://example.com/news/{doc_id}",
+            "title": f"News {doc_id}",
+            "domain": "example.com",
+            "terms": terms,
+        }
+
+
+def serve(docs, host, port, latency=0.0, tail=0.0, tail_rate=0.0, collections=None):
+    asyncio.run(MongoStandIn(docs, latency, tail, tail_rate, collections=collections).serve(host, port))
+
+
+def main():
+    from bench.corpus import zipf_corpus
+    parser = argparse.ArgumentParser(description="In-memory mongod stand-in serving a synthetic pages collection")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=27018)
+    parser.add_argument("--docs", type=int, default=10000)
+    parser.add_argument("--latency-ms", type=float, default=2.0)
+    parser.add_argument("--tail-ms", type=float, default=0.0)
+    parser.add_argument("--tail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    docs = list(page_docs(zipf_corpus(args.docs, 50000, 120)))
+    print(f"Serving {len(docs)} docs on {args.host}:{args.port}")
+    serve(docs, args.host, args.port, args.latency_ms / 1000, args.tail_ms / 1000, args.tail_rate)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+from bench.tokenizer import make_corpus
+from cpp.boolean_index_cpp import BooleanIndex
+from cpp.text_processor_cpp import process_documents, minhash
+from logic.near_duplicates import MinHashIndex
+
+
+# A wire story as another site republishes it: a new lead sentence, a
+# sentence dropped and a few words changed.
+def syndicate(text, rnd, edits):
+    sentences = text.split(". ")
+    if len(sentences) > 4:
+        del sentences[rnd.randrange(1, len(sentences))]
+    words = ". ".join(sentences).split(" ")
+    for _ in range(edits):
+        i = rnd.randrange(len(words))
+        words[i] = words[rnd.randrange(len(words))]
+    lead = rnd.choice(["Как сообщает агентство", "По информации источника", "Стало известно"])
+    return lead + ", " + " ".join(words)
+
+
+def index_size(doc_terms):
+    index = BooleanIndex(True)
+    for doc_id, terms in enumerate(doc_terms):
+        if terms:
+            index.add_document(doc_id, terms)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "index.snapshot")
+        index.save_snapshot(path, time.time())
+        return index.get_document_count(), os.path.getsize(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Near-duplicate detection over a corpus with syndicated copies")
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--words", type=int, default=400)
+    parser.add_argument("--copies", type=float, default=0.3, help="share of stories republished by other sites")
+    parser.add_argument("--edits", type=int, default=8)
+    parser.add_argument("--threshold", type=float, default=0.6)
+    parser.add_argument("--hashes", type=int, default=128)
+    parser.add_argument("--bands", type=int, default=32)
+    parser.add_argument("--shingle", type=int, default=3)
+    args = parser.parse_args()
+
+    rnd = random.Random(17)
+    originals = make_corpus(args.docs, args.words, seed=7)
+    texts = [(text, story) for story, text in enumerate(originals)]
+    for story, text in enumerate(originals):
+        if rnd.random() < args.copies:
+            for _ in range(rnd.randint(1, 2)):
+                texts.append((syndicate(text, rnd, args.edits), story))
+    rnd.shuffle(texts)
+    doc_terms = process_documents([text for text, _ in texts])
+    print(f"{args.docs} stories, {len(texts) - args.docs} syndicated copies, {len(texts)} pages")
+
+    started = time.perf_counter()
+    signatures = [minhash(terms, args.hashes, args.shingle) for terms in doc_terms]
+    hashed = time.perf_counter() - started
+
+    index = MinHashIndex(args.threshold, args.hashes, args.bands)
+    kept = []
+    found = wrong = 0
+    started = time.perf_counter()
+    for page, ((_, story), signature) in enumerate(zip(texts, signatures)):
+        match = index.find(signature)
+        if match is None:
+            index.add(page, signature)
+            kept.append(doc_terms[page])
+            continue
+        kept.append([])
+        found += 1
+        if texts[match[0]][1] != story:
+            wrong += 1
+    looked_up = time.perf_counter() - started
+
+    # Every story beyond its first page is a duplicate to be caught.
+    expected = len(texts) - args.docs
+    print(f"minhash:  {hashed / len(texts) * 1e6:6.1f} us/page")
+    print(f"lookup:   {looked_up / len(texts) * 1e6:6.1f} us/page")
+    print(f"found {found} near-duplicates of {expected} ({found / max(expected, 1):.1%}), {wrong} false")
+
+    docs_all, bytes_all = index_size(doc_terms)
+    docs_kept, bytes_kept = index_size(kept)
+    print(f"index, all pages:        {docs_all:7d} docs {bytes_all / 1e6:7.1f} MB")
+    print(f"index, canonical pages:  {docs_kept:7d} docs {bytes_kept / 1e6:7.1f} MB ({1 - bytes_kept / bytes_all:.1%} smaller)")
+
+
+if __name__ == "__main__":
+    main()
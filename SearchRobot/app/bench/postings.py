@@ -0,0 +1,66 @@
+import argparse
+import random
+import sys
+import time
+from bench.corpus import percentile, zipf_corpus
+
+
+def load_index_class(module_dir):
+    if module_dir:
+        sys.path.insert(0, module_dir)
+        from boolean_index_cpp import BooleanIndex
+    else:
+        from cpp.boolean_index_cpp import BooleanIndex
+    return BooleanIndex
+
+
+def make_queries(count, vocab_size, seed):
+    rnd = random.Random(seed)
+    # Head terms are the stop-word-like ones with the longest postings.
+    head = [f"t{rank}" for rank in range(1, 51)]
+    mid = [f"t{rank}" for rank in range(51, min(vocab_size, 2000))]
+    shapes = {
+        "a": lambda: [rnd.choice(head)],
+        "a and b": lambda: [rnd.choice(head), "and", rnd.choice(head)],
+        "a and rare": lambda: [rnd.choice(head), "and", rnd.choice(mid)],
+        "a or b": lambda: [rnd.choice(head), "or", rnd.choice(mid)],
+        "a not b": lambda: [rnd.choice(head), "not", rnd.choice(head)],
+        "not a": lambda: ["not", rnd.choice(mid)],
+        "a and b and rare": lambda: [rnd.choice(head), "and", rnd.choice(head), "and", rnd.choice(mid)],
+        "(a or b) and rare": lambda: ["(", rnd.choice(head), "or", rnd.choice(head), ")", "and", rnd.choice(mid)],
+        '"a b"': lambda: ['"', rnd.choice(head), rnd.choice(head), '"'],
+        "a near/3 b": lambda: [rnd.choice(head), "near", "/3", rnd.choice(mid)],
+    }
+    return {name: [make() for _ in range(count)] for name, make in shapes.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BooleanIndex query latency on a Zipf corpus")
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--vocab", type=int, default=50000)
+    parser.add_argument("--doc-len", type=int, default=120)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--module-dir", help="directory with an alternative boolean_index_cpp build")
+    parser.add_argument("--positions", action="store_true", help="store term positions")
+    args = parser.parse_args()
+
+    index_class = load_index_class(args.module_dir)
+    index = index_class(True) if args.positions else index_class()
+    started = time.perf_counter()
+    for doc_id, terms in zipf_corpus(args.docs, args.vocab, args.doc_len):
+        index.add_document(doc_id, terms)
+    print(f"build: {args.docs} docs in {time.perf_counter() - started:.2f}s, "
+          f"{index.get_term_count()} terms")
+
+    for name, queries in make_queries(args.queries, args.vocab, seed=7).items():
+        samples = []
+        for query in queries:
+            started = time.perf_counter()
+            index.search(query)
+            samples.append((time.perf_counter() - started) * 1000)
+        print(f"{name:>17}: p50 {percentile(samples, 50):8.3f} ms   "
+              f"p99 {percentile(samples, 99):8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import argparse
+import random
+import time
+from bench.corpus import percentile, zipf_corpus
+from bench.postings import load_index_class
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BM25 top-k latency on a Zipf corpus")
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--vocab", type=int, default=50000)
+    parser.add_argument("--doc-len", type=int, default=120)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--module-dir", help="directory with an alternative boolean_index_cpp build")
+    args = parser.parse_args()
+
+    index = load_index_class(args.module_dir)()
+    for doc_id, terms in zipf_corpus(args.docs, args.vocab, args.doc_len):
+        index.add_document(doc_id, terms)
+
+    rnd = random.Random(7)
+    queries = [
+        [f"t{rnd.randint(1, 50)}", f"t{rnd.randint(1, 50)}", f"t{rnd.randint(51, 2000)}"]
+        for _ in range(args.queries)
+    ]
+    # k = docs scores every match, i.e. what a full sort of the result would cost.
+    for k in (10, 100, args.docs):
+        samples = []
+        for query in queries:
+            started = time.perf_counter()
+            index.search_ranked(query, k)
+            samples.append((time.perf_counter() - started) * 1000)
+        print(f"k={k:>6}: p50 {percentile(samples, 50):8.3f} ms   "
+              f"p99 {percentile(samples, 99):8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
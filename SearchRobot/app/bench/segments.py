@@ -0,0 +1,85 @@
+import argparse
+import random
+import threading
+import time
+from bench.concurrency import make_queries
+from bench.corpus import percentile, zipf_corpus, zipf_vocabulary
+from cpp.boolean_index_cpp import BooleanIndex
+from logic.segmented_index import SegmentedIndex
+
+
+def recrawl(index, docs, rounds, batch, doc_len, seed):
+    # Rounds of re-crawled pages (replaced with new text) and new ones,
+    # one tenth each batch; yields the ingest rate of every round.
+    rnd = random.Random(seed)
+    terms, cum_weights = zipf_vocabulary(50000)
+    next_id = docs + 1
+    for _ in range(rounds):
+        ops = []
+        for _ in range(batch):
+            if rnd.random() < 0.1:
+                ops.append(("add", next_id, rnd.choices(terms, cum_weights=cum_weights, k=doc_len)))
+                next_id += 1
+            else:
+                ops.append(("replace", rnd.randint(1, docs), rnd.choices(terms, cum_weights=cum_weights, k=doc_len)))
+        started = time.perf_counter()
+        for start in range(0, batch, 100):
+            index.apply_batch(ops[start:start + 100])
+        yield batch / (time.perf_counter() - started)
+
+
+def run(name, index, args):
+    for start in range(1, args.docs + 1, 1000):
+        index.apply_batch([
+            ("add", start + i - 1, terms)
+            for i, terms in zipf_corpus(min(1000, args.docs - start + 1), 50000, args.doc_len, seed=start)
+        ])
+    queries = make_queries(args.queries, seed=7)
+    samples = []
+    done = threading.Event()
+
+    def reader():
+        i = 0
+        while not done.is_set():
+            started = time.perf_counter()
+            index.search(queries[i % len(queries)])
+            samples.append((time.perf_counter() - started) * 1000)
+            i += 1
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    rates = []
+    try:
+        for rate in recrawl(index, args.docs, args.rounds, args.batch, args.doc_len, seed=3):
+            rates.append(rate)
+    finally:
+        done.set()
+        thread.join()
+    third = max(1, len(rates) // 3)
+    print(f"{name:>10}: ingest {sum(rates[:third]) / third:7.0f} -> {sum(rates[-third:]) / third:7.0f} docs/s   "
+          f"query p50 {percentile(samples, 50):7.2f} ms   p99 {percentile(samples, 99):7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest rate and query latency under sustained re-crawl")
+    parser.add_argument("--docs", type=int, default=50000)
+    parser.add_argument("--doc-len", type=int, default=120)
+    parser.add_argument("--rounds", type=int, default=30)
+    parser.add_argument("--batch", type=int, default=5000, help="pages re-crawled per round")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--buffer-docs", type=int, default=10000)
+    parser.add_argument("--merge-factor", type=int, default=4)
+    args = parser.parse_args()
+
+    run("in place", BooleanIndex(True), args)
+    segmented = SegmentedIndex(True, args.buffer_docs, args.merge_factor)
+    run("segmented", segmented, args)
+    stats = segmented.segment_stats()
+    print(f"{len(stats['segments'])} segments, {stats['flushes']} flushes, {stats['merges']} merges "
+          f"of {stats['merged_docs']} docs in {stats['merge_seconds']} s, "
+          f"{stats['merge_bytes_read'] / 2**20:.0f} MB read, {stats['merge_bytes_written'] / 2**20:.0f} MB written")
+    segmented.close()
+
+
+if __name__ == "__main__":
+    main()
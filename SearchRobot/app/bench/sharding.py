@@ -0,0 +1,79 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from bench.concurrency import make_queries
+from bench.corpus import zipf_vocabulary
+from logic.sharded_index import ShardedIndex
+
+
+class ZipfShardSource:
+    # Every document comes from its own seed, so a shard generates only
+    # its own partition and the build time is the shard's alone.
+    def __init__(self, docs, vocab, doc_len):
+        self.docs = docs
+        self.vocab = vocab
+        self.doc_len = doc_len
+
+    def __call__(self, shard, shards):
+        terms, cum_weights = zipf_vocabulary(self.vocab)
+        for doc_id in range(shard or shards, self.docs + 1, shards):
+            yield doc_id, random.Random(doc_id).choices(terms, cum_weights=cum_weights, k=self.doc_len)
+
+
+def run_clients(index, queries, threads, duration):
+    stop = time.perf_counter() + duration
+    counts = [0] * threads
+
+    def client(slot):
+        i = slot
+        while time.perf_counter() < stop:
+            query = queries[i % len(queries)]
+            if i % 2:
+                index.search_ranked([term for term in query if term not in ("and", "or", "not")], 10)
+            else:
+                index.search(query)
+            i += threads
+            counts[slot] += 1
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(client, range(threads)))
+    return sum(counts) / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build time and query throughput of the index over N shard processes")
+    parser.add_argument("--docs", type=int, default=100000)
+    parser.add_argument("--vocab", type=int, default=50000)
+    parser.add_argument("--doc-len", type=int, default=120)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--threads", type=int, default=8, help="concurrent API threads sending queries")
+    parser.add_argument("--shards", default="1,2,4")
+    args = parser.parse_args()
+
+    source = ZipfShardSource(args.docs, args.vocab, args.doc_len)
+    queries = make_queries(args.queries, seed=7)
+    print(f"{args.docs} docs, {args.threads} client threads, {os.cpu_count()} cpus")
+
+    base = None
+    with tempfile.TemporaryDirectory() as sockets:
+        for shards in [int(s) for s in args.shards.split(",")]:
+            index = ShardedIndex(shards, sockets, source)
+            try:
+                started = time.perf_counter()
+                index.build()
+                build = time.perf_counter() - started
+                qps = run_clients(index, queries, args.threads, args.duration)
+            finally:
+                index.close()
+            if base is None:
+                base = (build, qps)
+            print(f"{shards} shards: build {build:6.2f} s ({base[0] / build:4.2f}x)   "
+                  f"{qps:8.0f} queries/s ({qps / base[1]:4.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import argparse
+import multiprocessing
+import random
+import time
+from collections import Counter
+from itertools import accumulate
+import bson
+from pymongo import MongoClient
+from bench.mongo_standin import serve
+from cpp.text_processor_cpp import process_documents
+from logic.boolean_index import MongoBooleanIndex
+from logic.page_codec import PageCodec
+
+SYLLABLES = ["ка", "ро", "ви", "на", "ло", "ме", "ти", "за", "пе", "ку", "ра", "до", "си", "мо", "те", "ни", "бу", "ле"]
+ENDINGS = ["", "а", "ы", "ов", "ами", "ого", "ому", "ый", "ая", "ие", "ить", "ал", "ет", "ом"]
+
+
+def word_vocabulary(size, seed):
+    rnd = random.Random(seed)
+    words = list(dict.fromkeys(
+        "".join(rnd.choices(SYLLABLES, k=rnd.randint(2, 4))) + rnd.choice(ENDINGS)
+        for _ in range(size * 2)
+    ))[:size]
+    return words, list(accumulate(1.0 / rank for rank in range(1, len(words) + 1)))
+
+
+def news_texts(docs, words_per_doc, vocab, seed):
+    # Zipf-distributed words in sentences. Real text has more repeated
+    # phrases, so it compresses better than this.
+    rnd = random.Random(seed)
+    words, cum_weights = word_vocabulary(vocab, seed)
+    for _ in range(docs):
+        sentences = []
+        left = words_per_doc
+        while left > 0:
+            sentence = rnd.choices(words, cum_weights=cum_weights, k=min(left, rnd.randint(8, 20)))
+            left -= len(sentence)
+            sentences.append(" ".join(sentence).capitalize() + ".")
+        yield " ".join(sentences)
+
+
+def plain_pages(texts, terms):
+    for doc_id, (text, doc_terms) in enumerate(zip(texts, terms), 1):
+        yield {
+            "_id": bson.ObjectId(),
+            "url": f"https://example.com/news/{doc_id}",
+            "normalized_url": f"https://example.com/news/{doc_id}",
+            "domain": "example.com",
+            "title": text[:60],
+            "content": text,
+            "terms": doc_terms,
+            "terms_count": len(doc_terms),
+            "content_hash": "0" * 40,
+            "duplicate_of": None,
+            "doc_id": doc_id,
+        }
+
+
+def compact_pages(pages, codec):
+    return [{**page, "terms": codec.encode_terms(page["terms"]), "content": codec.encode_content(page["content"])}
+            for page in pages]
+
+
+def field_bytes(pages, field):
+    return sum(len(bson.encode({field: page[field]})) - 5 for page in pages)
+
+
+def rebuild(pages, port, collections=None):
+    server = multiprocessing.Process(target=serve, args=(pages, "127.0.0.1", port),
+                                     kwargs={"collections": collections}, daemon=True)
+    server.start()
+    try:
+        time.sleep(0.5)
+        client = MongoClient(f"mongodb://127.0.0.1:{port}/?directConnection=true")
+        client.admin.command("ping")
+        started = time.perf_counter()
+        cpu = time.process_time()
+        index = MongoBooleanIndex(client["search"]["documents"])
+        elapsed = time.perf_counter() - started, time.process_time() - cpu
+        count = index.get_document_count(), index.get_term_count(), index.get_document_terms(1)
+        index.close()
+        client.close()
+        return elapsed, count
+    finally:
+        server.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Size of the pages collection and index rebuild time, plain vs compact")
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--words", type=int, default=400, help="words per page")
+    parser.add_argument("--vocab", type=int, default=50000)
+    parser.add_argument("--zstd-level", type=int, default=3)
+    parser.add_argument("--port", type=int, default=27019)
+    args = parser.parse_args()
+
+    texts = list(news_texts(args.docs, args.words, args.vocab, seed=3))
+    terms = process_documents(texts, 0)
+    plain = list(plain_pages(texts, terms))
+
+    # Ids by frequency, as logic.run_storage_migration assigns them.
+    codec = PageCodec(MongoClient(f"mongodb://127.0.0.1:{args.port}", connect=False)["search"],
+                      compact=True, zstd_level=args.zstd_level)
+    counts = Counter(term for doc_terms in terms for term in doc_terms)
+    dictionary = [{"_id": term_id, "term": term} for term_id, (term, _) in enumerate(counts.most_common())]
+    for entry in dictionary:
+        codec.dictionary._remember(entry["_id"], entry["term"])
+    compact = compact_pages(plain, codec)
+
+    mb = 2 ** 20
+    plain_size = sum(len(bson.encode(page)) for page in plain)
+    compact_size = sum(len(bson.encode(page)) for page in compact)
+    dictionary_size = sum(len(bson.encode(entry)) for entry in dictionary)
+    print(f"{args.docs} pages of {args.words} words, {len(dictionary)} distinct terms")
+    print(f"{'':>8}  {'collection':>10}  {'terms':>8}  {'content':>8}")
+    for name, pages, extra in (("plain", plain, 0), ("compact", compact, dictionary_size)):
+        print(f"{name:>8}  {(sum(len(bson.encode(page)) for page in pages) + extra) / mb:7.1f} MB  "
+              f"{field_bytes(pages, 'terms') / len(pages):6.0f} B  {field_bytes(pages, 'content') / len(pages):6.0f} B")
+    print(f"compact is {compact_size / plain_size:.0%} of plain, plus a {dictionary_size / mb:.1f} MB dictionary")
+
+    (plain_wall, plain_cpu), plain_count = rebuild(plain, args.port)
+    (compact_wall, compact_cpu), compact_count = rebuild(compact, args.port, {"terms": dictionary})
+    assert plain_count == compact_count
+    print(f"rebuild   plain {plain_wall:6.2f} s ({plain_cpu:6.2f} s CPU in the API)   "
+          f"compact {compact_wall:6.2f} s ({compact_cpu:6.2f} s CPU in the API)")
+
+
+if __name__ == "__main__":
+    main()
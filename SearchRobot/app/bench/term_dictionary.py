@@ -0,0 +1,42 @@
+import argparse
+import random
+import time
+from bench.postings import load_index_class
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BooleanIndex term dictionary load test")
+    parser.add_argument("--terms", type=int, default=1_000_000)
+    parser.add_argument("--terms-per-doc", type=int, default=1000)
+    parser.add_argument("--lookups", type=int, default=200_000)
+    parser.add_argument("--module-dir", help="directory with an alternative boolean_index_cpp build")
+    args = parser.parse_args()
+
+    index = load_index_class(args.module_dir)()
+    terms = [f"стем{n}" for n in range(args.terms)]
+
+    started = time.perf_counter()
+    for doc_id, start in enumerate(range(0, args.terms, args.terms_per_doc), start=1):
+        index.add_document(doc_id, terms[start:start + args.terms_per_doc])
+    elapsed = time.perf_counter() - started
+    print(f"insert: {args.terms} distinct terms in {elapsed:.2f}s "
+          f"({args.terms / elapsed:,.0f} terms/s)")
+
+    rnd = random.Random(1)
+    probes = [[rnd.choice(terms)] for _ in range(args.lookups // 2)]
+    probes += [[f"нет{n}"] for n in range(args.lookups // 2)]
+    rnd.shuffle(probes)
+    started = time.perf_counter()
+    for probe in probes:
+        index.search(probe)
+    elapsed = time.perf_counter() - started
+    print(f"lookup: {len(probes)} single-term searches (50% misses) in {elapsed:.2f}s "
+          f"({len(probes) / elapsed:,.0f} lookups/s)")
+
+    started = time.perf_counter()
+    count = index.get_term_count()
+    print(f"term count: {count} in {(time.perf_counter() - started) * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import argparse
+import os
+import random
+import time
+from cpp.text_processor_cpp import Vocabulary, process_document, process_documents
+
+WORDS = [
+    "Футбольный", "матч", "Спартака", "закончился", "победой", "гостей", "тренер",
+    "заявил", "после", "игры", "команда", "сезона", "чемпионата", "России",
+    "Messi", "scored", "twice", "during", "the", "championship", "final", "teams",
+    "и", "в", "на", "что", "по", "голы", "забиты", "минуте", "судья", "назначил",
+]
+
+
+def make_texts(count, words_per_doc, seed):
+    rnd = random.Random(seed)
+    return [
+        " ".join(rnd.choice(WORDS) for _ in range(words_per_doc)) + "."
+        for _ in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="text_processor_cpp batch throughput")
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--words", type=int, default=400)
+    parser.add_argument("--threads", default="1,2,4,8")
+    args = parser.parse_args()
+
+    texts = make_texts(args.docs, args.words, seed=7)
+    mb = sum(len(t.encode("utf-8")) for t in texts) / 1e6
+    print(f"{args.docs} docs, {mb:.1f} MB, {os.cpu_count()} cpus")
+
+    started = time.perf_counter()
+    for text in texts:
+        process_document(text)
+    elapsed = time.perf_counter() - started
+    print(f"process_document loop: {args.docs / elapsed:9.0f} docs/s  {mb / elapsed:6.1f} MB/s")
+
+    for threads in [int(t) for t in args.threads.split(",")]:
+        for mode in ("terms", "ids"):
+            started = time.perf_counter()
+            if mode == "ids":
+                process_documents(texts, threads, Vocabulary())
+            else:
+                process_documents(texts, threads)
+            elapsed = time.perf_counter() - started
+            print(f"{threads:>2} threads {mode:>5}: {args.docs / elapsed:9.0f} docs/s  {mb / elapsed:6.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
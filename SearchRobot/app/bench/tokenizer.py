@@ -0,0 +1,86 @@
+import argparse
+import random
+import sys
+import time
+from itertools import accumulate
+
+RUSSIAN_STEMS = [
+    "матч", "команд", "игрок", "тренер", "сезон", "чемпионат", "победител", "гол",
+    "клуб", "сборн", "турнир", "болельщик", "стадион", "контракт", "трансфер", "судь",
+    "защитник", "нападающ", "вратар", "полузащитник", "финал", "лиг", "очк", "минут",
+    "футбол", "хокке", "баскетбол", "теннис", "соревнован", "результат", "заявлен", "решен",
+]
+RUSSIAN_ENDINGS = ["", "а", "ы", "у", "ом", "ами", "ах", "ой", "ого", "ему", "ие", "ия", "ениях", "ов"]
+ENGLISH_WORDS = [
+    "match", "team", "player", "coach", "season", "league", "goal", "club", "transfer",
+    "final", "scored", "winning", "championship", "stadium", "fans", "contract", "played",
+]
+STOP_WORDS = ["и", "в", "на", "что", "не", "по", "с", "из", "за", "the", "of", "and", "to", "in"]
+
+
+def make_vocabulary(rnd):
+    words = [stem + end for stem in RUSSIAN_STEMS for end in RUSSIAN_ENDINGS]
+    words += ENGLISH_WORDS + [w + "s" for w in ENGLISH_WORDS]
+    rnd.shuffle(words)
+    return STOP_WORDS + words
+
+
+def make_corpus(docs, words_per_doc, seed):
+    rnd = random.Random(seed)
+    vocab = make_vocabulary(rnd)
+    cum_weights = list(accumulate(1.0 / rank for rank in range(1, len(vocab) + 1)))
+    texts = []
+    for _ in range(docs):
+        words = rnd.choices(vocab, cum_weights=cum_weights, k=words_per_doc)
+        sentences = []
+        for i in range(0, len(words), 12):
+            sentence = words[i:i + 12]
+            sentence[0] = sentence[0].capitalize()
+            if rnd.random() < 0.3:
+                sentence.insert(rnd.randrange(len(sentence)), str(rnd.randint(1, 2026)))
+            sentences.append(" ".join(sentence) + rnd.choice([".", "!", "?", "..."]))
+        texts.append(" ".join(sentences))
+    return texts
+
+
+def load_module(module_dir):
+    if module_dir:
+        sys.path.insert(0, module_dir)
+        import text_processor_cpp
+    else:
+        from cpp import text_processor_cpp
+    return text_processor_cpp
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokenizer throughput on a synthetic Russian/English news corpus")
+    parser.add_argument("--docs", type=int, default=3000)
+    parser.add_argument("--words", type=int, default=400)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--module-dir", help="directory with an alternative text_processor_cpp build")
+    args = parser.parse_args()
+
+    module = load_module(args.module_dir)
+    texts = make_corpus(args.docs, args.words, seed=7)
+    mb = sum(len(t.encode("utf-8")) for t in texts) / 1e6
+    print(f"{args.docs} docs, {mb:.1f} MB")
+
+    best = float("inf")
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        for text in texts:
+            module.process_document(text)
+        best = min(best, time.perf_counter() - started)
+    print(f"process_document:   {mb / best:7.1f} MB/s")
+
+    if hasattr(module, "process_documents"):
+        best = float("inf")
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            module.process_documents(texts, 1)
+            best = min(best, time.perf_counter() - started)
+        print(f"process_documents:  {mb / best:7.1f} MB/s (1 thread)")
+
+
+if __name__ == "__main__":
+    main()
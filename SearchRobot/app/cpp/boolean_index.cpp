@@ -1,634 +1,2436 @@
 #include <pybind11/pybind11.h>
 #include <cstring>
 #include <cstdlib>
+#include <cstdint>
+#include <cstdio>
+#include <chrono>
+#include <cmath>
+#include <iterator>
+#include <memory>
+#include <mutex>
+#include <queue>
+#include <shared_mutex>
+#include <string>
+#include <vector>
+#include <algorithm>
+#include <unordered_map>
+#include <unordered_set>
+#include <stdexcept>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 
 namespace py = pybind11;
 
-struct DocNode {
-    int doc_id;
-    DocNode* next;
+static const size_t POSTING_BLOCK_SIZE = 128;
 
-    DocNode(int id) : doc_id(id), next(nullptr) {}
-};
-
-struct TermEntry {
-    char* term;
-    DocNode* docs;
-    TermEntry* next;
+// Document lengths and the forward index are arrays addressed by doc_id,
+// so ids are bounded to keep a stray one from allocating gigabytes.
+static const int MAX_DOC_ID = (1 << 27) - 1;
 
-    TermEntry(const char* t) : docs(nullptr), next(nullptr) {
-        size_t len = strlen(t);
-        term = new char[len + 1];
-        strcpy(term, t);
+static void check_doc_id(int doc_id) {
+    if (doc_id < 0 || doc_id > MAX_DOC_ID) {
+        throw std::invalid_argument("doc_id out of range: " + std::to_string(doc_id));
     }
+}
 
-    ~TermEntry() {
-        delete[] term;
-        DocNode* cur = docs;
-        while (cur) {
-            DocNode* next = cur->next;
-            delete cur;
-            cur = next;
-        }
+static inline void put_varint(std::vector<uint8_t>& out, uint32_t v) {
+    while (v >= 0x80) {
+        out.push_back(static_cast<uint8_t>((v & 0x7F) | 0x80));
+        v >>= 7;
+    }
+    out.push_back(static_cast<uint8_t>(v));
+}
+
+static inline uint32_t get_varint(const uint8_t*& p) {
+    uint32_t v = *p & 0x7F;
+    int shift = 7;
+    while (*p++ & 0x80) {
+        v |= static_cast<uint32_t>(*p & 0x7F) << shift;
+        shift += 7;
     }
+    return v;
+}
+
+// First position in [pos, n) whose value is >= target, probing
+// exponentially before the final binary search.
+static inline size_t gallop(const int* data, size_t pos, size_t n, int target) {
+    if (pos >= n || data[pos] >= target) {
+        return pos;
+    }
+    size_t step = 1;
+    size_t lo = pos;
+    while (pos + step < n && data[pos + step] < target) {
+        lo = pos + step;
+        step <<= 1;
+    }
+    size_t hi = std::min(pos + step + 1, n);
+    return std::lower_bound(data + lo + 1, data + hi, target) - data;
+}
+
+static py::list to_pylist(const std::vector<int>& v) {
+    py::list r;
+    for (int x : v) {
+        r.append(x);
+    }
+    return r;
+}
+
+// Sealed blocks keep their first doc id verbatim, the remaining doc ids as
+// varint deltas and then every term frequency as a varint, all in one shared
+// byte buffer. last_doc doubles as the skip pointer and max_tf bounds the
+// block's contribution to a ranked score. Positions, when stored, live in a
+// separate buffer (per doc: tf varint position deltas) so that doc id scans
+// never touch them.
+struct PostingBlock {
+    int first_doc;
+    int last_doc;
+    uint32_t count;
+    uint32_t offset;
+    uint32_t tf_offset;
+    uint32_t length;
+    uint32_t max_tf;
+    uint32_t pos_offset;
+    uint32_t pos_length;
 };
 
-struct IntArray {
-    int* data = nullptr;
-    size_t size = 0;
-    size_t capacity = 0;
+// Decoded postings of one block (or the unsealed tail). pos holds the
+// encoded position chunks back to back and pos_ends[i] is the end of the
+// i-th document's chunk; both stay empty for non-positional lists.
+struct PostingRun {
+    std::vector<int> docs;
+    std::vector<uint32_t> tfs;
+    std::vector<uint8_t> pos;
+    std::vector<uint32_t> pos_ends;
+
+    size_t size() const {
+        return docs.size();
+    }
 
-    IntArray() {}
+    uint32_t pos_begin(size_t i) const {
+        return i == 0 ? 0 : pos_ends[i - 1];
+    }
 
-    IntArray(const IntArray& other) {
-        size = other.size;
-        capacity = other.capacity;
-        if (capacity > 0) {
-            data = new int[capacity];
-            memcpy(data, other.data, size * sizeof(int));
+    void insert(size_t i, int doc, uint32_t tf, const uint8_t* chunk, size_t chunk_len, bool positional) {
+        docs.insert(docs.begin() + i, doc);
+        tfs.insert(tfs.begin() + i, tf);
+        if (!positional) {
+            return;
+        }
+        uint32_t at = pos_begin(i);
+        pos.insert(pos.begin() + at, chunk, chunk + chunk_len);
+        pos_ends.insert(pos_ends.begin() + i, at);
+        for (size_t j = i; j < pos_ends.size(); ++j) {
+            pos_ends[j] += static_cast<uint32_t>(chunk_len);
         }
     }
 
-    IntArray& operator=(const IntArray& other) {
-        if (this != &other) {
-            delete[] data;
-            size = other.size;
-            capacity = other.capacity;
-            if (capacity > 0) {
-                data = new int[capacity];
-                memcpy(data, other.data, size * sizeof(int));
-            } else {
-                data = nullptr;
-            }
+    void erase(size_t i) {
+        docs.erase(docs.begin() + i);
+        tfs.erase(tfs.begin() + i);
+        if (pos_ends.empty()) {
+            return;
+        }
+        uint32_t from = pos_begin(i);
+        uint32_t len = pos_ends[i] - from;
+        pos.erase(pos.begin() + from, pos.begin() + from + len);
+        pos_ends.erase(pos_ends.begin() + i);
+        for (size_t j = i; j < pos_ends.size(); ++j) {
+            pos_ends[j] -= len;
         }
-        return *this;
     }
 
-    ~IntArray() {
-        delete[] data;
+    void clear() {
+        docs.clear();
+        tfs.clear();
+        pos.clear();
+        pos_ends.clear();
     }
+};
 
-    void push_back(int v) {
-        if (size >= capacity) {
-            size_t new_cap = (capacity == 0) ? 4 : capacity * 2;
-            int* new_data = new int[new_cap];
-            if (data) {
-                memcpy(new_data, data, size * sizeof(int));
-                delete[] data;
-            }
-            data = new_data;
-            capacity = new_cap;
-        }
-        data[size++] = v;
+static void encode_positions(const uint32_t* positions, size_t n, std::vector<uint8_t>& out) {
+    uint32_t prev = 0;
+    for (size_t i = 0; i < n; ++i) {
+        put_varint(out, positions[i] - prev);
+        prev = positions[i];
+    }
+}
+
+static void decode_positions(const uint8_t* p, uint32_t n, std::vector<uint32_t>& out) {
+    out.resize(n);
+    uint32_t pos = 0;
+    for (uint32_t i = 0; i < n; ++i) {
+        pos += get_varint(p);
+        out[i] = pos;
+    }
+}
+
+// Sorted (doc id, tf[, positions]) list: compressed blocks plus an
+// uncompressed tail that absorbs appends until it fills up a block.
+struct PostingList {
+    std::vector<PostingBlock> blocks;
+    std::vector<uint8_t> bytes;
+    std::vector<uint8_t> pos_bytes;
+    PostingRun tail;
+    size_t count = 0;
+    // Upper bound only: it is not lowered when postings are removed.
+    uint32_t max_tf = 0;
+    bool positional = false;
+
+    size_t size() const {
+        return count;
     }
 
-    void sort() {
-        for (size_t i = 0; i < size - 1; ++i) {
-            for (size_t j = 0; j < size - i - 1; ++j) {
-                if (data[j] > data[j + 1]) {
-                    int t = data[j];
-                    data[j] = data[j + 1];
-                    data[j + 1] = t;
-                }
-            }
-        }
+    bool empty() const {
+        return count == 0;
     }
 
-    void clear() {
-        size = 0;
+    int last() const {
+        return tail.docs.empty() ? blocks.back().last_doc : tail.docs.back();
     }
 
-    py::list to_pylist() const {
-        py::list r;
-        for (size_t i = 0; i < size; ++i) {
-            r.append(data[i]);
+    void decode_block(size_t b, std::vector<int>& out) const {
+        const PostingBlock& blk = blocks[b];
+        out.resize(blk.count);
+        const uint8_t* p = bytes.data() + blk.offset;
+        int doc = blk.first_doc;
+        out[0] = doc;
+        for (uint32_t i = 1; i < blk.count; ++i) {
+            doc += static_cast<int>(get_varint(p));
+            out[i] = doc;
         }
-        return r;
     }
-};
 
-struct DocIdSet {
-    int* data = nullptr;
-    size_t size = 0;
-    size_t capacity = 0;
-
-    ~DocIdSet() {
-        delete[] data;
+    void decode_tfs(size_t b, std::vector<uint32_t>& out) const {
+        const PostingBlock& blk = blocks[b];
+        out.resize(blk.count);
+        const uint8_t* p = bytes.data() + blk.tf_offset;
+        for (uint32_t i = 0; i < blk.count; ++i) {
+            out[i] = get_varint(p);
+        }
     }
 
-    bool contains(int v) const {
-        for (size_t i = 0; i < size; ++i) {
-            if (data[i] == v) {
-                return true;
+    // Start of every document's position chunk inside pos_bytes.
+    void position_starts(size_t b, const std::vector<uint32_t>& tfs, std::vector<uint32_t>& out) const {
+        const PostingBlock& blk = blocks[b];
+        out.resize(blk.count);
+        const uint8_t* base = pos_bytes.data();
+        const uint8_t* p = base + blk.pos_offset;
+        for (uint32_t i = 0; i < blk.count; ++i) {
+            out[i] = static_cast<uint32_t>(p - base);
+            for (uint32_t j = 0; j < tfs[i]; ++j) {
+                get_varint(p);
             }
         }
-        return false;
     }
 
-    void insert(int v) {
-        if (contains(v)) {
+    void decode_run(size_t b, PostingRun& run) const {
+        decode_block(b, run.docs);
+        decode_tfs(b, run.tfs);
+        run.pos.clear();
+        run.pos_ends.clear();
+        if (!positional) {
             return;
         }
-        if (size >= capacity) {
-            size_t new_cap = (capacity == 0) ? 4 : capacity * 2;
-            int* new_data = new int[new_cap];
-            if (data) {
-                memcpy(new_data, data, size * sizeof(int));
-                delete[] data;
-            }
-            data = new_data;
-            capacity = new_cap;
+        const PostingBlock& blk = blocks[b];
+        std::vector<uint32_t> starts;
+        position_starts(b, run.tfs, starts);
+        run.pos.assign(pos_bytes.begin() + blk.pos_offset,
+                       pos_bytes.begin() + blk.pos_offset + blk.pos_length);
+        run.pos_ends.resize(blk.count);
+        for (uint32_t i = 0; i < blk.count; ++i) {
+            run.pos_ends[i] = (i + 1 < blk.count ? starts[i + 1] : blk.pos_offset + blk.pos_length)
+                - blk.pos_offset;
         }
-        data[size++] = v;
     }
 
-    void to_array(IntArray& arr) const {
-        arr.clear();
-        for (size_t i = 0; i < size; ++i) {
-            arr.push_back(data[i]);
-        }
-        arr.sort();
+    // Index of the first block whose last doc is >= doc.
+    size_t find_block(int doc, size_t from = 0) const {
+        auto it = std::lower_bound(
+            blocks.begin() + from, blocks.end(), doc,
+            [](const PostingBlock& blk, int d) { return blk.last_doc < d; });
+        return it - blocks.begin();
     }
-};
 
-struct OpTermPair {
-    char op[8];
-    char term[256];
-
-    OpTermPair() {
-        op[0] = '\0';
-        term[0] = '\0';
+    bool contains(int doc) const {
+        if (empty()) {
+            return false;
+        }
+        if (!tail.docs.empty() && doc >= tail.docs.front()) {
+            return std::binary_search(tail.docs.begin(), tail.docs.end(), doc);
+        }
+        size_t b = find_block(doc);
+        if (b == blocks.size() || blocks[b].first_doc > doc) {
+            return false;
+        }
+        std::vector<int> docs;
+        decode_block(b, docs);
+        return std::binary_search(docs.begin(), docs.end(), doc);
     }
 
-    void set(const char* op_str, const char* term_str) {
-        if (op_str) {
-            strncpy(op, op_str, 7);
-            op[7] = '\0';
+    // Positional lists expect tf ascending positions.
+    bool add(int doc, uint32_t tf = 1, const uint32_t* positions = nullptr) {
+        std::vector<uint8_t> chunk;
+        if (positional) {
+            encode_positions(positions, tf, chunk);
         }
-        if (term_str) {
-            strncpy(term, term_str, 255);
-            term[255] = '\0';
+        if (empty() || doc > last()) {
+            push_tail(tail.size(), doc, tf, chunk);
+            return true;
         }
+        if (blocks.empty() || doc > blocks.back().last_doc) {
+            auto it = std::lower_bound(tail.docs.begin(), tail.docs.end(), doc);
+            if (it != tail.docs.end() && *it == doc) {
+                return false;
+            }
+            push_tail(it - tail.docs.begin(), doc, tf, chunk);
+            return true;
+        }
+        size_t b = find_block(doc);
+        PostingRun run;
+        decode_run(b, run);
+        auto it = std::lower_bound(run.docs.begin(), run.docs.end(), doc);
+        if (it != run.docs.end() && *it == doc) {
+            return false;
+        }
+        run.insert(it - run.docs.begin(), doc, tf, chunk.data(), chunk.size(), positional);
+        ++count;
+        max_tf = std::max(max_tf, tf);
+        rewrite_block(b, run);
+        return true;
     }
-};
 
-struct OpTermArray {
-    OpTermPair* data = nullptr;
-    size_t size = 0;
-    size_t capacity = 0;
-
-    ~OpTermArray() {
-        delete[] data;
+    bool remove(int doc) {
+        if (empty()) {
+            return false;
+        }
+        if (!tail.docs.empty() && doc >= tail.docs.front()) {
+            auto it = std::lower_bound(tail.docs.begin(), tail.docs.end(), doc);
+            if (it == tail.docs.end() || *it != doc) {
+                return false;
+            }
+            tail.erase(it - tail.docs.begin());
+            --count;
+            return true;
+        }
+        size_t b = find_block(doc);
+        if (b == blocks.size() || blocks[b].first_doc > doc) {
+            return false;
+        }
+        PostingRun run;
+        decode_run(b, run);
+        auto it = std::lower_bound(run.docs.begin(), run.docs.end(), doc);
+        if (it == run.docs.end() || *it != doc) {
+            return false;
+        }
+        run.erase(it - run.docs.begin());
+        --count;
+        rewrite_block(b, run);
+        return true;
     }
 
-    void push_back(const char* op_str, const char* term_str) {
-        if (size >= capacity) {
-            size_t new_cap = (capacity == 0) ? 4 : capacity * 2;
-            OpTermPair* new_data = new OpTermPair[new_cap];
-            if (data) {
-                for (size_t i = 0; i < size; ++i) {
-                    strcpy(new_data[i].op, data[i].op);
-                    strcpy(new_data[i].term, data[i].term);
-                }
-                delete[] data;
+    template <class F>
+    void for_each(F f) const {
+        std::vector<int> docs;
+        for (size_t b = 0; b < blocks.size(); ++b) {
+            decode_block(b, docs);
+            for (int d : docs) {
+                f(d);
             }
-            data = new_data;
-            capacity = new_cap;
         }
-        data[size++].set(op_str, term_str);
+        for (int d : tail.docs) {
+            f(d);
+        }
     }
-};
 
-class BooleanIndex {
-private:
-    static const size_t HASH_TABLE_SIZE = 10007;
-    TermEntry** hash_table = nullptr;
-    DocIdSet all_doc_ids;
+    void to_vector(std::vector<int>& out) const {
+        out.clear();
+        out.reserve(count);
+        for_each([&out](int d) { out.push_back(d); });
+    }
 
-    size_t string_hash(const char* str) const {
-        if (!str) {
-            return 0;
-        }
-        const size_t FNV_prime = 1099511628211ULL;
-        const size_t FNV_offset_basis = 14695981039346656037ULL;
-        size_t hash = FNV_offset_basis;
-        while (*str) {
-            hash ^= static_cast<unsigned char>(*str++);
-            hash *= FNV_prime;
-        }
-        return hash % HASH_TABLE_SIZE;
+    // Bytes the postings take, the unsealed tail counted as decoded.
+    size_t encoded_bytes() const {
+        return bytes.size() + pos_bytes.size() + blocks.size() * sizeof(PostingBlock)
+            + tail.size() * (sizeof(int) + sizeof(uint32_t)) + tail.pos.size();
     }
 
-    TermEntry* find_term(const char* term) const {
-        if (!term || term[0] == '\0') {
-            return nullptr;
-        }
-        size_t idx = string_hash(term);
-        TermEntry* e = hash_table[idx];
-        while (e) {
-            if (strcmp(e->term, term) == 0) {
-                return e;
-            }
-            e = e->next;
+    // The whole list as one run, in doc id order.
+    void to_run(PostingRun& out) const {
+        out.clear();
+        PostingRun run;
+        for (size_t b = 0; b < blocks.size(); ++b) {
+            decode_run(b, run);
+            append_run(out, run);
         }
-        return nullptr;
+        append_run(out, tail);
     }
 
-    TermEntry* get_or_create_term(const char* term) {
-        if (!term || term[0] == '\0') {
-            return nullptr;
-        }
-        size_t idx = string_hash(term);
-        TermEntry* e = hash_table[idx];
-        TermEntry* prev = nullptr;
-        while (e) {
-            if (strcmp(e->term, term) == 0) {
-                return e;
+    // Rebuilds the list without the given (sorted) doc ids.
+    size_t remove_all(const std::vector<int>& doomed) {
+        PostingRun all;
+        to_run(all);
+        PostingRun kept;
+        for (size_t i = 0; i < all.size(); ++i) {
+            if (!std::binary_search(doomed.begin(), doomed.end(), all.docs[i])) {
+                kept.docs.push_back(all.docs[i]);
+                kept.tfs.push_back(all.tfs[i]);
+                if (positional) {
+                    kept.pos.insert(kept.pos.end(), all.pos.begin() + all.pos_begin(i),
+                                    all.pos.begin() + all.pos_ends[i]);
+                    kept.pos_ends.push_back(static_cast<uint32_t>(kept.pos.size()));
+                }
             }
-            prev = e;
-            e = e->next;
         }
-        TermEntry* ne = new TermEntry(term);
-        if (prev) {
-            prev->next = ne;
-        } else {
-            hash_table[idx] = ne;
+        size_t removed = all.size() - kept.size();
+        if (removed > 0) {
+            assign(kept);
         }
-        return ne;
+        return removed;
     }
 
-    void to_lower(char* s) const {
-        for (size_t i = 0; s[i]; ++i) {
-            if (s[i] >= 'A' && s[i] <= 'Z') {
-                s[i] = static_cast<char>(s[i] - 'A' + 'a');
+    void assign(const PostingRun& run) {
+        bool was_positional = positional;
+        blocks.clear();
+        bytes.clear();
+        pos_bytes.clear();
+        tail.clear();
+        count = 0;
+        max_tf = 0;
+        positional = was_positional;
+        for (size_t i = 0; i < run.size(); ++i) {
+            std::vector<uint8_t> chunk;
+            if (positional) {
+                chunk.assign(run.pos.begin() + run.pos_begin(i), run.pos.begin() + run.pos_ends[i]);
             }
+            push_tail(tail.size(), run.docs[i], run.tfs[i], chunk);
         }
     }
 
-    void set_intersection(const IntArray& a, const IntArray& b, IntArray& res) const {
-        res.clear();
-        size_t i = 0, j = 0;
-        while (i < a.size && j < b.size) {
-            if (a.data[i] < b.data[j]) {
-                ++i;
-            } else if (a.data[i] > b.data[j]) {
-                ++j;
-            } else {
-                res.push_back(a.data[i]);
-                ++i;
-                ++j;
-            }
+private:
+    static void append_run(PostingRun& out, const PostingRun& run) {
+        uint32_t base = static_cast<uint32_t>(out.pos.size());
+        out.docs.insert(out.docs.end(), run.docs.begin(), run.docs.end());
+        out.tfs.insert(out.tfs.end(), run.tfs.begin(), run.tfs.end());
+        out.pos.insert(out.pos.end(), run.pos.begin(), run.pos.end());
+        for (uint32_t end : run.pos_ends) {
+            out.pos_ends.push_back(base + end);
         }
     }
 
-    void set_union(const IntArray& a, const IntArray& b, IntArray& res) const {
-        res.clear();
-        size_t i = 0, j = 0;
-        while (i < a.size && j < b.size) {
-            if (a.data[i] < b.data[j]) {
-                res.push_back(a.data[i]);
-                ++i;
-            } else if (a.data[i] > b.data[j]) {
-                res.push_back(b.data[j]);
-                ++j;
-            } else {
-                res.push_back(a.data[i]);
-                ++i;
-                ++j;
-            }
+    void push_tail(size_t i, int doc, uint32_t tf, const std::vector<uint8_t>& chunk) {
+        tail.insert(i, doc, tf, chunk.data(), chunk.size(), positional);
+        ++count;
+        max_tf = std::max(max_tf, tf);
+        if (tail.size() >= POSTING_BLOCK_SIZE) {
+            blocks.push_back(encode(tail, 0, tail.size(), bytes, pos_bytes));
+            tail.clear();
+        }
+    }
+
+    PostingBlock encode(const PostingRun& run, size_t from, size_t to,
+                        std::vector<uint8_t>& out, std::vector<uint8_t>& pos_out) const {
+        PostingBlock blk;
+        blk.first_doc = run.docs[from];
+        blk.last_doc = run.docs[to - 1];
+        blk.count = static_cast<uint32_t>(to - from);
+        blk.offset = static_cast<uint32_t>(out.size());
+        for (size_t i = from + 1; i < to; ++i) {
+            put_varint(out, static_cast<uint32_t>(run.docs[i] - run.docs[i - 1]));
         }
-        while (i < a.size) {
-            res.push_back(a.data[i++]);
+        blk.tf_offset = static_cast<uint32_t>(out.size());
+        blk.max_tf = 0;
+        for (size_t i = from; i < to; ++i) {
+            put_varint(out, run.tfs[i]);
+            blk.max_tf = std::max(blk.max_tf, run.tfs[i]);
         }
-        while (j < b.size) {
-            res.push_back(b.data[j++]);
+        blk.length = static_cast<uint32_t>(out.size()) - blk.offset;
+        blk.pos_offset = static_cast<uint32_t>(pos_out.size());
+        if (positional) {
+            pos_out.insert(pos_out.end(), run.pos.begin() + run.pos_begin(from),
+                           run.pos.begin() + run.pos_ends[to - 1]);
         }
+        blk.pos_length = static_cast<uint32_t>(pos_out.size()) - blk.pos_offset;
+        return blk;
     }
 
-    void set_difference(const IntArray& a, const IntArray& b, IntArray& res) const {
-        res.clear();
-        size_t i = 0, j = 0;
-        while (i < a.size && j < b.size) {
-            if (a.data[i] < b.data[j]) {
-                res.push_back(a.data[i]);
-                ++i;
-            } else if (a.data[i] > b.data[j]) {
-                ++j;
-            } else {
-                ++i;
-                ++j;
-            }
+    static void splice(std::vector<uint8_t>& buf, uint32_t at, uint32_t old_len,
+                       const std::vector<uint8_t>& fresh) {
+        buf.erase(buf.begin() + at, buf.begin() + at + old_len);
+        buf.insert(buf.begin() + at, fresh.begin(), fresh.end());
+    }
+
+    // Re-encodes block b from run, splitting it in two when it has grown
+    // past twice the block size and dropping it when it became empty.
+    void rewrite_block(size_t b, const PostingRun& run) {
+        std::vector<PostingBlock> fresh;
+        std::vector<uint8_t> encoded;
+        std::vector<uint8_t> encoded_pos;
+        size_t parts = run.size() > 2 * POSTING_BLOCK_SIZE ? 2 : (run.size() == 0 ? 0 : 1);
+        size_t start = 0;
+        uint32_t base = blocks[b].offset;
+        uint32_t pos_base = blocks[b].pos_offset;
+        for (size_t part = 0; part < parts; ++part) {
+            size_t end = (part + 1 == parts) ? run.size() : run.size() / 2;
+            PostingBlock blk = encode(run, start, end, encoded, encoded_pos);
+            blk.offset += base;
+            blk.tf_offset += base;
+            blk.pos_offset += pos_base;
+            fresh.push_back(blk);
+            start = end;
         }
-        while (i < a.size) {
-            res.push_back(a.data[i++]);
+
+        int64_t shift = static_cast<int64_t>(encoded.size()) - blocks[b].length;
+        int64_t pos_shift = static_cast<int64_t>(encoded_pos.size()) - blocks[b].pos_length;
+        splice(bytes, base, blocks[b].length, encoded);
+        splice(pos_bytes, pos_base, blocks[b].pos_length, encoded_pos);
+        for (size_t i = b + 1; i < blocks.size(); ++i) {
+            blocks[i].offset = static_cast<uint32_t>(blocks[i].offset + shift);
+            blocks[i].tf_offset = static_cast<uint32_t>(blocks[i].tf_offset + shift);
+            blocks[i].pos_offset = static_cast<uint32_t>(blocks[i].pos_offset + pos_shift);
         }
+        blocks.erase(blocks.begin() + b);
+        blocks.insert(blocks.begin() + b, fresh.begin(), fresh.end());
+    }
+};
+
+// Forward iterator over a PostingList that decodes one block at a time and
+// uses the block skip pointers to jump ahead in seek(). Term frequencies and
+// positions of a block are only decoded once they are asked for.
+class PostingCursor {
+public:
+    explicit PostingCursor(const PostingList& l) : list(l) {
+        load(0);
     }
 
-    void c_parse_query(const char** tokens, size_t count, OpTermArray& ops) const {
-        char current_op[8] = "AND";
-        for (size_t i = 0; i < count; ++i) {
-            const char* token = tokens[i];
-            if (!token || token[0] == '\0') {
-                continue;
-            }
-            size_t len = std::strlen(token);
-            if (len >= 255) {
-                continue;
-            }
+    bool valid() const {
+        return pos < n;
+    }
 
-            char lower_tok[256];
-            std::strcpy(lower_tok, token);
-            to_lower(lower_tok);
+    int doc() const {
+        return data[pos];
+    }
 
-            if (std::strcmp(lower_tok, "and") == 0 ||
-                std::strcmp(lower_tok, "or") == 0 ||
-                std::strcmp(lower_tok, "not") == 0) {
-                std::strcpy(current_op, lower_tok);
-            } else {
-                ops.push_back(current_op, token);
-                std::strcpy(current_op, "AND");
-            }
+    uint32_t tf() {
+        if (block == list.blocks.size()) {
+            return list.tail.tfs[pos];
         }
+        if (!tfs_loaded) {
+            list.decode_tfs(block, tf_buf);
+            tfs_loaded = true;
+        }
+        return tf_buf[pos];
     }
 
-    void parse_query(const py::list& ql, OpTermArray& ops) const {
-        size_t n = py::len(ql);
-        if (n == 0) {
+    // Positions of the current document; empty for non-positional lists.
+    void positions(std::vector<uint32_t>& out) {
+        out.clear();
+        if (!list.positional) {
+            return;
+        }
+        uint32_t count = tf();
+        if (block == list.blocks.size()) {
+            decode_positions(list.tail.pos.data() + list.tail.pos_begin(pos), count, out);
             return;
         }
+        if (!starts_loaded) {
+            list.position_starts(block, tf_buf, pos_starts);
+            starts_loaded = true;
+        }
+        decode_positions(list.pos_bytes.data() + pos_starts[pos], count, out);
+    }
 
-        char** c_tokens = new char*[n];
-        bool* owns_data = new bool[n];
+    // Largest tf in the current block, the tail counts as one block.
+    uint32_t block_max_tf() const {
+        return block < list.blocks.size() ? list.blocks[block].max_tf : list.max_tf;
+    }
 
-        for (size_t i = 0; i < n; ++i) {
-            py::object item = ql[i];
-            std::string s = item.cast<std::string>();
-            if (s.empty() || s.size() >= 255) {
-                c_tokens[i] = nullptr;
-                owns_data[i] = false;
-            } else {
-                char* buf = new char[s.size() + 1];
-                std::strcpy(buf, s.c_str());
-                c_tokens[i] = buf;
-                owns_data[i] = true;
-            }
+    void next() {
+        if (++pos >= n) {
+            load(block + 1);
         }
+    }
 
-        c_parse_query(const_cast<const char**>(c_tokens), n, ops);
-
-        for (size_t i = 0; i < n; ++i) {
-            if (owns_data[i]) {
-                delete[] c_tokens[i];
+    // Moves to the first doc id >= target.
+    void seek(int target) {
+        if (!valid() || data[pos] >= target) {
+            return;
+        }
+        if (block < list.blocks.size() && list.blocks[block].last_doc < target) {
+            load(list.find_block(target, block + 1));
+            if (!valid() || data[pos] >= target) {
+                return;
             }
         }
-        delete[] c_tokens;
-        delete[] owns_data;
+        pos = gallop(data, pos, n, target);
+        if (pos >= n) {
+            load(block + 1);
+        }
     }
 
-public:
-    BooleanIndex() {
-        hash_table = new TermEntry*[HASH_TABLE_SIZE]();
-        for (size_t i = 0; i < HASH_TABLE_SIZE; ++i) {
-            hash_table[i] = nullptr;
+private:
+    const PostingList& list;
+    std::vector<int> buf;
+    std::vector<uint32_t> tf_buf;
+    std::vector<uint32_t> pos_starts;
+    const int* data = nullptr;
+    size_t block = 0;
+    size_t pos = 0;
+    size_t n = 0;
+    bool tfs_loaded = false;
+    bool starts_loaded = false;
+
+    void load(size_t b) {
+        block = b;
+        pos = 0;
+        tfs_loaded = false;
+        starts_loaded = false;
+        if (b < list.blocks.size()) {
+            list.decode_block(b, buf);
+            data = buf.data();
+            n = buf.size();
+        } else if (b == list.blocks.size()) {
+            data = list.tail.docs.data();
+            n = list.tail.docs.size();
+        } else {
+            data = nullptr;
+            n = 0;
         }
     }
+};
 
-    ~BooleanIndex() {
-        for (size_t i = 0; i < HASH_TABLE_SIZE; ++i) {
-            TermEntry* e = hash_table[i];
-            while (e) {
-                TermEntry* n = e->next;
-                delete e;
-                e = n;
-            }
-        }
-        delete[] hash_table;
+static const uint32_t NO_TERM = UINT32_MAX;
+
+static inline uint64_t term_hash(const char* str, size_t len) {
+    const uint64_t FNV_prime = 1099511628211ULL;
+    uint64_t hash = 14695981039346656037ULL;
+    for (size_t i = 0; i < len; ++i) {
+        hash ^= static_cast<unsigned char>(str[i]);
+        hash *= FNV_prime;
+    }
+    return hash;
+}
+
+// Term -> dense term id map. Open addressing with linear probing over a
+// power-of-two slot table that doubles at 70% load; term bytes are interned
+// NUL-terminated in a single arena. Ids are never reused, so postings can be
+// kept in a plain vector indexed by term id.
+class TermDictionary {
+public:
+    TermDictionary() {
+        reset(1024);
     }
 
+    size_t size() const {
+        return offsets.size();
+    }
 
-    void c_add_document(int doc_id, const char** terms, size_t count) {
-        all_doc_ids.insert(doc_id);
-        for (size_t i = 0; i < count; ++i) {
-            const char* term = terms[i];
-            if (!term || term[0] == '\0') {
-                continue;
-            }
+    const char* term(uint32_t id) const {
+        return arena.data() + offsets[id];
+    }
 
-            TermEntry* e = get_or_create_term(term);
-            if (!e) {
-                continue;
-            }
+    size_t term_length(uint32_t id) const {
+        return lengths[id];
+    }
 
-            DocNode* cur = e->docs;
-            bool already_presented = false;
-            while (cur) {
-                if (cur->doc_id == doc_id) {
-                    already_presented = true;
-                    break;
-                }
-                cur = cur->next;
+    uint32_t find(const char* str, size_t len) const {
+        uint64_t h = term_hash(str, len);
+        uint32_t tag = static_cast<uint32_t>(h >> 32);
+        for (size_t i = h & mask; ; i = (i + 1) & mask) {
+            const Slot& s = slots[i];
+            if (s.id == NO_TERM) {
+                return NO_TERM;
             }
-            
-            if (already_presented) {
-                continue;
+            if (s.tag == tag && matches(s.id, str, len)) {
+                return s.id;
             }
-
-            DocNode* nd = new DocNode(doc_id);
-            nd->next = e->docs;
-            e->docs = nd;
         }
     }
 
-    void add_document(int doc_id, const py::list& terms_list) {
-        size_t n = py::len(terms_list);
-        if (n == 0) {
-            return;
+    uint32_t get_or_create(const char* str, size_t len) {
+        if ((offsets.size() + 1) * 10 > slots.size() * 7) {
+            grow();
         }
-
-        char** c_terms = new char*[n];
-        bool* owns_data = new bool[n];
-
-        for (size_t i = 0; i < n; ++i) {
-            py::object item = terms_list[i];
-            std::string s = item.cast<std::string>();
-            if (s.empty()) {
-                c_terms[i] = nullptr;
-                owns_data[i] = false;
-            } else {
-                char* buf = new char[s.size() + 1];
-                std::strcpy(buf, s.c_str());
-                c_terms[i] = buf;
-                owns_data[i] = true;
+        uint64_t h = term_hash(str, len);
+        uint32_t tag = static_cast<uint32_t>(h >> 32);
+        size_t i = h & mask;
+        for (; slots[i].id != NO_TERM; i = (i + 1) & mask) {
+            if (slots[i].tag == tag && matches(slots[i].id, str, len)) {
+                return slots[i].id;
             }
         }
+        uint32_t id = static_cast<uint32_t>(offsets.size());
+        offsets.push_back(static_cast<uint32_t>(arena.size()));
+        lengths.push_back(static_cast<uint32_t>(len));
+        arena.insert(arena.end(), str, str + len);
+        arena.push_back('\0');
+        slots[i] = Slot{id, tag};
+        return id;
+    }
 
-        c_add_document(doc_id, const_cast<const char**>(c_terms), n);
+    void clear() {
+        arena.clear();
+        arena.shrink_to_fit();
+        offsets.clear();
+        offsets.shrink_to_fit();
+        lengths.clear();
+        lengths.shrink_to_fit();
+        reset(1024);
+    }
 
-        for (size_t i = 0; i < n; ++i) {
-            if (owns_data[i]) {
-                delete[] c_terms[i];
-            }
-        }
-        delete[] c_terms;
-        delete[] owns_data;
+private:
+    struct Slot {
+        uint32_t id;
+        uint32_t tag;
+    };
+
+    std::vector<char> arena;
+    std::vector<uint32_t> offsets;
+    std::vector<uint32_t> lengths;
+    std::vector<Slot> slots;
+    size_t mask = 0;
+
+    bool matches(uint32_t id, const char* str, size_t len) const {
+        return lengths[id] == len && memcmp(arena.data() + offsets[id], str, len) == 0;
     }
 
-    void c_remove_document(int doc_id, const char** terms, size_t count) {
-        bool found_in_all = false;
-        for (size_t i = 0; i < all_doc_ids.size; ++i) {
-            if (all_doc_ids.data[i] == doc_id) {
-                for (size_t j = i; j < all_doc_ids.size - 1; ++j) {
-                    all_doc_ids.data[j] = all_doc_ids.data[j + 1];
-                }
-                --all_doc_ids.size;
-                found_in_all = true;
-                break;
+    void reset(size_t capacity) {
+        slots.assign(capacity, Slot{NO_TERM, 0});
+        mask = capacity - 1;
+    }
+
+    void grow() {
+        reset(slots.size() * 2);
+        for (uint32_t id = 0; id < offsets.size(); ++id) {
+            uint64_t h = term_hash(term(id), lengths[id]);
+            size_t i = h & mask;
+            while (slots[i].id != NO_TERM) {
+                i = (i + 1) & mask;
             }
+            slots[i] = Slot{id, static_cast<uint32_t>(h >> 32)};
         }
+    }
+};
 
-        if (!found_in_all) {
-            return;
-        }
+// Roaring-style set of doc ids: ids are split by their high 16 bits into
+// containers holding the low 16 bits either as a sorted array (sparse) or
+// as a 65536-bit bitmap once a container passes ARRAY_CONTAINER_MAX ids.
+class DocBitmap {
+public:
+    static const size_t ARRAY_CONTAINER_MAX = 4096;
 
-        for (size_t i = 0; i < count; ++i) {
-            const char* term = terms[i];
-            if (!term || term[0] == '\0') continue;
-
-            size_t idx = string_hash(term);
-            TermEntry* e = hash_table[idx];
-            TermEntry* prev_entry = nullptr;
-
-            while (e) {
-                if (strcmp(e->term, term) == 0) {
-                    DocNode* cur = e->docs;
-                    DocNode* prev = nullptr;
-                    while (cur) {
-                        if (cur->doc_id == doc_id) {
-                            if (prev) {
-                                prev->next = cur->next;
-                            } else {
-                                e->docs = cur->next;
-                            }
-                            delete cur;
-                            break;
-                        }
-                        prev = cur;
-                        cur = cur->next;
-                    }
+    size_t size() const {
+        return cardinality;
+    }
 
-                    if (e->docs == nullptr) {
-                        if (prev_entry) {
-                            prev_entry->next = e->next;
-                        } else {
-                            hash_table[idx] = e->next;
-                        }
-                        delete e;
-                    }
-                    break;
-                }
-                prev_entry = e;
-                e = e->next;
-            }
-        }
+    bool contains(int doc) const {
+        uint32_t v = static_cast<uint32_t>(doc);
+        const Container* c = find(static_cast<uint16_t>(v >> 16));
+        return c && c->contains(static_cast<uint16_t>(v & 0xFFFF));
     }
 
-    void remove_document(int doc_id, const py::list& terms_list) {
-        size_t n = py::len(terms_list);
-        if (n == 0) {
-            c_remove_document(doc_id, nullptr, 0);
-            return;
+    bool add(int doc) {
+        uint32_t v = static_cast<uint32_t>(doc);
+        uint16_t key = static_cast<uint16_t>(v >> 16);
+        auto it = lower(key);
+        if (it == containers.end() || it->key != key) {
+            it = containers.insert(it, Container(key));
         }
-
-        char** c_terms = new char*[n];
-        bool* owns_data = new bool[n];
-
-        for (size_t i = 0; i < n; ++i) {
-            py::object item = terms_list[i];
-            std::string s = item.cast<std::string>();
-            if (s.empty()) {
-                c_terms[i] = nullptr;
-                owns_data[i] = false;
-            } else {
-                char* buf = new char[s.size() + 1];
-                std::strcpy(buf, s.c_str());
-                c_terms[i] = buf;
-                owns_data[i] = true;
-            }
+        if (!it->add(static_cast<uint16_t>(v & 0xFFFF))) {
+            return false;
         }
+        ++cardinality;
+        return true;
+    }
 
-        c_remove_document(doc_id, const_cast<const char**>(c_terms), n);
+    bool remove(int doc) {
+        uint32_t v = static_cast<uint32_t>(doc);
+        uint16_t key = static_cast<uint16_t>(v >> 16);
+        auto it = lower(key);
+        if (it == containers.end() || it->key != key || !it->remove(static_cast<uint16_t>(v & 0xFFFF))) {
+            return false;
+        }
+        if (it->cardinality == 0) {
+            containers.erase(it);
+        }
+        --cardinality;
+        return true;
+    }
 
-        for (size_t i = 0; i < n; ++i) {
-            if (owns_data[i]) {
-                delete[] c_terms[i];
+    // Calls f for every doc id in ascending order.
+    template <class F>
+    void for_each(F f) const {
+        for (const Container& c : containers) {
+            int high = static_cast<int>(static_cast<uint32_t>(c.key) << 16);
+            if (c.bits.empty()) {
+                for (uint16_t low : c.array) {
+                    f(high | low);
+                }
+                continue;
+            }
+            for (size_t w = 0; w < c.bits.size(); ++w) {
+                uint64_t word = c.bits[w];
+                while (word) {
+                    int bit = __builtin_ctzll(word);
+                    f(high | static_cast<int>(w * 64 + bit));
+                    word &= word - 1;
+                }
             }
         }
-        delete[] c_terms;
-        delete[] owns_data;
     }
 
-    void c_search(const char** terms, size_t count, IntArray& out_result) const {
-        OpTermArray ops;
-        c_parse_query(terms, count, ops);
+    void to_vector(std::vector<int>& out) const {
+        out.clear();
+        out.reserve(cardinality);
+        for_each([&out](int d) { out.push_back(d); });
+    }
 
-        if (ops.size == 0) {
-            out_result.clear();
-            return;
+    // Walks the ids in ascending order straight from the containers, like
+    // PostingCursor over a posting list. The bitmap must not change while
+    // a cursor is open.
+    class Cursor {
+    public:
+        explicit Cursor(const DocBitmap& b) : bitmap(b) {
+            find_from(0);
         }
 
-        bool first = true;
-        out_result.clear();
+        bool valid() const {
+            return ci < bitmap.containers.size();
+        }
 
-        for (size_t i = 0; i < ops.size; ++i) {
-            const char* op = ops.data[i].op;
-            const char* term = ops.data[i].term;
-            if (!term || term[0] == '\0') {
-                continue;
+        int doc() const {
+            return current;
+        }
+
+        void next() {
+            const Container& c = bitmap.containers[ci];
+            if (c.bits.empty() && ++ai < c.array.size()) {
+                current = (current & ~0xFFFF) | c.array[ai];
+                return;
             }
+            find_from((current & 0xFFFF) + 1);
+        }
 
-            TermEntry* e = find_term(term);
-            IntArray term_docs;
-            if (e) {
-                DocNode* node = e->docs;
-                while (node) {
-                    term_docs.push_back(node->doc_id);
-                    node = node->next;
+        // Moves to the first id >= target.
+        void seek(int target) {
+            if (!valid() || target <= current) {
+                return;
+            }
+            uint32_t v = static_cast<uint32_t>(target);
+            uint16_t key = static_cast<uint16_t>(v >> 16);
+            const auto& containers = bitmap.containers;
+            if (containers[ci].key != key) {
+                ci = std::lower_bound(containers.begin() + ci, containers.end(), key,
+                    [](const Container& c, uint16_t k) { return c.key < k; }) - containers.begin();
+                ai = 0;
+                if (!valid() || containers[ci].key != key) {
+                    find_from(0);
+                    return;
                 }
-                term_docs.sort();
             }
+            find_from(v & 0xFFFF);
+        }
 
-            if (first) {
-                if (std::strcmp(op, "not") == 0) {
-                    IntArray all_docs;
-                    all_doc_ids.to_array(all_docs);
-                    set_difference(all_docs, term_docs, out_result);
-                } else {
-                    out_result = term_docs;
+        // Calls f for the current id and every one after it, leaving the
+        // cursor at the end.
+        template <class F>
+        void for_each_rest(F f) {
+            const auto& containers = bitmap.containers;
+            for (uint32_t from = current & 0xFFFF; ci < containers.size(); ++ci, ai = 0, from = 0) {
+                const Container& c = containers[ci];
+                int high = static_cast<int>(static_cast<uint32_t>(c.key) << 16);
+                if (c.bits.empty()) {
+                    for (size_t i = ai; i < c.array.size(); ++i) {
+                        f(high | c.array[i]);
+                    }
+                    continue;
                 }
-                first = false;
-            } else {
-                if (std::strcmp(op, "and") == 0) {
-                    IntArray inter;
-                    set_intersection(out_result, term_docs, inter);
-                    out_result = inter;
-                } else if (std::strcmp(op, "or") == 0) {
-                    IntArray uni;
-                    set_union(out_result, term_docs, uni);
-                    out_result = uni;
-                } else if (std::strcmp(op, "not") == 0) {
-                    IntArray diff;
-                    set_difference(out_result, term_docs, diff);
-                    out_result = diff;
+                for (size_t w = from >> 6; w < c.bits.size(); ++w) {
+                    uint64_t word = c.bits[w];
+                    if (w == from >> 6) {
+                        word &= ~0ULL << (from & 63);
+                    }
+                    while (word) {
+                        f(high | static_cast<int>(w * 64 + __builtin_ctzll(word)));
+                        word &= word - 1;
+                    }
+                }
+            }
+            current = INT32_MAX;
+        }
+
+    private:
+        const DocBitmap& bitmap;
+        size_t ci = 0;
+        // Position in an array container, a lower bound for the next search.
+        size_t ai = 0;
+        int current = INT32_MAX;
+
+        // Moves to the first id with low bits >= from in the current
+        // container, or else to the first id of a later one.
+        void find_from(uint32_t from) {
+            const auto& containers = bitmap.containers;
+            for (; ci < containers.size(); ++ci, ai = 0, from = 0) {
+                const Container& c = containers[ci];
+                int high = static_cast<int>(static_cast<uint32_t>(c.key) << 16);
+                if (c.bits.empty()) {
+                    auto it = std::lower_bound(c.array.begin() + ai, c.array.end(), from);
+                    if (it != c.array.end()) {
+                        ai = it - c.array.begin();
+                        current = high | *it;
+                        return;
+                    }
+                } else if (from < 65536) {
+                    size_t w = from >> 6;
+                    uint64_t word = c.bits[w] & (~0ULL << (from & 63));
+                    while (!word && ++w < c.bits.size()) {
+                        word = c.bits[w];
+                    }
+                    if (word) {
+                        current = high | static_cast<int>(w * 64 + __builtin_ctzll(word));
+                        return;
+                    }
                 }
             }
+            current = INT32_MAX;
         }
+    };
+
+    void clear() {
+        containers.clear();
+        containers.shrink_to_fit();
+        cardinality = 0;
     }
 
-    py::list search(const py::list& query_terms) {
+private:
+    struct Container {
+        uint16_t key;
+        uint32_t cardinality = 0;
+        std::vector<uint16_t> array;
+        std::vector<uint64_t> bits;
+
+        explicit Container(uint16_t k) : key(k) {}
+
+        bool contains(uint16_t low) const {
+            if (!bits.empty()) {
+                return (bits[low >> 6] >> (low & 63)) & 1;
+            }
+            return std::binary_search(array.begin(), array.end(), low);
+        }
+
+        bool add(uint16_t low) {
+            if (!bits.empty()) {
+                uint64_t mask = 1ULL << (low & 63);
+                if (bits[low >> 6] & mask) {
+                    return false;
+                }
+                bits[low >> 6] |= mask;
+                ++cardinality;
+                return true;
+            }
+            auto it = std::lower_bound(array.begin(), array.end(), low);
+            if (it != array.end() && *it == low) {
+                return false;
+            }
+            array.insert(it, low);
+            ++cardinality;
+            if (array.size() > ARRAY_CONTAINER_MAX) {
+                bits.assign(1024, 0);
+                for (uint16_t v : array) {
+                    bits[v >> 6] |= 1ULL << (v & 63);
+                }
+                array.clear();
+                array.shrink_to_fit();
+            }
+            return true;
+        }
+
+        bool remove(uint16_t low) {
+            if (!bits.empty()) {
+                uint64_t mask = 1ULL << (low & 63);
+                if (!(bits[low >> 6] & mask)) {
+                    return false;
+                }
+                bits[low >> 6] &= ~mask;
+                --cardinality;
+                if (cardinality <= ARRAY_CONTAINER_MAX) {
+                    array.reserve(cardinality);
+                    for (size_t w = 0; w < bits.size(); ++w) {
+                        uint64_t word = bits[w];
+                        while (word) {
+                            array.push_back(static_cast<uint16_t>(w * 64 + __builtin_ctzll(word)));
+                            word &= word - 1;
+                        }
+                    }
+                    bits.clear();
+                    bits.shrink_to_fit();
+                }
+                return true;
+            }
+            auto it = std::lower_bound(array.begin(), array.end(), low);
+            if (it == array.end() || *it != low) {
+                return false;
+            }
+            array.erase(it);
+            --cardinality;
+            return true;
+        }
+    };
+
+    std::vector<Container> containers;
+    size_t cardinality = 0;
+
+    std::vector<Container>::iterator lower(uint16_t key) {
+        return std::lower_bound(containers.begin(), containers.end(), key,
+            [](const Container& c, uint16_t k) { return c.key < k; });
+    }
+
+    const Container* find(uint16_t key) const {
+        auto it = std::lower_bound(containers.begin(), containers.end(), key,
+            [](const Container& c, uint16_t k) { return c.key < k; });
+        return (it != containers.end() && it->key == key) ? &*it : nullptr;
+    }
+};
+
+// A quoted phrase (ordered, adjacent terms) or a NEAR/N group (any order,
+// all terms within a window of N positions).
+struct PhraseSpec {
+    uint32_t slop;
+    bool ordered;
+};
+
+// Parsed boolean query. PHRASE nodes keep their members in query order.
+struct QueryNode {
+    enum Kind { TERM, PHRASE, AND, OR, NOT };
+
+    Kind kind;
+    std::vector<std::string> terms;
+    PhraseSpec spec{0, true};
+    std::vector<QueryNode> children;
+    // Planner's upper bound on the number of matching documents.
+    size_t estimate = 0;
+
+    explicit QueryNode(Kind k = TERM) : kind(k) {}
+};
+
+// Recursive descent over the query tokens:
+//   or   := and ("or" and)*
+//   and  := not (["and"] not)*
+//   not  := "not" not | primary
+//   primary := "(" or ")" | '"' term* '"' | term ("near" "/N" term)*
+// so NOT binds tighter than AND, AND tighter than OR, and adjacent terms
+// are ANDed. Dangling operators and unbalanced parentheses are tolerated.
+class QueryParser {
+public:
+    QueryParser(const char** tokens, size_t count) {
+        for (size_t i = 0; i < count; ++i) {
+            if (!tokens[i] || tokens[i][0] == '\0' || std::strlen(tokens[i]) >= 255) {
+                continue;
+            }
+            raw.push_back(tokens[i]);
+            std::string lower(tokens[i]);
+            for (char& c : lower) {
+                if (c >= 'A' && c <= 'Z') {
+                    c = static_cast<char>(c - 'A' + 'a');
+                }
+            }
+            lowered.push_back(lower);
+        }
+    }
+
+    bool parse(QueryNode& out) {
+        bool found = false;
+        while (pos < raw.size()) {
+            QueryNode part;
+            if (parse_or(part)) {
+                if (found) {
+                    QueryNode both(QueryNode::AND);
+                    both.children.push_back(std::move(out));
+                    both.children.push_back(std::move(part));
+                    out = std::move(both);
+                } else {
+                    out = std::move(part);
+                    found = true;
+                }
+            } else if (pos < raw.size()) {
+                ++pos;  // stray ")"
+            }
+        }
+        return found;
+    }
+
+private:
+    std::vector<const char*> raw;
+    std::vector<std::string> lowered;
+    size_t pos = 0;
+
+    bool at(const char* tok) const {
+        return pos < raw.size() && lowered[pos] == tok;
+    }
+
+    bool is_slop(size_t i) const {
+        return i < raw.size() && raw[i][0] == '/';
+    }
+
+    bool is_word(size_t i) const {
+        if (i >= raw.size()) {
+            return false;
+        }
+        const std::string& t = lowered[i];
+        return t != "and" && t != "or" && t != "not" && t != "(" && t != ")" &&
+               t != "\"" && t[0] != '/';
+    }
+
+    bool parse_or(QueryNode& out) {
+        QueryNode node(QueryNode::OR);
+        while (pos < raw.size()) {
+            if (at("or")) {
+                ++pos;
+                continue;
+            }
+            QueryNode child;
+            if (parse_and(child)) {
+                node.children.push_back(std::move(child));
+            }
+            if (!at("or")) {
+                break;
+            }
+        }
+        return finish(node, out);
+    }
+
+    bool parse_and(QueryNode& out) {
+        QueryNode node(QueryNode::AND);
+        while (pos < raw.size() && !at("or") && !at(")")) {
+            if (at("and")) {
+                ++pos;
+                continue;
+            }
+            QueryNode child;
+            if (parse_not(child)) {
+                node.children.push_back(std::move(child));
+            }
+        }
+        return finish(node, out);
+    }
+
+    bool parse_not(QueryNode& out) {
+        if (!at("not")) {
+            return parse_primary(out);
+        }
+        ++pos;
+        QueryNode child;
+        if (pos >= raw.size() || at("or") || at(")") || !parse_not(child)) {
+            return false;
+        }
+        out = QueryNode(QueryNode::NOT);
+        out.children.push_back(std::move(child));
+        return true;
+    }
+
+    bool parse_primary(QueryNode& out) {
+        if (at("(")) {
+            ++pos;
+            bool found = parse_or(out);
+            if (at(")")) {
+                ++pos;
+            }
+            return found;
+        }
+        if (at("\"")) {
+            ++pos;
+            out = QueryNode(QueryNode::PHRASE);
+            while (pos < raw.size() && !at("\"")) {
+                if (is_word(pos)) {
+                    out.terms.push_back(raw[pos]);
+                }
+                ++pos;
+            }
+            ++pos;
+            return simplify(out);
+        }
+        if (!is_word(pos)) {
+            ++pos;  // stray "/N"
+            return false;
+        }
+        out = QueryNode(QueryNode::TERM);
+        out.terms.push_back(raw[pos++]);
+        while (at("near") && is_slop(pos + 1) && is_word(pos + 2)) {
+            uint32_t slop = static_cast<uint32_t>(std::strtoul(raw[pos + 1] + 1, nullptr, 10));
+            out.kind = QueryNode::PHRASE;
+            out.spec.ordered = false;
+            out.spec.slop = std::max(out.spec.slop, slop);
+            out.terms.push_back(raw[pos + 2]);
+            pos += 3;
+        }
+        return true;
+    }
+
+    static bool simplify(QueryNode& node) {
+        if (node.terms.size() == 1) {
+            node.kind = QueryNode::TERM;
+        }
+        return !node.terms.empty();
+    }
+
+    static bool finish(QueryNode& node, QueryNode& out) {
+        if (node.children.empty()) {
+            return false;
+        }
+        if (node.children.size() == 1) {
+            out = std::move(node.children[0]);
+        } else {
+            out = std::move(node);
+        }
+        return true;
+    }
+};
+
+// Phrase: some p with p + i among the positions of the i-th term.
+static bool phrase_matches(const std::vector<std::vector<uint32_t>>& positions) {
+    for (uint32_t p : positions[0]) {
+        bool ok = true;
+        for (size_t i = 1; i < positions.size() && ok; ++i) {
+            ok = std::binary_search(positions[i].begin(), positions[i].end(), p + static_cast<uint32_t>(i));
+        }
+        if (ok) {
+            return true;
+        }
+    }
+    return false;
+}
+
+// NEAR: the smallest window holding a position of every term spans at most
+// slop positions.
+static bool near_matches(const std::vector<std::vector<uint32_t>>& positions, uint32_t slop) {
+    std::vector<size_t> at(positions.size(), 0);
+    while (true) {
+        size_t lowest = 0;
+        uint32_t lo = UINT32_MAX;
+        uint32_t hi = 0;
+        for (size_t i = 0; i < positions.size(); ++i) {
+            uint32_t p = positions[i][at[i]];
+            if (p < lo) {
+                lo = p;
+                lowest = i;
+            }
+            hi = std::max(hi, p);
+        }
+        if (hi - lo <= slop) {
+            return true;
+        }
+        if (++at[lowest] == positions[lowest].size()) {
+            return false;
+        }
+    }
+}
+
+// Pull-based iterator over the sorted doc ids matched by a query node.
+class DocIterator {
+public:
+    virtual ~DocIterator() {}
+    virtual bool valid() const = 0;
+    virtual int doc() const = 0;
+    virtual void next() = 0;
+    // Moves to the first doc id >= target.
+    virtual void seek(int target) = 0;
+
+    // Appends every remaining doc id.
+    virtual void drain(std::vector<int>& out) {
+        for (; valid(); next()) {
+            out.push_back(doc());
+        }
+    }
+
+    // Keeps the docs (sorted, none behind the iterator) that it matches.
+    virtual void intersect(std::vector<int>& docs) {
+        size_t kept = 0;
+        for (int d : docs) {
+            seek(d);
+            if (!valid()) {
+                break;
+            }
+            if (doc() == d) {
+                docs[kept++] = d;
+            }
+        }
+        docs.resize(kept);
+    }
+};
+
+typedef std::unique_ptr<DocIterator> DocIteratorPtr;
+
+class EmptyIterator : public DocIterator {
+public:
+    bool valid() const override {
+        return false;
+    }
+
+    int doc() const override {
+        return INT32_MAX;
+    }
+
+    void next() override {}
+
+    void seek(int) override {}
+};
+
+class TermIterator : public DocIterator {
+public:
+    explicit TermIterator(const PostingList& list) : cursor(list) {}
+
+    bool valid() const override {
+        return cursor.valid();
+    }
+
+    int doc() const override {
+        return cursor.doc();
+    }
+
+    void next() override {
+        cursor.next();
+    }
+
+    void seek(int target) override {
+        cursor.seek(target);
+    }
+
+    void drain(std::vector<int>& out) override {
+        for (; cursor.valid(); cursor.next()) {
+            out.push_back(cursor.doc());
+        }
+    }
+
+    void intersect(std::vector<int>& docs) override {
+        size_t kept = 0;
+        for (int d : docs) {
+            cursor.seek(d);
+            if (!cursor.valid()) {
+                break;
+            }
+            if (cursor.doc() == d) {
+                docs[kept++] = d;
+            }
+        }
+        docs.resize(kept);
+    }
+
+    void positions(std::vector<uint32_t>& out) {
+        cursor.positions(out);
+    }
+
+private:
+    PostingCursor cursor;
+};
+
+// Every live document.
+class LiveIterator : public DocIterator {
+public:
+    explicit LiveIterator(const DocBitmap& live) : cursor(live) {}
+
+    bool valid() const override {
+        return cursor.valid();
+    }
+
+    int doc() const override {
+        return cursor.doc();
+    }
+
+    void next() override {
+        cursor.next();
+    }
+
+    void seek(int target) override {
+        cursor.seek(target);
+    }
+
+    void drain(std::vector<int>& out) override {
+        cursor.for_each_rest([&out](int d) { out.push_back(d); });
+    }
+
+private:
+    DocBitmap::Cursor cursor;
+};
+
+// Conjunction: leapfrogs the required children (rarest first) and skips
+// docs found in any excluded child, so "x AND NOT y" is a single pass.
+// With a phrase spec the candidates are verified against term positions
+// of members, which are in query order.
+class AndIterator : public DocIterator {
+public:
+    AndIterator(std::vector<DocIteratorPtr> req, std::vector<DocIteratorPtr> exc,
+                std::vector<PostingCursor> exc_terms = {},
+                const PhraseSpec* spec = nullptr, std::vector<TermIterator*> phrase_members = {})
+        : required(std::move(req)), excluded(std::move(exc)), excluded_terms(std::move(exc_terms)),
+          phrase(spec), members(std::move(phrase_members)), positions(members.size()) {
+        settle();
+    }
+
+    bool valid() const override {
+        return !done && required[0]->valid();
+    }
+
+    int doc() const override {
+        return required[0]->doc();
+    }
+
+    void next() override {
+        required[0]->next();
+        settle();
+    }
+
+    void seek(int target) override {
+        if (!valid() || doc() >= target) {
+            return;
+        }
+        required[0]->seek(target);
+        settle();
+    }
+
+    // Batch form of the leapfrog: the rarest child's docs are narrowed by
+    // each other child in turn, stopping as soon as nothing is left.
+    void drain(std::vector<int>& out) override {
+        if (phrase || !valid()) {
+            DocIterator::drain(out);
+            return;
+        }
+        std::vector<int> docs;
+        required[0]->drain(docs);
+        for (size_t i = 1; i < required.size() && !docs.empty(); ++i) {
+            required[i]->intersect(docs);
+        }
+        for (int d : docs) {
+            if (!excluded_contains(d)) {
+                out.push_back(d);
+            }
+        }
+        done = true;
+    }
+
+private:
+    std::vector<DocIteratorPtr> required;
+    std::vector<DocIteratorPtr> excluded;
+    // Negated plain terms, probed without going through DocIterator.
+    std::vector<PostingCursor> excluded_terms;
+    const PhraseSpec* phrase;
+    std::vector<TermIterator*> members;
+    std::vector<std::vector<uint32_t>> positions;
+    bool done = false;
+
+    void settle() {
+        DocIterator& lead = *required[0];
+        while (lead.valid()) {
+            int d = lead.doc();
+            size_t i = 1;
+            for (; i < required.size(); ++i) {
+                required[i]->seek(d);
+                if (!required[i]->valid()) {
+                    done = true;
+                    return;
+                }
+                if (required[i]->doc() != d) {
+                    break;
+                }
+            }
+            if (i < required.size()) {
+                lead.seek(required[i]->doc());
+                continue;
+            }
+            if (!excluded_contains(d) && phrase_ok()) {
+                return;
+            }
+            lead.next();
+        }
+    }
+
+    bool excluded_contains(int d) {
+        for (PostingCursor& cur : excluded_terms) {
+            cur.seek(d);
+            if (cur.valid() && cur.doc() == d) {
+                return true;
+            }
+        }
+        for (DocIteratorPtr& it : excluded) {
+            it->seek(d);
+            if (it->valid() && it->doc() == d) {
+                return true;
+            }
+        }
+        return false;
+    }
+
+    bool phrase_ok() {
+        if (!phrase) {
+            return true;
+        }
+        for (size_t i = 0; i < members.size(); ++i) {
+            members[i]->positions(positions[i]);
+            if (positions[i].empty()) {
+                return false;
+            }
+        }
+        return phrase->ordered ? phrase_matches(positions) : near_matches(positions, phrase->slop);
+    }
+};
+
+class OrIterator : public DocIterator {
+public:
+    explicit OrIterator(std::vector<DocIteratorPtr> c) : children(std::move(c)) {
+        settle();
+    }
+
+    bool valid() const override {
+        return current != INT32_MAX;
+    }
+
+    int doc() const override {
+        return current;
+    }
+
+    void next() override {
+        for (DocIteratorPtr& it : children) {
+            if (it->valid() && it->doc() == current) {
+                it->next();
+            }
+        }
+        settle();
+    }
+
+    void seek(int target) override {
+        if (current >= target) {
+            return;
+        }
+        for (DocIteratorPtr& it : children) {
+            it->seek(target);
+        }
+        settle();
+    }
+
+    void drain(std::vector<int>& out) override {
+        std::vector<int> merged;
+        std::vector<int> part;
+        std::vector<int> step;
+        for (DocIteratorPtr& it : children) {
+            part.clear();
+            it->drain(part);
+            step.clear();
+            std::set_union(merged.begin(), merged.end(), part.begin(), part.end(), std::back_inserter(step));
+            merged.swap(step);
+        }
+        out.insert(out.end(), merged.begin(), merged.end());
+        current = INT32_MAX;
+    }
+
+private:
+    std::vector<DocIteratorPtr> children;
+    int current = INT32_MAX;
+
+    void settle() {
+        current = INT32_MAX;
+        for (DocIteratorPtr& it : children) {
+            if (it->valid() && it->doc() < current) {
+                current = it->doc();
+            }
+        }
+    }
+};
+
+// Live documents that the child does not match, walked straight off the
+// live bitmap.
+class ComplementIterator : public DocIterator {
+public:
+    ComplementIterator(const DocBitmap& live, DocIteratorPtr c) : cursor(live), child(std::move(c)) {
+        settle();
+    }
+
+    bool valid() const override {
+        return cursor.valid();
+    }
+
+    int doc() const override {
+        return cursor.doc();
+    }
+
+    void next() override {
+        cursor.next();
+        settle();
+    }
+
+    void seek(int target) override {
+        cursor.seek(target);
+        settle();
+    }
+
+    void drain(std::vector<int>& out) override {
+        std::vector<int> matched;
+        child->drain(matched);
+        size_t m = 0;
+        cursor.for_each_rest([&](int d) {
+            while (m < matched.size() && matched[m] < d) {
+                ++m;
+            }
+            if (m == matched.size() || matched[m] != d) {
+                out.push_back(d);
+            }
+        });
+    }
+
+private:
+    DocBitmap::Cursor cursor;
+    DocIteratorPtr child;
+
+    void settle() {
+        for (; cursor.valid(); cursor.next()) {
+            child->seek(cursor.doc());
+            if (!child->valid() || child->doc() != cursor.doc()) {
+                return;
+            }
+        }
+    }
+};
+
+// Snapshot layout (little-endian):
+//   magic[8] "BIDXSNP1", u32 version, u32 flags, f64 watermark,
+//   u64 doc_count, u64 term_count,
+//   doc ids as varint deltas followed by their lengths as varints,
+//   per term in sorted order: varint len, bytes, varint df, varint doc id
+//   deltas, varint term frequencies and, with SNAPSHOT_POSITIONS, varint
+//   byte length plus the position deltas of every doc back to back.
+// Version 2 snapshots are the same without flags (always zero).
+static const char SNAPSHOT_MAGIC[8] = {'B', 'I', 'D', 'X', 'S', 'N', 'P', '1'};
+static const uint32_t SNAPSHOT_VERSION = 3;
+static const uint32_t SNAPSHOT_POSITIONS = 1;
+
+struct SnapshotWriter {
+    std::string buf;
+
+    void raw(const void* p, size_t n) {
+        buf.append(static_cast<const char*>(p), n);
+    }
+
+    void varint(uint64_t v) {
+        while (v >= 0x80) {
+            buf.push_back(static_cast<char>((v & 0x7F) | 0x80));
+            v >>= 7;
+        }
+        buf.push_back(static_cast<char>(v));
+    }
+
+    void sorted_ids(const int* ids, size_t n) {
+        varint(n);
+        int prev = 0;
+        for (size_t i = 0; i < n; ++i) {
+            varint(static_cast<uint32_t>(ids[i] - prev));
+            prev = ids[i];
+        }
+    }
+
+    void values(const uint32_t* v, size_t n) {
+        for (size_t i = 0; i < n; ++i) {
+            varint(v[i]);
+        }
+    }
+};
+
+struct SnapshotReader {
+    const uint8_t* p;
+    const uint8_t* end;
+
+    void raw(void* out, size_t n) {
+        if (static_cast<size_t>(end - p) < n) {
+            throw std::runtime_error("truncated index snapshot");
+        }
+        memcpy(out, p, n);
+        p += n;
+    }
+
+    void skip(size_t n) {
+        if (static_cast<size_t>(end - p) < n) {
+            throw std::runtime_error("truncated index snapshot");
+        }
+        p += n;
+    }
+
+    uint64_t varint() {
+        uint64_t v = 0;
+        int shift = 0;
+        while (p < end && shift < 64) {
+            uint8_t b = *p++;
+            v |= static_cast<uint64_t>(b & 0x7F) << shift;
+            if (!(b & 0x80)) {
+                return v;
+            }
+            shift += 7;
+        }
+        throw std::runtime_error("truncated index snapshot");
+    }
+};
+
+struct MappedFile {
+    const uint8_t* data = nullptr;
+    size_t size = 0;
+
+    explicit MappedFile(const std::string& path) {
+        int fd = ::open(path.c_str(), O_RDONLY);
+        if (fd < 0) {
+            throw std::runtime_error("cannot open index snapshot: " + path);
+        }
+        struct stat st;
+        if (fstat(fd, &st) != 0 || st.st_size == 0) {
+            ::close(fd);
+            throw std::runtime_error("empty index snapshot: " + path);
+        }
+        size = static_cast<size_t>(st.st_size);
+        void* m = mmap(nullptr, size, PROT_READ, MAP_PRIVATE, fd, 0);
+        ::close(fd);
+        if (m == MAP_FAILED) {
+            throw std::runtime_error("cannot mmap index snapshot: " + path);
+        }
+        madvise(m, size, MADV_SEQUENTIAL);
+        data = static_cast<const uint8_t*>(m);
+    }
+
+    ~MappedFile() {
+        if (data) {
+            munmap(const_cast<uint8_t*>(data), size);
+        }
+    }
+};
+
+class BooleanIndex {
+private:
+    TermDictionary dictionary;
+    std::vector<PostingList> postings;
+    size_t live_terms = 0;
+    // Live documents per term, the df of BM25: postings of tombstoned
+    // documents stay in the lists until they are purged. Terms with any
+    // are the ones get_term_count counts.
+    std::vector<uint32_t> live_df;
+    size_t searchable_terms = 0;
+    // While apply_batch runs: the terms that got their first live document
+    // or lost their last one, with whether they had any before the batch.
+    bool track_live_changes = false;
+    std::unordered_map<uint32_t, bool> live_changes;
+    DocBitmap live_docs;
+
+    // Removed documents whose postings have not been purged yet; their
+    // term ids stay in the forward index until then. Searches mask them
+    // out via live_docs.
+    static const size_t COMPACTION_THRESHOLD = 4096;
+    std::unordered_set<int> tombstones;
+
+    // Forward index: the sorted term ids of every document that has
+    // postings, live or tombstoned, packed into one array and addressed by
+    // doc_id. A document that outgrows its run is moved to the end, and
+    // the array is repacked once the abandoned runs outweigh the rest.
+    struct ForwardSlot {
+        uint32_t offset = 0;
+        uint32_t length = 0;
+    };
+    static const size_t FORWARD_REPACK_MIN = 1 << 16;
+    std::vector<uint32_t> forward_ids;
+    std::vector<ForwardSlot> forward_slots;
+    size_t forward_garbage = 0;
+
+    // Document lengths (indexed terms, repeats included) for BM25.
+    static constexpr double BM25_K1 = 1.2;
+    static constexpr double BM25_B = 0.75;
+    std::vector<uint32_t> doc_lengths;
+    uint64_t total_length = 0;
+
+    // Whether postings carry term positions for phrase and NEAR queries.
+    bool store_positions;
+
+    // Off for the frozen segments of a SegmentedIndex: their tombstones
+    // are dropped by merges instead of by compactions in the write path.
+    bool auto_compact;
+
+    // Searches share the index, updates take it exclusively. The wrappers
+    // release the GIL before locking and build their Python results only
+    // after unlocking, so nothing waits for the GIL while holding the lock
+    // and a heavy query or a compaction stalls neither the interpreter nor
+    // the other readers.
+    mutable std::shared_mutex mutex;
+    typedef std::shared_lock<std::shared_mutex> ReadLock;
+    typedef std::unique_lock<std::shared_mutex> WriteLock;
+
+    struct RankedTerm {
+        const PostingList* list;
+        double idf;
+        double upper_bound;
+    };
+
+    // Collection statistics of a whole sharded index, which ranked search
+    // on one shard uses instead of its own so that scores from different
+    // shards are comparable.
+    struct CorpusStats {
+        double n_docs;
+        double total_length;
+        std::unordered_map<std::string, double> df;
+    };
+
+    const PostingList* find_term(const char* term) const {
+        if (!term || term[0] == '\0') {
+            return nullptr;
+        }
+        uint32_t id = dictionary.find(term, strlen(term));
+        if (id == NO_TERM || postings[id].empty()) {
+            return nullptr;
+        }
+        return &postings[id];
+    }
+
+    uint32_t get_or_create_term(const char* term, size_t len) {
+        uint32_t id = dictionary.get_or_create(term, len);
+        if (id == postings.size()) {
+            postings.emplace_back();
+            postings.back().positional = store_positions;
+            live_df.push_back(0);
+        }
+        return id;
+    }
+
+    void add_posting(uint32_t id, int doc_id, uint32_t tf, const uint32_t* positions = nullptr) {
+        bool was_empty = postings[id].empty();
+        if (postings[id].add(doc_id, tf, positions)) {
+            add_live_df(id);
+            if (was_empty) {
+                ++live_terms;
+            }
+        }
+    }
+
+    // Tombstoned documents were already taken out of live_df.
+    void remove_posting(uint32_t id, int doc_id) {
+        if (!postings[id].remove(doc_id)) {
+            return;
+        }
+        if (live_docs.contains(doc_id)) {
+            remove_live_df(id);
+        }
+        if (postings[id].empty()) {
+            --live_terms;
+        }
+    }
+
+    void add_live_df(uint32_t id) {
+        if (live_df[id]++ == 0) {
+            ++searchable_terms;
+            if (track_live_changes) {
+                live_changes.emplace(id, false);
+            }
+        }
+    }
+
+    void remove_live_df(uint32_t id) {
+        if (--live_df[id] == 0) {
+            --searchable_terms;
+            if (track_live_changes) {
+                live_changes.emplace(id, true);
+            }
+        }
+    }
+
+    // After a bulk load, when every posting belongs to a live document.
+    void reset_live_df() {
+        live_df.resize(postings.size());
+        searchable_terms = 0;
+        for (uint32_t id = 0; id < postings.size(); ++id) {
+            live_df[id] = static_cast<uint32_t>(postings[id].size());
+            searchable_terms += live_df[id] > 0;
+        }
+    }
+
+    void set_doc_length(int doc_id, uint32_t length) {
+        size_t slot = static_cast<size_t>(doc_id);
+        if (slot >= doc_lengths.size()) {
+            if (length == 0) {
+                return;
+            }
+            doc_lengths.resize(std::max(slot + 1, doc_lengths.size() * 2), 0);
+        }
+        total_length += length;
+        total_length -= doc_lengths[slot];
+        doc_lengths[slot] = length;
+    }
+
+    uint32_t doc_length(int doc_id) const {
+        size_t slot = static_cast<size_t>(doc_id);
+        return slot < doc_lengths.size() ? doc_lengths[slot] : 0;
+    }
+
+    double bm25(double idf, uint32_t tf, uint32_t dl, double avgdl) const {
+        double norm = BM25_K1 * (1.0 - BM25_B + BM25_B * dl / avgdl);
+        return idf * tf * (BM25_K1 + 1.0) / (tf + norm);
+    }
+
+    // Term ids of a document as [first, second). Valid until the forward
+    // index is next modified.
+    std::pair<const uint32_t*, const uint32_t*> forward(int doc_id) const {
+        size_t slot = static_cast<size_t>(doc_id);
+        if (slot >= forward_slots.size()) {
+            return {nullptr, nullptr};
+        }
+        const uint32_t* begin = forward_ids.data() + forward_slots[slot].offset;
+        return {begin, begin + forward_slots[slot].length};
+    }
+
+    bool has_forward(int doc_id) const {
+        size_t slot = static_cast<size_t>(doc_id);
+        return slot < forward_slots.size() && forward_slots[slot].length > 0;
+    }
+
+    void set_forward(int doc_id, const std::vector<uint32_t>& ids) {
+        size_t slot = static_cast<size_t>(doc_id);
+        if (slot >= forward_slots.size()) {
+            if (ids.empty()) {
+                return;
+            }
+            forward_slots.resize(std::max(slot + 1, forward_slots.size() * 2));
+        }
+        ForwardSlot& entry = forward_slots[slot];
+        forward_garbage += entry.length;
+        if (ids.size() > entry.length) {
+            entry.offset = static_cast<uint32_t>(forward_ids.size());
+            forward_ids.insert(forward_ids.end(), ids.begin(), ids.end());
+        } else {
+            std::copy(ids.begin(), ids.end(), forward_ids.begin() + entry.offset);
+            forward_garbage -= ids.size();
+        }
+        entry.length = static_cast<uint32_t>(ids.size());
+        if (forward_garbage >= FORWARD_REPACK_MIN && forward_garbage * 2 > forward_ids.size()) {
+            repack_forward();
+        }
+    }
+
+    void repack_forward() {
+        std::vector<uint32_t> packed;
+        packed.reserve(forward_ids.size() - forward_garbage);
+        for (ForwardSlot& entry : forward_slots) {
+            uint32_t offset = static_cast<uint32_t>(packed.size());
+            packed.insert(packed.end(), forward_ids.begin() + entry.offset,
+                          forward_ids.begin() + entry.offset + entry.length);
+            entry.offset = offset;
+        }
+        forward_ids.swap(packed);
+        forward_garbage = 0;
+    }
+
+    // Derives the forward index from the postings, visiting term ids in
+    // ascending order so every document's run comes out sorted.
+    void rebuild_forward() {
+        forward_slots.clear();
+        for (const PostingList& list : postings) {
+            list.for_each([this](int d) {
+                size_t slot = static_cast<size_t>(d);
+                if (slot >= forward_slots.size()) {
+                    forward_slots.resize(std::max(slot + 1, forward_slots.size() * 2));
+                }
+                ++forward_slots[slot].length;
+            });
+        }
+        uint32_t offset = 0;
+        for (ForwardSlot& entry : forward_slots) {
+            entry.offset = offset;
+            offset += entry.length;
+            entry.length = 0;
+        }
+        forward_ids.assign(offset, 0);
+        forward_garbage = 0;
+        for (uint32_t id = 0; id < postings.size(); ++id) {
+            postings[id].for_each([this, id](int d) {
+                ForwardSlot& entry = forward_slots[d];
+                forward_ids[entry.offset + entry.length++] = id;
+            });
+        }
+    }
+
+    void purge(int doc_id) {
+        if (tombstones.erase(doc_id) == 0) {
+            return;
+        }
+        auto terms = forward(doc_id);
+        for (const uint32_t* id = terms.first; id != terms.second; ++id) {
+            remove_posting(*id, doc_id);
+        }
+        set_forward(doc_id, std::vector<uint32_t>());
+    }
+
+    // Whether the posting of doc_id under term id already has this tf and
+    // these positions.
+    bool posting_matches(uint32_t id, int doc_id, uint32_t tf, const std::vector<uint32_t>& positions) const {
+        PostingCursor cursor(postings[id]);
+        cursor.seek(doc_id);
+        if (!cursor.valid() || cursor.doc() != doc_id || cursor.tf() != tf) {
+            return false;
+        }
+        if (!store_positions) {
+            return true;
+        }
+        std::vector<uint32_t> current;
+        cursor.positions(current);
+        return current == positions;
+    }
+
+    // (term id, position) pairs of a term list, sorted, positions starting
+    // at base.
+    void term_positions(const char** terms, size_t count, uint32_t base,
+                        std::vector<std::pair<uint32_t, uint32_t>>& ids) {
+        ids.clear();
+        ids.reserve(count);
+        for (size_t i = 0; i < count; ++i) {
+            const char* term = terms[i];
+            if (!term || term[0] == '\0') {
+                continue;
+            }
+
+            uint32_t position = base + static_cast<uint32_t>(ids.size());
+            ids.emplace_back(get_or_create_term(term, strlen(term)), position);
+        }
+        std::sort(ids.begin(), ids.end());
+    }
+
+    // Rebuilds pos_ends of a run from its tfs, checking the chunk bounds.
+    static void read_position_ends(PostingRun& run) {
+        const uint8_t* p = run.pos.data();
+        const uint8_t* end = p + run.pos.size();
+        run.pos_ends.resize(run.docs.size());
+        for (size_t i = 0; i < run.docs.size(); ++i) {
+            for (uint32_t j = 0; j < run.tfs[i]; ++j) {
+                while (p < end && (*p & 0x80)) {
+                    ++p;
+                }
+                if (p == end) {
+                    throw std::runtime_error("truncated index snapshot");
+                }
+                ++p;
+            }
+            run.pos_ends[i] = static_cast<uint32_t>(p - run.pos.data());
+        }
+    }
+
+    // Live term ids ordered by term bytes, as stored in snapshots.
+    std::vector<uint32_t> sorted_term_ids() const {
+        std::vector<uint32_t> ids;
+        ids.reserve(live_terms);
+        for (uint32_t id = 0; id < postings.size(); ++id) {
+            if (!postings[id].empty()) {
+                ids.push_back(id);
+            }
+        }
+        std::sort(ids.begin(), ids.end(), [this](uint32_t a, uint32_t b) {
+            return strcmp(dictionary.term(a), dictionary.term(b)) < 0;
+        });
+        return ids;
+    }
+
+    // Fills in estimates bottom-up, flattens nested AND/OR and orders AND
+    // children rarest first, with the negated ones last. Estimates are
+    // upper bounds, so an AND estimated at zero is never evaluated.
+    void plan(QueryNode& node) const {
+        size_t n_docs = live_docs.size();
+        switch (node.kind) {
+        case QueryNode::TERM:
+        case QueryNode::PHRASE:
+            node.estimate = n_docs;
+            for (const std::string& term : node.terms) {
+                const PostingList* list = find_term(term.c_str());
+                node.estimate = std::min(node.estimate, list ? static_cast<size_t>(live_df[list - postings.data()]) : 0);
+            }
+            return;
+        case QueryNode::NOT: {
+            QueryNode& child = node.children[0];
+            plan(child);
+            // Only a plain term gives an exact complement.
+            bool exact = child.kind == QueryNode::TERM;
+            node.estimate = exact ? n_docs - std::min(n_docs, child.estimate) : n_docs;
+            return;
+        }
+        default:
+            break;
+        }
+
+        std::vector<QueryNode> flat;
+        for (QueryNode& child : node.children) {
+            plan(child);
+            if (child.kind == node.kind) {
+                for (QueryNode& grandchild : child.children) {
+                    flat.push_back(std::move(grandchild));
+                }
+            } else {
+                flat.push_back(std::move(child));
+            }
+        }
+        node.children.swap(flat);
+
+        if (node.kind == QueryNode::OR) {
+            node.estimate = 0;
+            for (const QueryNode& child : node.children) {
+                node.estimate += child.estimate;
+            }
+            node.estimate = std::min(node.estimate, n_docs);
+            return;
+        }
+        node.estimate = n_docs;
+        for (const QueryNode& child : node.children) {
+            node.estimate = std::min(node.estimate, child.estimate);
+        }
+        std::stable_sort(node.children.begin(), node.children.end(), [](const QueryNode& a, const QueryNode& b) {
+            bool a_not = a.kind == QueryNode::NOT;
+            bool b_not = b.kind == QueryNode::NOT;
+            if (a_not != b_not) {
+                return b_not;
+            }
+            // A larger exclusion rejects more candidates on the first probe.
+            return a_not ? a.children[0].estimate > b.children[0].estimate : a.estimate < b.estimate;
+        });
+    }
+
+    DocIteratorPtr open(const QueryNode& node) const {
+        switch (node.kind) {
+        case QueryNode::TERM: {
+            const PostingList* list = find_term(node.terms[0].c_str());
+            if (!list) {
+                return DocIteratorPtr(new EmptyIterator());
+            }
+            return DocIteratorPtr(new TermIterator(*list));
+        }
+        case QueryNode::PHRASE:
+            return open_phrase(node);
+        case QueryNode::NOT:
+            return DocIteratorPtr(new ComplementIterator(live_docs, open(node.children[0])));
+        case QueryNode::OR: {
+            std::vector<DocIteratorPtr> children;
+            for (const QueryNode& child : node.children) {
+                if (child.estimate > 0) {
+                    children.push_back(open(child));
+                }
+            }
+            if (children.empty()) {
+                return DocIteratorPtr(new EmptyIterator());
+            }
+            return DocIteratorPtr(new OrIterator(std::move(children)));
+        }
+        default:
+            break;
+        }
+
+        if (node.estimate == 0) {
+            return DocIteratorPtr(new EmptyIterator());
+        }
+        std::vector<DocIteratorPtr> required;
+        std::vector<DocIteratorPtr> excluded;
+        std::vector<PostingCursor> excluded_terms;
+        for (const QueryNode& child : node.children) {
+            if (child.kind == QueryNode::NOT && child.children[0].kind == QueryNode::TERM) {
+                const PostingList* list = find_term(child.children[0].terms[0].c_str());
+                if (list) {
+                    excluded_terms.emplace_back(*list);
+                }
+            } else if (child.kind == QueryNode::NOT) {
+                excluded.push_back(open(child.children[0]));
+            } else {
+                required.push_back(open(child));
+            }
+        }
+        if (required.empty()) {
+            required.push_back(DocIteratorPtr(new LiveIterator(live_docs)));
+        }
+        return DocIteratorPtr(new AndIterator(std::move(required), std::move(excluded), std::move(excluded_terms)));
+    }
+
+    // AND of the member terms, verified against positions when stored.
+    DocIteratorPtr open_phrase(const QueryNode& node) const {
+        std::vector<const PostingList*> lists;
+        for (const std::string& term : node.terms) {
+            const PostingList* list = find_term(term.c_str());
+            if (!list) {
+                return DocIteratorPtr(new EmptyIterator());
+            }
+            lists.push_back(list);
+        }
+        std::vector<size_t> order(lists.size());
+        for (size_t i = 0; i < order.size(); ++i) {
+            order[i] = i;
+        }
+        std::stable_sort(order.begin(), order.end(), [&lists](size_t a, size_t b) {
+            return lists[a]->size() < lists[b]->size();
+        });
+
+        std::vector<TermIterator*> members;
+        for (const PostingList* list : lists) {
+            members.push_back(new TermIterator(*list));
+        }
+        std::vector<DocIteratorPtr> required;
+        for (size_t i : order) {
+            required.push_back(DocIteratorPtr(members[i]));
+        }
+        if (!store_positions) {
+            return DocIteratorPtr(new AndIterator(std::move(required), {}));
+        }
+        return DocIteratorPtr(new AndIterator(std::move(required), {}, {}, &node.spec, members));
+    }
+
+    void evaluate(const QueryNode& node, std::vector<int>& out) const {
+        out.clear();
+        if (node.kind == QueryNode::TERM) {
+            const PostingList* list = find_term(node.terms[0].c_str());
+            if (list) {
+                list->to_vector(out);
+            }
+        } else {
+            open(node)->drain(out);
+        }
+        if (!tombstones.empty()) {
+            out.erase(std::remove_if(out.begin(), out.end(),
+                [this](int d) { return !live_docs.contains(d); }), out.end());
+        }
+    }
+
+    // Number of documents a plan node matches on its own and the time that
+    // took, for every node of a plan.
+    struct NodeProfile {
+        size_t count;
+        double time_ms;
+        std::vector<NodeProfile> children;
+    };
+
+    NodeProfile profile_node(const QueryNode& node) const {
+        std::vector<int> docs;
+        auto started = std::chrono::steady_clock::now();
+        evaluate(node, docs);
+        std::chrono::duration<double, std::milli> elapsed = std::chrono::steady_clock::now() - started;
+        NodeProfile profile{docs.size(), elapsed.count(), {}};
+        for (const QueryNode& child : node.children) {
+            profile.children.push_back(profile_node(child));
+        }
+        return profile;
+    }
+
+    // Plan node with its estimate and profile.
+    static py::dict explain_node(const QueryNode& node, const NodeProfile& profile) {
+        static const char* names[] = {"term", "phrase", "and", "or", "not"};
+        py::dict result;
+        result["op"] = names[node.kind];
+        if (node.kind == QueryNode::TERM) {
+            result["term"] = node.terms[0];
+        } else if (node.kind == QueryNode::PHRASE) {
+            py::list terms;
+            for (const std::string& term : node.terms) {
+                terms.append(py::str(term));
+            }
+            result["terms"] = terms;
+            result["ordered"] = node.spec.ordered;
+            if (!node.spec.ordered) {
+                result["slop"] = node.spec.slop;
+            }
+        }
+        result["estimate"] = node.estimate;
+        result["count"] = profile.count;
+        result["time_ms"] = profile.time_ms;
+
+        if (!node.children.empty()) {
+            py::list children;
+            for (size_t i = 0; i < node.children.size(); ++i) {
+                children.append(explain_node(node.children[i], profile.children[i]));
+            }
+            result["children"] = children;
+        }
+        return result;
+    }
+
+    // Terms that score (those outside any NOT) and terms whose negation
+    // rules documents out (NOT term at the top level of the query).
+    void ranked_terms(const QueryNode& node, bool top, std::vector<const PostingList*>& scored,
+                      std::vector<const PostingList*>& excluded) const {
+        switch (node.kind) {
+        case QueryNode::TERM:
+        case QueryNode::PHRASE:
+            for (const std::string& term : node.terms) {
+                const PostingList* list = find_term(term.c_str());
+                if (list) {
+                    scored.push_back(list);
+                }
+            }
+            return;
+        case QueryNode::NOT:
+            if (top && node.children[0].kind == QueryNode::TERM) {
+                const PostingList* list = find_term(node.children[0].terms[0].c_str());
+                if (list) {
+                    excluded.push_back(list);
+                }
+            }
+            return;
+        default:
+            for (const QueryNode& child : node.children) {
+                ranked_terms(child, top && node.kind == QueryNode::AND, scored, excluded);
+            }
+        }
+    }
+
+public:
+    explicit BooleanIndex(bool store_positions = false, bool auto_compact = true)
+        : store_positions(store_positions), auto_compact(auto_compact) {}
+
+    void c_add_document(int doc_id, const char** terms, size_t count) {
+        purge(doc_id);
+        live_docs.add(doc_id);
+        // Positions continue after any terms the document already has.
+        uint32_t base = doc_length(doc_id);
+        std::vector<std::pair<uint32_t, uint32_t>> ids;
+        term_positions(terms, count, base, ids);
+        set_doc_length(doc_id, base + static_cast<uint32_t>(ids.size()));
+
+        std::vector<uint32_t> term_ids;
+        std::vector<uint32_t> positions;
+        for (size_t i = 0; i < ids.size();) {
+            size_t j = i;
+            positions.clear();
+            while (j < ids.size() && ids[j].first == ids[i].first) {
+                positions.push_back(ids[j].second);
+                ++j;
+            }
+            add_posting(ids[i].first, doc_id, static_cast<uint32_t>(j - i), positions.data());
+            term_ids.push_back(ids[i].first);
+            i = j;
+        }
+
+        auto old = forward(doc_id);
+        if (old.first != old.second) {
+            std::vector<uint32_t> merged;
+            std::set_union(old.first, old.second, term_ids.begin(), term_ids.end(),
+                           std::back_inserter(merged));
+            term_ids.swap(merged);
+        }
+        set_forward(doc_id, term_ids);
+    }
+
+    // Rewrites a live document by diffing its old and new term sets: terms
+    // it lost and gained have their postings removed and added, shared
+    // terms are only rewritten when their tf or positions changed.
+    void c_replace_document(int doc_id, const char** terms, size_t count) {
+        if (!live_docs.contains(doc_id)) {
+            c_add_document(doc_id, terms, count);
+            return;
+        }
+        std::vector<std::pair<uint32_t, uint32_t>> ids;
+        term_positions(terms, count, 0, ids);
+        set_doc_length(doc_id, static_cast<uint32_t>(ids.size()));
+
+        auto range = forward(doc_id);
+        std::vector<uint32_t> old(range.first, range.second);
+        std::vector<uint32_t> term_ids;
+        std::vector<uint32_t> positions;
+        size_t k = 0;
+        for (size_t i = 0; i < ids.size();) {
+            uint32_t id = ids[i].first;
+            size_t j = i;
+            positions.clear();
+            while (j < ids.size() && ids[j].first == id) {
+                positions.push_back(ids[j].second);
+                ++j;
+            }
+            uint32_t tf = static_cast<uint32_t>(j - i);
+            while (k < old.size() && old[k] < id) {
+                remove_posting(old[k++], doc_id);
+            }
+            if (k < old.size() && old[k] == id) {
+                ++k;
+                if (!posting_matches(id, doc_id, tf, positions)) {
+                    remove_posting(id, doc_id);
+                    add_posting(id, doc_id, tf, positions.data());
+                }
+            } else {
+                add_posting(id, doc_id, tf, positions.data());
+            }
+            term_ids.push_back(id);
+            i = j;
+        }
+        while (k < old.size()) {
+            remove_posting(old[k++], doc_id);
+        }
+        set_forward(doc_id, term_ids);
+    }
+
+    void add_document(int doc_id, const py::list& terms_list) {
+        check_doc_id(doc_id);
+        size_t n = py::len(terms_list);
+        if (n == 0) {
+            return;
+        }
+
+        char** c_terms = new char*[n];
+        bool* owns_data = new bool[n];
+
+        for (size_t i = 0; i < n; ++i) {
+            py::object item = terms_list[i];
+            std::string s = item.cast<std::string>();
+            if (s.empty()) {
+                c_terms[i] = nullptr;
+                owns_data[i] = false;
+            } else {
+                char* buf = new char[s.size() + 1];
+                std::strcpy(buf, s.c_str());
+                c_terms[i] = buf;
+                owns_data[i] = true;
+            }
+        }
+
+        {
+            py::gil_scoped_release release;
+            WriteLock lock(mutex);
+            c_add_document(doc_id, const_cast<const char**>(c_terms), n);
+        }
+
+        for (size_t i = 0; i < n; ++i) {
+            if (owns_data[i]) {
+                delete[] c_terms[i];
+            }
+        }
+        delete[] c_terms;
+        delete[] owns_data;
+    }
+
+    void c_remove_document(int doc_id) {
+        if (!live_docs.remove(doc_id)) {
+            return;
+        }
+        set_doc_length(doc_id, 0);
+        if (has_forward(doc_id)) {
+            tombstones.insert(doc_id);
+            auto terms = forward(doc_id);
+            for (const uint32_t* id = terms.first; id != terms.second; ++id) {
+                remove_live_df(*id);
+            }
+        }
+
+        if (auto_compact && tombstones.size() >= COMPACTION_THRESHOLD) {
+            c_compact();
+        }
+    }
+
+    void remove_document(int doc_id) {
+        check_doc_id(doc_id);
+        WriteLock lock(mutex);
+        c_remove_document(doc_id);
+    }
+
+    void c_search(const char** terms, size_t count, std::vector<int>& out_result) const {
+        out_result.clear();
+        QueryNode root;
+        if (!QueryParser(terms, count).parse(root)) {
+            return;
+        }
+        plan(root);
+        evaluate(root, out_result);
+    }
+
+    py::list search(const py::list& query_terms) {
         size_t n = py::len(query_terms);
         char** c_terms = nullptr;
         bool* owns_data = nullptr;
-        IntArray result_docs;
+        std::vector<int> result_docs;
 
         if (n > 0) {
             c_terms = new char*[n];
@@ -648,7 +2450,11 @@ public:
                 }
             }
 
-            c_search(const_cast<const char**>(c_terms), n, result_docs);
+            {
+                py::gil_scoped_release release;
+                ReadLock lock(mutex);
+                c_search(const_cast<const char**>(c_terms), n, result_docs);
+            }
 
             for (size_t i = 0; i < n; ++i) {
                 if (owns_data[i]) {
@@ -667,97 +2473,778 @@ public:
         //     std::sprintf(buf, "doc_%d", result_docs.data[i]);
         //     result.append(std::string(buf)); 
         // }
-        return result_docs.to_pylist();
+        return to_pylist(result_docs);
     }
 
-    int get_document_count() const {
-        return static_cast<int>(all_doc_ids.size);
+    // BM25 over the query terms outside any NOT (operators and phrases do
+    // not restrict matches, NOT terms at the top level exclude documents),
+    // keeping the best k documents in a min-heap. MaxScore: terms are
+    // ordered by score upper bound, and once the heap is full the terms
+    // whose bounds together cannot beat its minimum stop driving candidate
+    // generation and are only probed for documents that still can.
+    void c_search_ranked(const char** terms, size_t count, size_t k,
+                         std::vector<std::pair<int, double>>& out, const CorpusStats* stats = nullptr) const {
+        out.clear();
+        QueryNode root;
+        if (k == 0 || live_docs.size() == 0 || !QueryParser(terms, count).parse(root)) {
+            return;
+        }
+
+        double n_docs = stats ? stats->n_docs : static_cast<double>(live_docs.size());
+        double avgdl = std::max(1.0, (stats ? stats->total_length : static_cast<double>(total_length)) / n_docs);
+        std::vector<const PostingList*> scored;
+        std::vector<const PostingList*> excluded;
+        ranked_terms(root, true, scored, excluded);
+        std::vector<RankedTerm> ranked;
+        for (const PostingList* list : scored) {
+            bool seen = false;
+            for (const RankedTerm& t : ranked) {
+                seen = seen || t.list == list;
+            }
+            if (seen) {
+                continue;
+            }
+            double df = static_cast<double>(live_df[list - postings.data()]);
+            if (stats) {
+                auto it = stats->df.find(dictionary.term(static_cast<uint32_t>(list - postings.data())));
+                if (it != stats->df.end()) {
+                    df = it->second;
+                }
+            }
+            double idf = std::max(0.0, std::log(1.0 + (n_docs - df + 0.5) / (df + 0.5)));
+            // A zero-length document maximises the BM25 term weight.
+            double tf = list->max_tf;
+            double upper = idf * tf * (BM25_K1 + 1.0) / (tf + BM25_K1 * (1.0 - BM25_B));
+            ranked.push_back(RankedTerm{list, idf, upper});
+        }
+        if (ranked.empty()) {
+            return;
+        }
+        std::sort(ranked.begin(), ranked.end(), [](const RankedTerm& a, const RankedTerm& b) {
+            return a.upper_bound < b.upper_bound;
+        });
+
+        size_t n = ranked.size();
+        std::vector<double> prefix(n);
+        std::vector<PostingCursor> cursors;
+        cursors.reserve(n);
+        for (size_t i = 0; i < n; ++i) {
+            prefix[i] = ranked[i].upper_bound + (i > 0 ? prefix[i - 1] : 0.0);
+            cursors.emplace_back(*ranked[i].list);
+        }
+        std::vector<PostingCursor> excluded_cursors;
+        excluded_cursors.reserve(excluded.size());
+        for (const PostingList* list : excluded) {
+            excluded_cursors.emplace_back(*list);
+        }
+
+        // Doc ids are negated so that among equal scores the highest id is
+        // evicted first, keeping every top k a prefix of any deeper one.
+        typedef std::pair<double, int> Scored;
+        std::priority_queue<Scored, std::vector<Scored>, std::greater<Scored>> heap;
+        double threshold = 0.0;
+        size_t first_essential = 0;
+
+        while (true) {
+            int candidate = INT32_MAX;
+            for (size_t i = first_essential; i < n; ++i) {
+                if (cursors[i].valid() && cursors[i].doc() < candidate) {
+                    candidate = cursors[i].doc();
+                }
+            }
+            if (candidate == INT32_MAX) {
+                break;
+            }
+
+            uint32_t dl = doc_length(candidate);
+            double score = 0.0;
+            for (size_t i = first_essential; i < n; ++i) {
+                if (cursors[i].valid() && cursors[i].doc() == candidate) {
+                    score += bm25(ranked[i].idf, cursors[i].tf(), dl, avgdl);
+                    cursors[i].next();
+                }
+            }
+
+            bool rejected = !tombstones.empty() && !live_docs.contains(candidate);
+            for (size_t i = 0; i < excluded_cursors.size() && !rejected; ++i) {
+                excluded_cursors[i].seek(candidate);
+                rejected = excluded_cursors[i].valid() && excluded_cursors[i].doc() == candidate;
+            }
+            if (rejected) {
+                continue;
+            }
+
+            for (size_t i = first_essential; i-- > 0;) {
+                if (heap.size() == k && score + prefix[i] <= threshold) {
+                    break;
+                }
+                cursors[i].seek(candidate);
+                if (cursors[i].valid() && cursors[i].doc() == candidate) {
+                    score += bm25(ranked[i].idf, cursors[i].tf(), dl, avgdl);
+                }
+            }
+
+            if (heap.size() < k) {
+                heap.push(Scored(score, -candidate));
+            } else if (score > threshold) {
+                heap.pop();
+                heap.push(Scored(score, -candidate));
+            } else {
+                continue;
+            }
+            if (heap.size() == k) {
+                threshold = heap.top().first;
+                while (first_essential < n && prefix[first_essential] <= threshold) {
+                    ++first_essential;
+                }
+                if (first_essential == n) {
+                    break;
+                }
+            }
+        }
+
+        out.reserve(heap.size());
+        while (!heap.empty()) {
+            out.emplace_back(-heap.top().second, heap.top().first);
+            heap.pop();
+        }
+        std::sort(out.begin(), out.end(), [](const std::pair<int, double>& a, const std::pair<int, double>& b) {
+            return a.second != b.second ? a.second > b.second : a.first < b.first;
+        });
     }
 
-    int get_term_count() const {
-        int count = 0;
-        for (size_t i = 0; i < HASH_TABLE_SIZE; ++i) {
-            TermEntry* e = hash_table[i];
-            while (e) {
-                ++count;
-                e = e->next;
+    py::list search_ranked(const py::list& query_terms, int k, const py::object& stats) {
+        std::unique_ptr<CorpusStats> corpus;
+        if (!stats.is_none()) {
+            auto parts = stats.cast<py::tuple>();
+            corpus.reset(new CorpusStats{parts[0].cast<double>(), parts[1].cast<double>(), {}});
+            for (auto item : parts[2].cast<py::dict>()) {
+                corpus->df[item.first.cast<std::string>()] = item.second.cast<double>();
             }
         }
-        return count;
+        std::vector<std::string> owned;
+        owned.reserve(py::len(query_terms));
+        for (auto item : query_terms) {
+            owned.push_back(item.cast<std::string>());
+        }
+        std::vector<const char*> c_terms;
+        for (const std::string& s : owned) {
+            c_terms.push_back(s.empty() || s.size() >= 255 ? nullptr : s.c_str());
+        }
+
+        std::vector<std::pair<int, double>> hits;
+        {
+            py::gil_scoped_release release;
+            ReadLock lock(mutex);
+            c_search_ranked(c_terms.data(), c_terms.size(), k > 0 ? static_cast<size_t>(k) : 0, hits, corpus.get());
+        }
+
+        py::list result;
+        for (const auto& hit : hits) {
+            result.append(py::make_tuple(hit.first, hit.second));
+        }
+        return result;
     }
 
-    py::dict get_index_data() const {
-        py::dict terms_dict;
-        for (size_t i = 0; i < HASH_TABLE_SIZE; ++i) {
-            TermEntry* e = hash_table[i];
-            while (e) {
-                py::list doc_list;
-                DocNode* node = e->docs;
-                while (node) {
-                    doc_list.append(node->doc_id);
-                    node = node->next;
+    py::object explain(const py::list& query_terms) const {
+        std::vector<std::string> owned;
+        for (auto item : query_terms) {
+            owned.push_back(item.cast<std::string>());
+        }
+        std::vector<const char*> c_terms;
+        for (const std::string& s : owned) {
+            c_terms.push_back(s.c_str());
+        }
+        QueryNode root;
+        if (!QueryParser(c_terms.data(), c_terms.size()).parse(root)) {
+            return py::none();
+        }
+        NodeProfile profile;
+        {
+            py::gil_scoped_release release;
+            ReadLock lock(mutex);
+            plan(root);
+            profile = profile_node(root);
+        }
+        return explain_node(root, profile);
+    }
+
+    // Applies (op, doc_id, terms) tuples in order, op being "add",
+    // "replace" (a replace with no terms removes) or "remove" (terms
+    // unused). Everything is converted and
+    // validated before the first change, so a malformed batch leaves the
+    // index untouched; before, if given, is called once it is validated and
+    // before the first change. Returns (gained, lost): the terms that had no
+    // live document before the batch and have one now, and the other way
+    // round.
+    py::tuple apply_batch(const py::list& ops_list, const py::object& before) {
+        enum Kind { ADD, REPLACE, REMOVE };
+        struct BatchOp {
+            Kind kind;
+            int doc_id;
+            std::vector<std::string> terms;
+        };
+        std::vector<BatchOp> ops;
+        ops.reserve(py::len(ops_list));
+        for (auto item : ops_list) {
+            py::tuple t = item.cast<py::tuple>();
+            if (t.size() != 3) {
+                throw std::invalid_argument("batch operation must be (op, doc_id, terms)");
+            }
+            std::string kind = t[0].cast<std::string>();
+            if (kind != "add" && kind != "replace" && kind != "remove") {
+                throw std::invalid_argument("unknown batch operation: " + kind);
+            }
+            BatchOp op;
+            op.kind = kind == "add" ? ADD : (kind == "replace" ? REPLACE : REMOVE);
+            op.doc_id = t[1].cast<int>();
+            check_doc_id(op.doc_id);
+            for (auto term : t[2].cast<py::list>()) {
+                op.terms.push_back(term.cast<std::string>());
+            }
+            ops.push_back(std::move(op));
+        }
+        if (!before.is_none()) {
+            before();
+        }
+
+        std::vector<std::string> gained;
+        std::vector<std::string> lost;
+        {
+            py::gil_scoped_release release;
+            WriteLock lock(mutex);
+            live_changes.clear();
+            track_live_changes = true;
+            std::vector<const char*> c_terms;
+            for (const BatchOp& op : ops) {
+                if (op.kind == REMOVE || (op.kind == REPLACE && op.terms.empty())) {
+                    c_remove_document(op.doc_id);
+                    continue;
+                }
+                c_terms.clear();
+                for (const std::string& term : op.terms) {
+                    c_terms.push_back(term.c_str());
+                }
+                if (op.kind == REPLACE) {
+                    c_replace_document(op.doc_id, c_terms.data(), c_terms.size());
+                } else if (!c_terms.empty()) {
+                    c_add_document(op.doc_id, c_terms.data(), c_terms.size());
+                }
+            }
+            track_live_changes = false;
+            for (const auto& change : live_changes) {
+                bool live = live_df[change.first] > 0;
+                if (live != change.second) {
+                    (live ? gained : lost).emplace_back(dictionary.term(change.first));
+                }
+            }
+        }
+        py::list gained_list;
+        py::list lost_list;
+        for (const std::string& term : gained) {
+            gained_list.append(py::str(term));
+        }
+        for (const std::string& term : lost) {
+            lost_list.append(py::str(term));
+        }
+        return py::make_tuple(gained_list, lost_list);
+    }
+
+    void remove_documents(const py::list& doc_ids_list) {
+        std::vector<int> ids;
+        ids.reserve(py::len(doc_ids_list));
+        for (auto item : doc_ids_list) {
+            ids.push_back(item.cast<int>());
+            check_doc_id(ids.back());
+        }
+        if (ids.empty()) {
+            return;
+        }
+
+        py::gil_scoped_release release;
+        WriteLock lock(mutex);
+        for (int doc_id : ids) {
+            c_remove_document(doc_id);
+        }
+        c_compact();
+    }
+
+    // Drops the postings of all tombstoned documents, one pass per term.
+    void c_compact() {
+        std::unordered_map<uint32_t, std::vector<int>> by_term;
+        for (int doc_id : tombstones) {
+            auto terms = forward(doc_id);
+            for (const uint32_t* id = terms.first; id != terms.second; ++id) {
+                by_term[*id].push_back(doc_id);
+            }
+            forward_garbage += forward_slots[doc_id].length;
+            forward_slots[doc_id].length = 0;
+        }
+        for (auto& entry : by_term) {
+            std::vector<int>& docs = entry.second;
+            std::sort(docs.begin(), docs.end());
+            PostingList& list = postings[entry.first];
+            if (!list.empty() && list.remove_all(docs) > 0 && list.empty()) {
+                --live_terms;
+            }
+        }
+        tombstones.clear();
+        if (forward_garbage >= FORWARD_REPACK_MIN && forward_garbage * 2 > forward_ids.size()) {
+            repack_forward();
+        }
+    }
+
+    void compact() {
+        WriteLock lock(mutex);
+        c_compact();
+    }
+
+    struct MergeStats {
+        size_t docs = 0;
+        size_t postings = 0;
+        size_t bytes_read = 0;
+        size_t bytes_written = 0;
+    };
+
+    // Fills this index with the live documents of the sources, which must
+    // not share documents (the segments of a SegmentedIndex). Every term's
+    // posting runs are merged in doc id order, dropping tombstoned
+    // documents. Sources are read-locked one term at a time so that
+    // removals from them are not held up; the live documents are taken at
+    // the start, and removals made later have to be applied to the result.
+    void c_merge(const std::vector<BooleanIndex*>& sources, MergeStats& stats) {
+        c_clear();
+        std::vector<std::vector<int>> live(sources.size());
+        for (size_t s = 0; s < sources.size(); ++s) {
+            const BooleanIndex& source = *sources[s];
+            ReadLock lock(source.mutex);
+            source.live_docs.to_vector(live[s]);
+            for (int doc_id : live[s]) {
+                live_docs.add(doc_id);
+                set_doc_length(doc_id, source.doc_length(doc_id));
+            }
+            for (uint32_t id = 0; id < source.postings.size(); ++id) {
+                if (!source.postings[id].empty()) {
+                    get_or_create_term(source.dictionary.term(id), source.dictionary.term_length(id));
+                }
+            }
+        }
+        stats.docs = live_docs.size();
+
+        std::vector<PostingRun> parts(sources.size());
+        std::vector<size_t> next(sources.size());
+        PostingRun run;
+        PostingRun merged;
+        for (uint32_t id = 0; id < postings.size(); ++id) {
+            const char* term = dictionary.term(id);
+            size_t len = dictionary.term_length(id);
+            for (size_t s = 0; s < sources.size(); ++s) {
+                const BooleanIndex& source = *sources[s];
+                parts[s].clear();
+                next[s] = 0;
+                {
+                    ReadLock lock(source.mutex);
+                    uint32_t source_id = source.dictionary.find(term, len);
+                    if (source_id == NO_TERM || source.postings[source_id].empty()) {
+                        continue;
+                    }
+                    source.postings[source_id].to_run(run);
+                    stats.bytes_read += source.postings[source_id].encoded_bytes();
+                }
+                for (size_t i = 0; i < run.size(); ++i) {
+                    if (std::binary_search(live[s].begin(), live[s].end(), run.docs[i])) {
+                        append_posting(parts[s], run, i);
+                    }
+                }
+            }
+
+            merged.clear();
+            while (true) {
+                size_t best = sources.size();
+                for (size_t s = 0; s < sources.size(); ++s) {
+                    if (next[s] < parts[s].size()
+                            && (best == sources.size() || parts[s].docs[next[s]] < parts[best].docs[next[best]])) {
+                        best = s;
+                    }
                 }
-                terms_dict[py::str(e->term)] = doc_list;
-                e = e->next;
+                if (best == sources.size()) {
+                    break;
+                }
+                append_posting(merged, parts[best], next[best]++);
+            }
+            if (!merged.docs.empty()) {
+                postings[id].assign(merged);
+                ++live_terms;
+                stats.postings += merged.size();
+                stats.bytes_written += postings[id].encoded_bytes();
+            }
+        }
+        reset_live_df();
+        rebuild_forward();
+    }
+
+    static void append_posting(PostingRun& out, const PostingRun& run, size_t i) {
+        out.docs.push_back(run.docs[i]);
+        out.tfs.push_back(run.tfs[i]);
+        if (!run.pos_ends.empty()) {
+            out.pos.insert(out.pos.end(), run.pos.begin() + run.pos_begin(i), run.pos.begin() + run.pos_ends[i]);
+            out.pos_ends.push_back(static_cast<uint32_t>(out.pos.size()));
+        }
+    }
+
+    py::dict merge(const py::list& sources_list) {
+        std::vector<BooleanIndex*> sources;
+        for (auto item : sources_list) {
+            BooleanIndex* source = item.cast<BooleanIndex*>();
+            if (source == this) {
+                throw std::invalid_argument("an index cannot be merged into itself");
             }
+            if (source->store_positions != store_positions) {
+                throw std::invalid_argument("cannot merge indexes with and without positions");
+            }
+            sources.push_back(source);
+        }
+        MergeStats stats;
+        {
+            py::gil_scoped_release release;
+            WriteLock lock(mutex);
+            c_merge(sources, stats);
         }
-        IntArray all_docs;
-        all_doc_ids.to_array(all_docs);
         py::dict result;
-        result["documents"] = all_docs.to_pylist();
-        result["terms"] = terms_dict;
-        result["doc_count"] = py::int_(static_cast<int>(all_doc_ids.size));
-        result["term_count"] = py::int_(get_term_count());
+        result["docs"] = stats.docs;
+        result["postings"] = stats.postings;
+        result["bytes_read"] = stats.bytes_read;
+        result["bytes_written"] = stats.bytes_written;
         return result;
     }
 
-    py::list get_document_terms(int doc_id) const {
-        py::list result;
-        for (size_t i = 0; i < HASH_TABLE_SIZE; ++i) {
-            TermEntry* e = hash_table[i];
-            while (e) {
-                DocNode* node = e->docs;
-                while (node) {
-                    if (node->doc_id == doc_id) {
-                        result.append(py::str(e->term));
-                        break;
+    py::dict storage_stats() const {
+        size_t posting_bytes = 0;
+        size_t docs = 0;
+        size_t tombstone_count = 0;
+        size_t terms = 0;
+        {
+            py::gil_scoped_release release;
+            ReadLock lock(mutex);
+            for (const PostingList& list : postings) {
+                posting_bytes += list.encoded_bytes();
+            }
+            docs = live_docs.size();
+            tombstone_count = tombstones.size();
+            terms = live_terms;
+        }
+        py::dict result;
+        result["docs"] = docs;
+        result["tombstones"] = tombstone_count;
+        result["terms"] = terms;
+        result["posting_bytes"] = posting_bytes;
+        return result;
+    }
+
+    void c_save_snapshot(double watermark, SnapshotWriter& w) {
+        c_compact();
+        std::vector<uint32_t> terms = sorted_term_ids();
+
+        uint32_t version = SNAPSHOT_VERSION;
+        uint32_t flags = store_positions ? SNAPSHOT_POSITIONS : 0;
+        uint64_t doc_count = live_docs.size();
+        uint64_t term_count = terms.size();
+        w.raw(SNAPSHOT_MAGIC, sizeof(SNAPSHOT_MAGIC));
+        w.raw(&version, sizeof(version));
+        w.raw(&flags, sizeof(flags));
+        w.raw(&watermark, sizeof(watermark));
+        w.raw(&doc_count, sizeof(doc_count));
+        w.raw(&term_count, sizeof(term_count));
+
+        std::vector<int> ids;
+        PostingRun run;
+        live_docs.to_vector(ids);
+        w.sorted_ids(ids.data(), ids.size());
+        for (int doc_id : ids) {
+            w.varint(doc_length(doc_id));
+        }
+
+        for (uint32_t id : terms) {
+            size_t len = dictionary.term_length(id);
+            w.varint(len);
+            w.raw(dictionary.term(id), len);
+            postings[id].to_run(run);
+            w.sorted_ids(run.docs.data(), run.docs.size());
+            w.values(run.tfs.data(), run.tfs.size());
+            if (store_positions) {
+                w.varint(run.pos.size());
+                w.raw(run.pos.data(), run.pos.size());
+            }
+        }
+    }
+
+    void save_snapshot(const std::string& path, double watermark) {
+        SnapshotWriter w;
+        {
+            WriteLock lock(mutex);
+            c_save_snapshot(watermark, w);
+        }
+
+        std::string tmp_path = path + ".tmp";
+        FILE* f = fopen(tmp_path.c_str(), "wb");
+        if (!f) {
+            throw std::runtime_error("cannot write index snapshot: " + tmp_path);
+        }
+        size_t written = fwrite(w.buf.data(), 1, w.buf.size(), f);
+        bool ok = written == w.buf.size() && fflush(f) == 0 && fsync(fileno(f)) == 0;
+        ok = (fclose(f) == 0) && ok;
+        if (!ok || rename(tmp_path.c_str(), path.c_str()) != 0) {
+            unlink(tmp_path.c_str());
+            throw std::runtime_error("cannot write index snapshot: " + path);
+        }
+    }
+
+    double load_snapshot(const std::string& path) {
+        WriteLock lock(mutex);
+        MappedFile file(path);
+        SnapshotReader r{file.data, file.data + file.size};
+
+        char magic[sizeof(SNAPSHOT_MAGIC)];
+        uint32_t version = 0;
+        uint32_t flags = 0;
+        double watermark = 0.0;
+        uint64_t doc_count = 0;
+        uint64_t term_count = 0;
+        r.raw(magic, sizeof(magic));
+        r.raw(&version, sizeof(version));
+        if (memcmp(magic, SNAPSHOT_MAGIC, sizeof(magic)) != 0 || version < 2 || version > SNAPSHOT_VERSION) {
+            throw std::runtime_error("not an index snapshot: " + path);
+        }
+        r.raw(&flags, sizeof(flags));
+        bool has_positions = (flags & SNAPSHOT_POSITIONS) != 0;
+        if (store_positions && !has_positions) {
+            throw std::runtime_error("index snapshot has no term positions: " + path);
+        }
+        r.raw(&watermark, sizeof(watermark));
+        r.raw(&doc_count, sizeof(doc_count));
+        r.raw(&term_count, sizeof(term_count));
+
+        c_clear();
+
+        size_t n = r.varint();
+        if (n != doc_count) {
+            throw std::runtime_error("corrupted index snapshot: " + path);
+        }
+        std::vector<int> ids(n);
+        int prev = 0;
+        for (size_t i = 0; i < n; ++i) {
+            prev += static_cast<int>(r.varint());
+            ids[i] = prev;
+            live_docs.add(prev);
+        }
+        for (size_t i = 0; i < n; ++i) {
+            set_doc_length(ids[i], static_cast<uint32_t>(r.varint()));
+        }
+
+        std::string term;
+        PostingRun run;
+        for (uint64_t t = 0; t < term_count; ++t) {
+            size_t len = r.varint();
+            term.resize(len);
+            r.raw(&term[0], len);
+            size_t df = r.varint();
+            uint32_t id = get_or_create_term(term.data(), len);
+            run.clear();
+            run.docs.resize(df);
+            run.tfs.resize(df);
+            prev = 0;
+            for (size_t i = 0; i < df; ++i) {
+                prev += static_cast<int>(r.varint());
+                run.docs[i] = prev;
+            }
+            for (size_t i = 0; i < df; ++i) {
+                run.tfs[i] = static_cast<uint32_t>(r.varint());
+            }
+            if (has_positions) {
+                size_t pos_len = r.varint();
+                if (store_positions) {
+                    run.pos.resize(pos_len);
+                    r.raw(run.pos.data(), pos_len);
+                    read_position_ends(run);
+                } else {
+                    r.skip(pos_len);
+                }
+            }
+            if (df > 0 && postings[id].empty()) {
+                postings[id].assign(run);
+                ++live_terms;
+            }
+        }
+        reset_live_df();
+        rebuild_forward();
+        return watermark;
+    }
+
+    // (documents, total length, {term: document frequency}) for the terms of
+    // a query found here; the sums over all shards are the CorpusStats
+    // passed back to search_ranked.
+    py::tuple term_stats(const py::list& query_terms) const {
+        std::vector<std::string> owned;
+        for (auto item : query_terms) {
+            owned.push_back(item.cast<std::string>());
+        }
+        std::vector<uint32_t> counts(owned.size(), 0);
+        size_t n_docs = 0;
+        uint64_t length = 0;
+        {
+            py::gil_scoped_release release;
+            ReadLock lock(mutex);
+            for (size_t i = 0; i < owned.size(); ++i) {
+                const PostingList* list = find_term(owned[i].c_str());
+                if (list) {
+                    counts[i] = live_df[list - postings.data()];
+                }
+            }
+            n_docs = live_docs.size();
+            length = total_length;
+        }
+        py::dict df;
+        for (size_t i = 0; i < owned.size(); ++i) {
+            if (counts[i] > 0) {
+                df[py::str(owned[i])] = py::int_(counts[i]);
+            }
+        }
+        return py::make_tuple(n_docs, length, df);
+    }
+
+    py::list get_terms() const {
+        std::vector<std::string> found;
+        {
+            py::gil_scoped_release release;
+            ReadLock lock(mutex);
+            found.reserve(searchable_terms);
+            for (uint32_t id = 0; id < postings.size(); ++id) {
+                if (live_df[id] > 0) {
+                    found.emplace_back(dictionary.term(id), dictionary.term_length(id));
+                }
+            }
+        }
+        py::list terms;
+        for (const std::string& term : found) {
+            terms.append(py::str(term));
+        }
+        return terms;
+    }
+
+    int get_document_count() const {
+        ReadLock lock(mutex);
+        return static_cast<int>(live_docs.size());
+    }
+
+    int get_term_count() const {
+        ReadLock lock(mutex);
+        return static_cast<int>(searchable_terms);
+    }
+
+    py::dict get_index_data() const {
+        std::vector<std::pair<std::string, std::vector<int>>> term_docs;
+        std::vector<int> all_docs;
+        size_t term_count = 0;
+        {
+            py::gil_scoped_release release;
+            ReadLock lock(mutex);
+            std::vector<int> docs;
+            for (uint32_t id = 0; id < postings.size(); ++id) {
+                if (postings[id].empty()) {
+                    continue;
+                }
+                postings[id].to_vector(docs);
+                if (!tombstones.empty()) {
+                    docs.erase(std::remove_if(docs.begin(), docs.end(),
+                        [this](int d) { return !live_docs.contains(d); }), docs.end());
+                    if (docs.empty()) {
+                        continue;
                     }
-                    node = node->next;
                 }
-                e = e->next;
+                term_docs.emplace_back(std::string(dictionary.term(id), dictionary.term_length(id)), docs);
             }
+            live_docs.to_vector(all_docs);
+            term_count = searchable_terms;
+        }
+        py::dict terms_dict;
+        for (const auto& entry : term_docs) {
+            terms_dict[py::str(entry.first)] = to_pylist(entry.second);
         }
+        py::dict result;
+        result["documents"] = to_pylist(all_docs);
+        result["terms"] = terms_dict;
+        result["doc_count"] = py::int_(static_cast<int>(all_docs.size()));
+        result["term_count"] = py::int_(static_cast<int>(term_count));
         return result;
     }
 
-    void clear() {
-        for (size_t i = 0; i < HASH_TABLE_SIZE; ++i) {
-            TermEntry* e = hash_table[i];
-            while (e) {
-                TermEntry* n = e->next;
-                delete e;
-                e = n;
+    py::list get_document_terms(int doc_id) const {
+        std::vector<std::string> found;
+        {
+            py::gil_scoped_release release;
+            ReadLock lock(mutex);
+            if (live_docs.contains(doc_id)) {
+                auto terms = forward(doc_id);
+                for (const uint32_t* id = terms.first; id != terms.second; ++id) {
+                    found.emplace_back(dictionary.term(*id), dictionary.term_length(*id));
+                }
             }
-            hash_table[i] = nullptr;
         }
-        if (all_doc_ids.data) {
-            delete[] all_doc_ids.data;
-            all_doc_ids.data = nullptr;
-            all_doc_ids.size = 0;
-            all_doc_ids.capacity = 0;
+        py::list result;
+        for (const std::string& term : found) {
+            result.append(py::str(term));
         }
+        return result;
+    }
+
+    void c_clear() {
+        dictionary.clear();
+        postings.clear();
+        postings.shrink_to_fit();
+        live_df.clear();
+        live_df.shrink_to_fit();
+        searchable_terms = 0;
+        live_terms = 0;
+        live_docs.clear();
+        tombstones.clear();
+        forward_ids.clear();
+        forward_ids.shrink_to_fit();
+        forward_slots.clear();
+        forward_slots.shrink_to_fit();
+        forward_garbage = 0;
+        doc_lengths.clear();
+        doc_lengths.shrink_to_fit();
+        total_length = 0;
+    }
+
+    void clear() {
+        WriteLock lock(mutex);
+        c_clear();
     }
 };
 
 PYBIND11_MODULE(boolean_index_cpp, m) {
+    m.attr("MAX_DOC_ID") = MAX_DOC_ID;
     py::class_<BooleanIndex>(m, "BooleanIndex")
-        .def(py::init<>())
+        .def(py::init<bool, bool>(), py::arg("store_positions") = false, py::arg("auto_compact") = true)
         .def("add_document", &BooleanIndex::add_document)
-        .def("remove_document", &BooleanIndex::remove_document)
+        .def("remove_document", &BooleanIndex::remove_document, py::call_guard<py::gil_scoped_release>())
         .def("search", &BooleanIndex::search)
-        .def("get_document_count", &BooleanIndex::get_document_count)
-        .def("get_term_count", &BooleanIndex::get_term_count)
+        .def("explain", &BooleanIndex::explain)
+        .def("search_ranked", &BooleanIndex::search_ranked,
+             py::arg("query_terms"), py::arg("k") = 10, py::arg("stats") = py::none())
+        .def("term_stats", &BooleanIndex::term_stats)
+        .def("get_terms", &BooleanIndex::get_terms)
+        .def("get_document_count", &BooleanIndex::get_document_count, py::call_guard<py::gil_scoped_release>())
+        .def("get_term_count", &BooleanIndex::get_term_count, py::call_guard<py::gil_scoped_release>())
         .def("get_index_data", &BooleanIndex::get_index_data)
         .def("get_document_terms", &BooleanIndex::get_document_terms)
-        .def("clear", &BooleanIndex::clear);
+        .def("remove_documents", &BooleanIndex::remove_documents)
+        .def("apply_batch", &BooleanIndex::apply_batch, py::arg("ops"), py::arg("before") = py::none())
+        .def("save_snapshot", &BooleanIndex::save_snapshot, py::call_guard<py::gil_scoped_release>())
+        .def("load_snapshot", &BooleanIndex::load_snapshot, py::call_guard<py::gil_scoped_release>())
+        .def("compact", &BooleanIndex::compact, py::call_guard<py::gil_scoped_release>())
+        .def("merge", &BooleanIndex::merge)
+        .def("storage_stats", &BooleanIndex::storage_stats)
+        .def("clear", &BooleanIndex::clear, py::call_guard<py::gil_scoped_release>());
 }
\ No newline at end of file
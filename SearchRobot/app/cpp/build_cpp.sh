@@ -17,7 +17,7 @@ PYTHON_INCLUDE_DIR=$(python3 -c "import sysconfig; print(sysconfig.get_path('inc
 PYTHON_LIBRARY_DIR=$(python3 -c "import sysconfig; print(sysconfig.get_config_var('LIBDIR'))")
 
 echo "Building text_processor_cpp..."
-c++ -O3 -Wall -shared -std=c++17 -fPIC \
+c++ -O3 -Wall -shared -std=c++17 -fPIC -pthread \
     ${PYBIND11_INCLUDES} \
     -I${PYTHON_INCLUDE_DIR} \
     text_processor.cpp \
@@ -25,7 +25,7 @@ c++ -O3 -Wall -shared -std=c++17 -fPIC \
     -o text_processor_cpp${PYTHON_EXT_SUFFIX}
 
 echo "Building boolean_index_cpp..."
-c++ -O3 -Wall -shared -std=c++17 -fPIC \
+c++ -O3 -Wall -shared -std=c++17 -fPIC -pthread \
     ${PYBIND11_INCLUDES} \
     -I${PYTHON_INCLUDE_DIR} \
     boolean_index.cpp \
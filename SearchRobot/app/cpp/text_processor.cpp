@@ -1,15 +1,23 @@
 #include <pybind11/pybind11.h>
 #include <pybind11/stl.h>
+#include <pybind11/numpy.h>
 #include <vector>
 #include <string>
-#include <unordered_set>
+#include <string_view>
+#include <unordered_map>
 #include <algorithm>
+#include <atomic>
+#include <mutex>
+#include <thread>
 #include <cctype>
+#include <cstdint>
+#include <cstring>
+#include <memory>
 
 namespace py = pybind11;
 using namespace py::literals;
 
-static const std::unordered_set<std::string> RUSSIAN_STOP_WORDS = {
+static const char* RUSSIAN_STOP_WORDS[] = {
 "и", "в", "во", "не", "что", "он", "на", "я", "с", "со", "как", "а", "то",
 "все", "она", "так", "его", "но", "да", "ты", "к", "у", "же", "вы", "за",
 "бы", "по", "только", "ее", "мне", "было", "вот", "от", "меня", "еще",
@@ -18,57 +26,92 @@ static const std::unordered_set<std::string> RUSSIAN_STOP_WORDS = {
 "опять", "уж", "вам", "сказал", "ведь", "там", "потом", "себя", "ничего"
 };
 
-static const std::unordered_set<std::string> ENGLISH_STOP_WORDS_BASE = {
+static const char* ENGLISH_STOP_WORDS[] = {
 "a", "an", "are", "as", "at", "be", "but", "by", "for", "if", "in",
 "into", "is", "it", "no", "of", "on", "such", "that", "the",
 "their", "then", "there", "these", "they", "this", "to", "was", "will", "with"
 };
 
-static const std::unordered_set<std::string> ENGLISH_STOP_WORDS_DOC = []() {
-    auto s = ENGLISH_STOP_WORDS_BASE;
-    s.insert("and"); s.insert("or"); s.insert("not");
-    return s;
-}();
-
-static const std::unordered_set<std::string> ENGLISH_STOP_WORDS_QUERY = ENGLISH_STOP_WORDS_BASE;
-
-std::string to_lower_utf8(const std::string& str) {
-    std::string result;
-    result.reserve(str.size());
-    for (size_t i = 0; i < str.size(); ++i) {
-        unsigned char c = static_cast<unsigned char>(str[i]);
-        if (c >= 'A' && c <= 'Z') {
-            result += static_cast<char>(c - 'A' + 'a');
-        }
-        else if (c == 0xD0 && i + 1 < str.size()) {
-            unsigned char c2 = static_cast<unsigned char>(str[i + 1]);
-            if (c2 >= 0x90 && c2 <= 0x9F) {
-                result += static_cast<char>(0xD0);
-                result += static_cast<char>(c2 + 0x20);
-                ++i;
-            } else if (c2 >= 0xA0 && c2 <= 0xAF) {
-                result += static_cast<char>(0xD1);
-                result += static_cast<char>(c2 - 0x20);
-                ++i;
-            } else if (c2 == 0x81) {
-                result += static_cast<char>(0xD1);
-                result += static_cast<char>(0x91);
-                ++i;
+// Stop words only in documents: in queries they are operators.
+static const char* ENGLISH_DOCUMENT_STOP_WORDS[] = {"and", "or", "not"};
+
+enum StopKind : unsigned {
+    STOP_RUSSIAN = 1,
+    STOP_ENGLISH = 2,
+    STOP_ENGLISH_DOCUMENT = 4,
+};
+static const unsigned DOCUMENT_STOP_WORDS = STOP_RUSSIAN | STOP_ENGLISH | STOP_ENGLISH_DOCUMENT;
+static const unsigned QUERY_STOP_WORDS = STOP_RUSSIAN | STOP_ENGLISH;
+
+static inline uint64_t hash_bytes(std::string_view s, uint64_t seed = 0) {
+    uint64_t h = 14695981039346656037ULL ^ seed;
+    for (unsigned char c : s) {
+        h ^= c;
+        h *= 1099511628211ULL;
+    }
+    return h;
+}
+
+// Perfect hash over the stop words: a seed is searched once so that every
+// word gets a slot of its own, and a lookup is one hash and one compare.
+class StopList {
+public:
+    StopList() {
+        add(RUSSIAN_STOP_WORDS, std::size(RUSSIAN_STOP_WORDS), STOP_RUSSIAN);
+        add(ENGLISH_STOP_WORDS, std::size(ENGLISH_STOP_WORDS), STOP_ENGLISH);
+        add(ENGLISH_DOCUMENT_STOP_WORDS, std::size(ENGLISH_DOCUMENT_STOP_WORDS), STOP_ENGLISH_DOCUMENT);
+        for (seed = 1; !place(); ++seed) {
+        }
+    }
+
+    unsigned kinds(std::string_view word) const {
+        if (word.size() > max_length) {
+            return 0;
+        }
+        const Entry& e = slots[hash_bytes(word, seed) & (SLOTS - 1)];
+        return e.word == word ? e.kinds : 0;
+    }
+
+private:
+    struct Entry {
+        std::string_view word;
+        unsigned kinds = 0;
+    };
+    static const size_t SLOTS = 2048;
+
+    void add(const char** list, size_t count, unsigned kind) {
+        for (size_t i = 0; i < count; ++i) {
+            std::string_view word(list[i]);
+            auto it = std::find_if(words.begin(), words.end(),
+                                   [word](const Entry& e) { return e.word == word; });
+            if (it == words.end()) {
+                words.push_back({word, kind});
             } else {
-                result += str[i];
+                it->kinds |= kind;
             }
+            max_length = std::max(max_length, word.size());
         }
-        else if (c == 0xD1 && i + 1 < str.size()) {
-            result += str[i];
-            result += str[i + 1];
-            ++i;
-        }
-        else {
-            result += str[i];
+    }
+
+    bool place() {
+        slots.assign(SLOTS, Entry());
+        for (const Entry& e : words) {
+            Entry& slot = slots[hash_bytes(e.word, seed) & (SLOTS - 1)];
+            if (!slot.word.empty()) {
+                return false;
+            }
+            slot = e;
         }
+        return true;
     }
-    return result;
-}
+
+    std::vector<Entry> words;
+    std::vector<Entry> slots;
+    uint64_t seed = 0;
+    size_t max_length = 0;
+};
+
+static const StopList STOP_LIST;
 
 bool is_russian_word(const std::string& word) {
     for (char c : word) {
@@ -78,127 +121,447 @@ bool is_russian_word(const std::string& word) {
     return false;
 }
 
-std::string simple_russian_stem(const std::string& word) {
-    if (word == "система") return "систем";
-    if (word == "данных") return "данн";
-    if (word.size() < 4) return word;
-    std::string w = word;
-    std::vector<std::string> endings = {
-        "ность", "ностью", "ностям", "ностях",
-        "ствие", "ствием", "ствия", "ствий", "ствиям", "ствиях",
-        "тель", "теля", "телем", "телям", "телях",
-        "ение", "ением", "ения", "ений", "ениям", "ениях",
-        "ание", "анием", "ания", "аний", "аниям", "аниях",
-        "ься", "ться",
-        "ого", "его", "ому", "ему", "ими", "ыми", "их", "ых",
-        "ий", "ия", "ию", "ие", "иях", "иям", "иями",
-        "ый", "ая", "ое", "ые", "ой", "ей", "ом", "ем",
-        "ую", "юю",
-        "ем", "ом", "ам", "ям", "ах", "ях",
-        "ма", "ми", "му", "м",
-        "и", "ы", "ь", "а", "я", "о", "е", "у", "ю"
-    };
-    for (const auto& end : endings) {
-        if (w.size() > end.size() && w.substr(w.size() - end.size()) == end) {
-            w.resize(w.size() - end.size());
-            break;
+static const std::string_view RUSSIAN_ENDINGS[] = {
+    "ность", "ностью", "ностям", "ностях",
+    "ствие", "ствием", "ствия", "ствий", "ствиям", "ствиях",
+    "тель", "теля", "телем", "телям", "телях",
+    "ение", "ением", "ения", "ений", "ениям", "ениях",
+    "ание", "анием", "ания", "аний", "аниям", "аниях",
+    "ься", "ться",
+    "ого", "его", "ому", "ему", "ими", "ыми", "их", "ых",
+    "ий", "ия", "ию", "ие", "иях", "иям", "иями",
+    "ый", "ая", "ое", "ые", "ой", "ей", "ом", "ем",
+    "ую", "юю",
+    "ем", "ом", "ам", "ям", "ах", "ях",
+    "ма", "ми", "му", "м",
+    "и", "ы", "ь", "а", "я", "о", "е", "у", "ю"
+};
+
+static const std::string_view ENGLISH_ENDINGS[] = {
+    "es", "sses", "ies", "ss", "s", "ing", "ed", "er", "est", "ly"
+};
+
+// Stems only ever cut a suffix off, so they are returned as the length of
+// the prefix that remains. The first ending in list order wins.
+static size_t russian_stem_length(std::string_view word) {
+    if (word == "система") return std::string_view("систем").size();
+    if (word == "данных") return std::string_view("данн").size();
+    if (word.size() < 4) return word.size();
+    for (std::string_view end : RUSSIAN_ENDINGS) {
+        if (word.size() > end.size() && word.compare(word.size() - end.size(), end.size(), end) == 0) {
+            size_t stem = word.size() - end.size();
+            return stem >= 3 ? stem : word.size();
         }
     }
-    return w.size() >= 3 ? w : word;
+    return word.size();
 }
 
-std::string simple_english_stem(const std::string& word) {
-    if (word.size() < 4) return word;
-    std::string w = word;
-    std::vector<std::string> endings = {
-        "es", "sses", "ies", "ss", "s", "ing", "ed", "er", "est", "ly"
+static size_t english_stem_length(std::string_view word) {
+    if (word.size() < 4) return word.size();
+    for (std::string_view end : ENGLISH_ENDINGS) {
+        if (word.size() > end.size() && word.compare(word.size() - end.size(), end.size(), end) == 0) {
+            return word.size() - end.size();
+        }
+    }
+    return word.size();
+}
+
+// Bounded surface form -> stem length cache shared by all threads. Slots
+// are direct-mapped by hash, so a new form just replaces whatever shared
+// its slot; the slots are split into shards with a lock each.
+class StemCache {
+public:
+    StemCache() : shards(new Shard[SHARDS]) {}
+
+    size_t stem_length(std::string_view word, bool russian) {
+        if (word.size() > MAX_FORM) {
+            return russian ? russian_stem_length(word) : english_stem_length(word);
+        }
+        uint64_t h = hash_bytes(word);
+        Shard& shard = shards[h >> (64 - SHARD_BITS)];
+        Slot& slot = shard.slots[h & (SLOTS_PER_SHARD - 1)];
+        {
+            std::lock_guard<std::mutex> lock(shard.mutex);
+            if (slot.form == word) {
+                return slot.stem;
+            }
+        }
+        size_t stem = russian ? russian_stem_length(word) : english_stem_length(word);
+        std::lock_guard<std::mutex> lock(shard.mutex);
+        slot.form.assign(word.data(), word.size());
+        slot.stem = static_cast<uint32_t>(stem);
+        return stem;
+    }
+
+private:
+    static const size_t SHARD_BITS = 6;
+    static const size_t SHARDS = size_t(1) << SHARD_BITS;
+    static const size_t SLOTS_PER_SHARD = 1024;
+    static const size_t MAX_FORM = 64;
+
+    struct Slot {
+        std::string form;
+        uint32_t stem = 0;
     };
-    for (const auto& end : endings) {
-        if (w.size() > end.size() && w.substr(w.size() - end.size()) == end) {
-            w.resize(w.size() - end.size());
-            break;
-        }
-    }
-    return w;
-}
-
-std::vector<std::string> tokenize_text(
-    const std::string& text,
-    const std::unordered_set<std::string>& eng_stop,
-    const std::unordered_set<std::string>& rus_stop
-) {
-    std::vector<std::string> tokens;
-    std::string current;
-    for (size_t i = 0; i < text.size(); ++i) {
-        unsigned char c = static_cast<unsigned char>(text[i]);
-        bool is_letter = false;
-        if ((c >= 'a' && c <= 'z') || (c >= 'A' && c <= 'Z')) is_letter = true;
-        else if (c == 0xD0 || c == 0xD1) {
-            if (i + 1 < text.size()) {
-                unsigned char c2 = static_cast<unsigned char>(text[i + 1]);
-                if (c == 0xD0) is_letter = (c2 >= 0x90 && c2 <= 0xBF) || (c2 == 0x81);
-                else is_letter = (c2 >= 0x80 && c2 <= 0x8F) || (c2 == 0x91);
+    struct Shard {
+        std::mutex mutex;
+        Slot slots[SLOTS_PER_SHARD];
+    };
+    std::unique_ptr<Shard[]> shards;
+};
+
+static StemCache STEM_CACHE;
+
+static inline bool is_cyrillic_letter(unsigned char c, unsigned char c2) {
+    if (c == 0xD0) return (c2 >= 0x90 && c2 <= 0xBF) || c2 == 0x81;
+    return (c2 >= 0x80 && c2 <= 0x8F) || c2 == 0x91;
+}
+
+static inline bool is_query_syntax(const std::string& text, size_t i) {
+    char c = text[i];
+    return c == '"' || c == '(' || c == ')' ||
+           (c == '/' && i + 1 < text.size() && isdigit(static_cast<unsigned char>(text[i + 1])));
+}
+
+enum TokenKind { LATIN_WORD, RUSSIAN_WORD, SYNTAX };
+
+// One pass over UTF-8 text: words (Latin and Cyrillic letters, ' and -)
+// are found, case-folded and checked against the stop list, and emit is
+// called with each kept word as a view into the text, or into a scratch
+// buffer when it had capitals. With query_syntax, parentheses, '"' and
+// "/N" (NEAR distance) are emitted as SYNTAX tokens.
+template <class Emit>
+static void scan_tokens(const std::string& text, unsigned stop_kinds, bool query_syntax, Emit emit) {
+    const unsigned char* s = reinterpret_cast<const unsigned char*>(text.data());
+    size_t n = text.size();
+    std::string folded;
+    size_t i = 0;
+    while (i < n) {
+        if (query_syntax && is_query_syntax(text, i)) {
+            size_t j = i + 1;
+            while (text[i] == '/' && j < n && isdigit(s[j])) {
+                ++j;
             }
+            emit(std::string_view(text.data() + i, j - i), SYNTAX);
+            i = j;
+            continue;
         }
-        else if (c == '\'' || c == '-') is_letter = true;
 
-        if (is_letter) {
-            if (c == 0xD0 || c == 0xD1) {
-                if (i + 1 < text.size()) {
-                    current += text[i];
-                    current += text[i + 1];
+        size_t start = i;
+        bool upper = false;
+        bool russian = false;
+        while (i < n) {
+            unsigned char c = s[i];
+            if (c < 0x80) {
+                if ((c >= 'a' && c <= 'z') || c == '\'' || c == '-') {
                     ++i;
-                } else current += text[i];
-            } else current += text[i];
-        } else {
-            if (!current.empty()) {
-                std::string lower_word = to_lower_utf8(current);
-                if (lower_word.size() >= 2) {
-                    bool is_stop = (rus_stop.count(lower_word) > 0) || (eng_stop.count(lower_word) > 0);
-                    if (!is_stop) tokens.push_back(lower_word);
+                } else if (c >= 'A' && c <= 'Z') {
+                    upper = true;
+                    ++i;
+                } else {
+                    break;
                 }
-                current.clear();
+            } else if ((c == 0xD0 || c == 0xD1) && i + 1 < n && is_cyrillic_letter(c, s[i + 1])) {
+                upper |= c == 0xD0 && (s[i + 1] <= 0xAF);
+                russian = true;
+                i += 2;
+            } else {
+                break;
             }
         }
-    }
-    if (!current.empty()) {
-        std::string lower_word = to_lower_utf8(current);
-        if (lower_word.size() >= 2) {
-            bool is_stop = (rus_stop.count(lower_word) > 0) || (eng_stop.count(lower_word) > 0);
-            if (!is_stop) tokens.push_back(lower_word);
+        if (i == start) {
+            ++i;
+            continue;
+        }
+
+        std::string_view word(text.data() + start, i - start);
+        if (upper) {
+            folded.clear();
+            for (size_t k = start; k < i; ++k) {
+                unsigned char c = s[k];
+                if (c >= 'A' && c <= 'Z') {
+                    folded += static_cast<char>(c - 'A' + 'a');
+                } else if (c == 0xD0 && s[k + 1] <= 0x9F && s[k + 1] != 0x81) {
+                    folded += static_cast<char>(0xD0);
+                    folded += static_cast<char>(s[++k] + 0x20);
+                } else if (c == 0xD0 && s[k + 1] <= 0xAF && s[k + 1] != 0x81) {
+                    folded += static_cast<char>(0xD1);
+                    folded += static_cast<char>(s[++k] - 0x20);
+                } else if (c == 0xD0 && s[k + 1] == 0x81) {
+                    folded += static_cast<char>(0xD1);
+                    folded += static_cast<char>(0x91);
+                    ++k;
+                } else if (c >= 0x80) {
+                    folded += static_cast<char>(c);
+                    folded += static_cast<char>(s[++k]);
+                } else {
+                    folded += static_cast<char>(c);
+                }
+            }
+            word = folded;
+        }
+        if (word.size() >= 2 && !(STOP_LIST.kinds(word) & stop_kinds)) {
+            emit(word, russian ? RUSSIAN_WORD : LATIN_WORD);
         }
     }
-    return tokens;
 }
 
 std::vector<std::string> stem_tokens(const std::vector<std::string>& tokens) {
     std::vector<std::string> result;
     result.reserve(tokens.size());
     for (const auto& t : tokens) {
-        if (is_russian_word(t)) result.push_back(simple_russian_stem(t));
-        else result.push_back(simple_english_stem(t));
+        result.emplace_back(t, 0, STEM_CACHE.stem_length(t, is_russian_word(t)));
     }
     return result;
 }
 
+// Stemmed terms of a text, syntax tokens passed through as they are.
+static std::vector<std::string> stemmed_terms(const std::string& text, unsigned stop_kinds, bool query_syntax) {
+    std::vector<std::string> terms;
+    scan_tokens(text, stop_kinds, query_syntax, [&terms](std::string_view token, TokenKind kind) {
+        size_t length = kind == SYNTAX ? token.size() : STEM_CACHE.stem_length(token, kind == RUSSIAN_WORD);
+        terms.emplace_back(token.substr(0, length));
+    });
+    return terms;
+}
+
+std::vector<std::string> document_terms(const std::string& raw_text) {
+    return stemmed_terms(raw_text, DOCUMENT_STOP_WORDS, false);
+}
+
 py::dict process_document(const std::string& raw_text) {
-    auto tokens = tokenize_text(raw_text, ENGLISH_STOP_WORDS_DOC, RUSSIAN_STOP_WORDS);
-    auto stemmed = stem_tokens(tokens);
+    auto stemmed = document_terms(raw_text);
     py::dict stats;
     stats["token_count"] = (int)stemmed.size();
     return py::dict("terms"_a = stemmed, "stats"_a = stats);
 }
 
 py::dict process_query(const std::string& raw_query) {
-    auto tokens = tokenize_text(raw_query, ENGLISH_STOP_WORDS_QUERY, RUSSIAN_STOP_WORDS);
-    auto stemmed = stem_tokens(tokens);
+    auto stemmed = stemmed_terms(raw_query, QUERY_STOP_WORDS, true);
     py::dict stats;
     stats["token_count"] = (int)stemmed.size();
     return py::dict("terms"_a = stemmed, "stats"_a = stats);
 }
 
+static inline uint64_t mix64(uint64_t x) {
+    x ^= x >> 30;
+    x *= 0xbf58476d1ce4e5b9ULL;
+    x ^= x >> 27;
+    x *= 0x94d049bb133111ebULL;
+    return x ^ (x >> 31);
+}
+
+// MinHash of the set of shingles of `shingle` consecutive terms: one
+// 64-bit hash per shingle, spread into `count` 32-bit hash functions by
+// multiply-shift. The share of equal positions in two signatures estimates
+// the Jaccard similarity of the shingle sets.
+std::vector<uint32_t> minhash(const std::vector<std::string>& terms, size_t count, size_t shingle) {
+    std::vector<uint32_t> signature(count, UINT32_MAX);
+    if (terms.empty()) {
+        return signature;
+    }
+    std::vector<uint64_t> multipliers(count), offsets(count);
+    for (size_t i = 0; i < count; ++i) {
+        multipliers[i] = mix64(2 * i + 1) | 1;
+        offsets[i] = mix64(2 * i + 2);
+    }
+    size_t width = std::max<size_t>(1, std::min(shingle, terms.size()));
+    for (size_t i = 0; i + width <= terms.size(); ++i) {
+        uint64_t h = 0;
+        for (size_t j = 0; j < width; ++j) {
+            h = hash_bytes(terms[i + j], h * 31 + j);
+        }
+        h = mix64(h);
+        for (size_t k = 0; k < count; ++k) {
+            uint32_t value = (uint32_t)((multipliers[k] * h + offsets[k]) >> 32);
+            signature[k] = std::min(signature[k], value);
+        }
+    }
+    return signature;
+}
+
+template <class F>
+static void parallel_for(size_t count, size_t n_threads, F f) {
+    n_threads = std::min(n_threads, count);
+    if (n_threads <= 1) {
+        for (size_t i = 0; i < count; ++i) {
+            f(i);
+        }
+        return;
+    }
+    std::atomic<size_t> next(0);
+    auto worker = [&]() {
+        for (size_t i = next++; i < count; i = next++) {
+            f(i);
+        }
+    };
+    std::vector<std::thread> threads;
+    for (size_t t = 1; t < n_threads; ++t) {
+        threads.emplace_back(worker);
+    }
+    worker();
+    for (auto& t : threads) {
+        t.join();
+    }
+}
+
+template <class T>
+static py::array_t<T> to_array(std::vector<T>* data) {
+    py::capsule owner(data, [](void* p) { delete static_cast<std::vector<T>*>(p); });
+    return py::array_t<T>(data->size(), data->data(), owner);
+}
+
+// Documents are handed out to the threads in chunks; with a vocabulary each
+// chunk numbers its terms locally and the chunks are merged in document
+// order, so ids do not depend on the thread count.
+static const size_t DOCUMENT_CHUNK = 64;
+
+struct ChunkTerms {
+    std::vector<std::string> terms;
+    std::vector<int32_t> ids;
+    std::vector<uint32_t> counts;
+};
+
+// Term ids shared across process_documents calls, numbered in order of
+// first occurrence. Calls intern their terms without the GIL, so every
+// access takes the lock; a call interns all of its terms at once.
+class Vocabulary {
+public:
+    void intern(const std::vector<ChunkTerms>& parts, std::vector<std::vector<int32_t>>& remaps) {
+        std::lock_guard<std::mutex> lock(mutex);
+        for (size_t c = 0; c < parts.size(); ++c) {
+            remaps[c].reserve(parts[c].terms.size());
+            for (const std::string& term : parts[c].terms) {
+                auto it = ids.emplace(term, static_cast<int32_t>(terms.size()));
+                if (it.second) {
+                    terms.push_back(term);
+                }
+                remaps[c].push_back(it.first->second);
+            }
+        }
+    }
+
+    int32_t find(const std::string& term) const {
+        std::lock_guard<std::mutex> lock(mutex);
+        auto it = ids.find(term);
+        return it == ids.end() ? -1 : it->second;
+    }
+
+    std::string term(int32_t id) const {
+        std::lock_guard<std::mutex> lock(mutex);
+        if (id < 0 || static_cast<size_t>(id) >= terms.size()) {
+            throw py::index_error("term id out of range");
+        }
+        return terms[id];
+    }
+
+    size_t size() const {
+        std::lock_guard<std::mutex> lock(mutex);
+        return terms.size();
+    }
+
+    std::vector<std::string> all_terms() const {
+        std::lock_guard<std::mutex> lock(mutex);
+        return terms;
+    }
+
+private:
+    mutable std::mutex mutex;
+    std::vector<std::string> terms;
+    std::unordered_map<std::string, int32_t> ids;
+};
+
+// Tokenizes and stems a batch of documents on n_threads threads (all cores
+// when 0) without holding the GIL. Returns a list of term lists, or with a
+// vocabulary an (ids, offsets) pair of NumPy arrays backed by the result
+// buffers: document i has terms ids[offsets[i]:offsets[i + 1]].
+py::object process_documents(const py::list& texts, int n_threads, Vocabulary* vocabulary) {
+    std::vector<std::string> docs;
+    docs.reserve(py::len(texts));
+    for (auto item : texts) {
+        docs.push_back(item.cast<std::string>());
+    }
+    size_t threads = n_threads > 0 ? n_threads : std::max(1u, std::thread::hardware_concurrency());
+    size_t chunks = (docs.size() + DOCUMENT_CHUNK - 1) / DOCUMENT_CHUNK;
+
+    if (!vocabulary) {
+        std::vector<std::vector<std::string>> terms(docs.size());
+        {
+            py::gil_scoped_release release;
+            parallel_for(chunks, threads, [&](size_t c) {
+                size_t end = std::min(docs.size(), (c + 1) * DOCUMENT_CHUNK);
+                for (size_t i = c * DOCUMENT_CHUNK; i < end; ++i) {
+                    terms[i] = document_terms(docs[i]);
+                }
+            });
+        }
+        py::list result;
+        for (const auto& doc_terms : terms) {
+            result.append(py::cast(doc_terms));
+        }
+        return result;
+    }
+
+    std::vector<ChunkTerms> parts(chunks);
+    std::unique_ptr<std::vector<int32_t>> ids(new std::vector<int32_t>());
+    std::unique_ptr<std::vector<int64_t>> offsets(new std::vector<int64_t>(docs.size() + 1, 0));
+    {
+        py::gil_scoped_release release;
+        parallel_for(chunks, threads, [&](size_t c) {
+            ChunkTerms& part = parts[c];
+            std::unordered_map<std::string, int32_t> local;
+            size_t end = std::min(docs.size(), (c + 1) * DOCUMENT_CHUNK);
+            for (size_t i = c * DOCUMENT_CHUNK; i < end; ++i) {
+                std::vector<std::string> doc_terms = document_terms(docs[i]);
+                for (std::string& term : doc_terms) {
+                    auto it = local.emplace(term, static_cast<int32_t>(part.terms.size()));
+                    if (it.second) {
+                        part.terms.push_back(std::move(term));
+                    }
+                    part.ids.push_back(it.first->second);
+                }
+                part.counts.push_back(static_cast<uint32_t>(doc_terms.size()));
+            }
+        });
+
+        std::vector<size_t> starts(chunks + 1, 0);
+        std::vector<std::vector<int32_t>> remaps(chunks);
+        size_t doc = 0;
+        for (size_t c = 0; c < chunks; ++c) {
+            for (uint32_t count : parts[c].counts) {
+                (*offsets)[doc + 1] = (*offsets)[doc] + count;
+                ++doc;
+            }
+            starts[c + 1] = starts[c] + parts[c].ids.size();
+        }
+        vocabulary->intern(parts, remaps);
+
+        ids->resize(starts[chunks]);
+        parallel_for(chunks, threads, [&](size_t c) {
+            int32_t* out = ids->data() + starts[c];
+            for (int32_t local : parts[c].ids) {
+                *out++ = remaps[c][local];
+            }
+        });
+    }
+    return py::make_tuple(to_array(ids.release()), to_array(offsets.release()));
+}
+
 PYBIND11_MODULE(text_processor_cpp, m) {
     m.def("process_document", &process_document);
     m.def("process_query", &process_query);
     m.def("stem_tokens", &stem_tokens);
+    m.def("minhash", [](const std::vector<std::string>& terms, size_t count, size_t shingle) {
+              auto signature = new std::vector<uint32_t>(minhash(terms, count, shingle));
+              return to_array(signature);
+          }, py::arg("terms"), py::arg("count") = 128, py::arg("shingle") = 3);
+    m.def("process_documents", &process_documents,
+          py::arg("texts"), py::arg("n_threads") = 0, py::arg("vocabulary") = nullptr);
+
+    py::class_<Vocabulary>(m, "Vocabulary")
+        .def(py::init<>())
+        .def("__len__", &Vocabulary::size)
+        .def("find", &Vocabulary::find)
+        .def("term", &Vocabulary::term)
+        .def("terms", &Vocabulary::all_terms);
 }
\ No newline at end of file
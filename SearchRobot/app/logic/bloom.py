@@ -0,0 +1,120 @@
+# Adds fingerprints to a scalable Bloom filter kept in plain Redis strings
+# used as bitmaps. Layer i holds capacity * 2^i items at error_rate / 2^(i+1)
+# (so the error of all layers together stays under error_rate); a new layer
+# is started once the last one is full. ARGV holds two 32-bit hashes per
+# fingerprint, positions come from double hashing. Returns 1 for every
+# fingerprint that was new, 0 for one that was (probably) seen before.
+ADD_SCRIPT = """
+local meta = KEYS[1]
+local state = redis.call('HMGET', meta, 'capacity', 'error_rate', 'layers', 'count')
+local capacity = tonumber(state[1])
+local error_rate = tonumber(state[2])
+local layers = tonumber(state[3])
+local count = tonumber(state[4])
+if not capacity then
+    capacity = tonumber(ARGV[1])
+    error_rate = tonumber(ARGV[2])
+    layers = 1
+    count = 0
+end
+local LN2 = math.log(2)
+local sizes = {}
+local hashes = {}
+local function layer(i)
+    if not sizes[i] then
+        local cap = capacity * 2 ^ i
+        local err = error_rate / 2 ^ (i + 1)
+        local bits = math.min(4294967296, math.ceil(-cap * math.log(err) / (LN2 * LN2)))
+        sizes[i] = bits
+        hashes[i] = math.max(1, math.floor(bits / cap * LN2 + 0.5))
+    end
+    return sizes[i], hashes[i]
+end
+local added = {}
+for n = 3, #ARGV, 2 do
+    local h1 = tonumber(ARGV[n])
+    local h2 = tonumber(ARGV[n + 1])
+    local seen = false
+    for i = layers - 1, 0, -1 do
+        local bits, k = layer(i)
+        local key = meta .. ':' .. i
+        seen = true
+        for j = 0, k - 1 do
+            if redis.call('GETBIT', key, (h1 + j * h2) % bits) == 0 then
+                seen = false
+                break
+            end
+        end
+        if seen then
+            break
+        end
+    end
+    if seen then
+        added[#added + 1] = 0
+    else
+        local bits, k = layer(layers - 1)
+        local key = meta .. ':' .. (layers - 1)
+        for j = 0, k - 1 do
+            redis.call('SETBIT', key, (h1 + j * h2) % bits, 1)
+        end
+        count = count + 1
+        if count >= capacity * 2 ^ (layers - 1) then
+            layers = layers + 1
+            count = 0
+        end
+        added[#added + 1] = 1
+    end
+end
+redis.call('HSET', meta, 'capacity', capacity, 'error_rate', error_rate, 'layers', layers, 'count', count)
+return added
+"""
+
+
+class RedisBloomFilter:
+    # Request fingerprints are sha1 hex digests, so their leading bits are
+    # already uniform and serve as the two hashes directly.
+    BATCH = 1000
+
+    def __init__(self, redis, key, capacity=1_000_000, error_rate=0.001):
+        if capacity < 1 or not 0 < error_rate < 1:
+            raise ValueError(f"bad Bloom filter parameters: capacity={capacity}, error_rate={error_rate}")
+        self.redis = redis
+        self.key = key
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.add_script = redis.register_script(ADD_SCRIPT)
+
+    @staticmethod
+    def _hashes(fingerprint):
+        return int(fingerprint[:8], 16), int(fingerprint[8:16], 16) | 1
+
+    def add(self, fingerprint):
+        return self.add_many([fingerprint])[0]
+
+    def add_many(self, fingerprints):
+        added = []
+        for start in range(0, len(fingerprints), self.BATCH):
+            args = [self.capacity, self.error_rate]
+            for fingerprint in fingerprints[start:start + self.BATCH]:
+                args.extend(self._hashes(fingerprint))
+            added.extend(bool(flag) for flag in self.add_script(keys=[self.key], args=args))
+        return added
+
+    def layers(self):
+        return int(self.redis.hget(self.key, "layers") or 0)
+
+    def stats(self):
+        state = self.redis.hgetall(self.key)
+        layers = int(state.get(b"layers", 0))
+        capacity = int(state.get(b"capacity", self.capacity))
+        count = int(state.get(b"count", 0))
+        return {
+            "layers": layers,
+            "items": sum(capacity * 2 ** i for i in range(layers - 1)) + count if layers else 0,
+            "bytes": sum(self.redis.strlen(f"{self.key}:{i}") for i in range(layers)),
+        }
+
+    def clear(self):
+        layers = self.layers()
+        self.redis.delete(self.key, *[f"{self.key}:{i}" for i in range(layers)])
+
@@ -1,83 +1,443 @@
-from cpp.boolean_index_cpp import BooleanIndex
+import os
+import asyncio
+import json
+import base64
+import bisect
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from cpp.boolean_index_cpp import MAX_DOC_ID, BooleanIndex
 from cpp.text_processor_cpp import process_query
 from logic import db
+from logic.result_cache import ResultCache
+from logic.doc_store import DocStore
+from logic.page_codec import PageCodec
+from logic.coalescer import RequestCoalescer
+from logic.index_sync import IndexSync
+from logic.segmented_index import SegmentedIndex
+from logic.sharded_index import MongoShardSource, ShardedIndex
 
 index = None
+index_cfg = {}
+db_cfg = {}
+index_lock = threading.Lock()
+
+def configure_boolean_index(cfg: dict, database: dict = None):
+    global index_cfg, db_cfg
+    index_cfg = cfg or {}
+    db_cfg = database or {}
 
 def get_boolean_index():
     global index
-    if index is None:
-        client, collection = db.mongo_client, db.mongo_collection
-        if not client:
-            print("MongoBooleanIndex not initialized")
-            return None   
-        index = MongoBooleanIndex(collection)
+    # Handlers run in the threadpool, so the first requests may race here.
+    with index_lock:
+        if index is None:
+            client, collection = db.mongo_client, db.mongo_collection
+            async_collection = db.async_mongo_collection
+            if not client:
+                print("MongoBooleanIndex not initialized")
+                return None
+            store_positions = index_cfg.get("positions", False)
+            segments = None
+            if index_cfg.get("segmented", False):
+                segments = {
+                    "buffer_docs": index_cfg.get("segment_buffer_docs", 10000),
+                    "merge_factor": index_cfg.get("segment_merge_factor", 4),
+                    "max_deletes": index_cfg.get("segment_max_deletes", 0.3),
+                }
+            inner = None
+            if index_cfg.get("shards", 0) > 1:
+                inner = ShardedIndex(
+                    index_cfg["shards"],
+                    index_cfg.get("shard_socket_dir", "/tmp/index-shards"),
+                    MongoShardSource(db_cfg["mongo_uri"], db_cfg["database"], db_cfg["collection"]),
+                    store_positions=store_positions,
+                    segments=segments,
+                    call_timeout=index_cfg.get("shard_call_timeout_seconds", 30.0),
+                )
+            elif segments is not None:
+                inner = SegmentedIndex(store_positions, **segments)
+            index = MongoBooleanIndex(
+                collection,
+                index=inner,
+                async_collection=async_collection,
+                search_threads=index_cfg.get("search_threads"),
+                snapshot_path=index_cfg.get("snapshot_path"),
+                replay_margin=index_cfg.get("snapshot_replay_margin_seconds", 600),
+                store_positions=store_positions,
+                cache_bytes=index_cfg.get("result_cache_mb", 64) * 1024 * 1024,
+                sync={
+                    "mode": index_cfg.get("sync", "auto"),
+                    "batch_size": index_cfg.get("sync_batch_size", 500),
+                    "batch_interval": index_cfg.get("sync_batch_interval_seconds", 1.0),
+                    "poll_interval": index_cfg.get("sync_poll_interval_seconds", 5.0),
+                    "poll_margin": index_cfg.get("sync_poll_margin_seconds", 60.0),
+                } if index_cfg.get("sync", "auto") != "off" else None,
+            )
     return index
 
+async def get_boolean_index_async():
+    # For async handlers: the index is built at startup, so only requests
+    # racing that wait for it, on a thread.
+    if index is not None:
+        return index
+    return await asyncio.to_thread(get_boolean_index)
+
 
 class MongoBooleanIndex:
-    def __init__(self, collection):
+    # Ranked results are computed and cached this deep at least, deeper
+    # pages double the depth, up to MAX_RANKED_DEPTH. Pages start at most
+    # MAX_OFFSET deep and hold at most MAX_LIMIT results.
+    RANKED_DEPTH = 128
+    MAX_RANKED_DEPTH = 1 << 20
+    MAX_OFFSET = MAX_RANKED_DEPTH
+    MAX_LIMIT = 10000
+
+    def __init__(self, collection, snapshot_path=None, replay_margin=600, store_positions=False,
+                 cache_bytes=64 * 1024 * 1024, index=None, sync=None, async_collection=None, search_threads=None):
         self.collection = collection
-        self.index = BooleanIndex()
-        
-        batch_size = 1000
+        self.async_collection = async_collection
+        # Decodes the terms of pages in either storage format.
+        self.codec = PageCodec(collection.database)
+        self.executor = ThreadPoolExecutor(max_workers=search_threads or os.cpu_count(), thread_name_prefix="search")
+        self.coalescer = RequestCoalescer()
+        # A ShardedIndex in place of the in-process BooleanIndex spreads the
+        # documents over worker processes, a SegmentedIndex keeps updates
+        # off the bulk of the index.
+        self.index = index if index is not None else BooleanIndex(store_positions)
+        self.snapshot_path = snapshot_path
+        self.replay_margin = replay_margin
+        self.cache = ResultCache(cache_bytes)
+        self.docs = DocStore()
+        self.docs_path = snapshot_path + ".docs" if snapshot_path else None
+        # Bumped after every change to the index; cached results computed
+        # at an older generation are stale.
+        self.generation = 0
+        self.generation_lock = threading.Lock()
+        # Follows the writes to the collection; its position is saved with
+        # every snapshot.
+        self.sync = None
+        if sync is not None:
+            self.sync = IndexSync(self, collection, snapshot_path + ".sync" if snapshot_path else None, **sync)
+
         print("MongoBooleanIndex initializing...")
+        watermark = self._load_snapshot()
+        resumed = False
+        if self.sync is not None:
+            resumed = self.sync.open(self.sync.load_checkpoint() if watermark is not None else None)
+        if watermark is None:
+            self._build()
+            self.save_snapshot()
+        elif resumed:
+            print("  Catching up from the saved sync position")
+        else:
+            self._replay(watermark)
+        if self.sync is not None:
+            self.sync.start()
+        print("MongoBooleanIndex has been initialized")
+
+    def _load_snapshot(self):
+        if not self.snapshot_path or not all(os.path.exists(path) for path in self._snapshot_paths()):
+            return None
+        try:
+            watermark = self.index.load_snapshot(self.snapshot_path)
+        except RuntimeError as e:
+            print(f"Snapshot {self.snapshot_path} is not usable: {e}")
+            self.index.clear()
+            return None
+        print(f"  Loaded snapshot {self.snapshot_path} "
+              f"({self.index.get_document_count()} docs)")
+        if not self._load_docs():
+            self._build_docs()
+        return watermark
+
+    def _snapshot_paths(self):
+        if isinstance(self.index, ShardedIndex):
+            return self.index.snapshot_paths(self.snapshot_path)
+        return [self.snapshot_path]
+
+    def _load_docs(self):
+        if not os.path.exists(self.docs_path):
+            return False
+        try:
+            self.docs.load(self.docs_path)
+        except (OSError, ValueError) as e:
+            print(f"Document store {self.docs_path} is not usable: {e}")
+            return False
+        print(f"  Loaded document store {self.docs_path} ({len(self.docs)} docs)")
+        return True
+
+    def _store_doc(self, doc):
+        self.docs.set(doc["doc_id"], doc.get("url", ""), doc.get("title", ""), doc.get("domain", ""))
+
+    def _build_docs(self):
+        cursor = self.collection.find(
+            {"duplicate_of": None},
+            {"doc_id": 1, "url": 1, "title": 1, "domain": 1},
+            batch_size=1000
+        )
+        for doc in cursor:
+            if doc.get("doc_id") is not None:
+                self._store_doc(doc)
+        print(f"  Built document store ({len(self.docs)} docs)")
+
+    def _build(self):
+        if isinstance(self.index, ShardedIndex):
+            # Every shard reads its own partition from Mongo.
+            print(f"  Built {self.index.build()} docs on {self.index.shards} shards")
+            self._build_docs()
+            return
+        batch_size = 1000
         total = 0
+        batch = []
         cursor = self.collection.find(
-            {},
-            {"doc_id": 1, "terms": 1},
+            {"duplicate_of": None},
+            {"doc_id": 1, "terms": 1, "url": 1, "title": 1, "domain": 1},
             batch_size=batch_size
         )
         for doc in cursor:
-            doc_id = doc.get("doc_id")
-            terms = doc.get("terms", [])
-            
-            if doc_id is None:
+            if doc.get("doc_id") is None:
                 continue
-            
-            self.index.add_document(doc_id, terms)
+
+            batch.append(doc)
+            self._store_doc(doc)
             total += 1
-            
+
             if total % batch_size == 0:
+                self._add_docs(batch)
+                batch = []
                 print(f"  Loaded {total} docs...")
-        print("MongoBooleanIndex has been initialized")
-    
-    def _fetch_urls_by_doc_ids(self, doc_ids, offset=0, limit=100):
-        doc_ids = doc_ids[offset:offset+limit]
-        
-        cursor = self.collection.find(
-            {"doc_id": {"$in": doc_ids}},
-            {"doc_id": 1, "url": 1}
-        )
-        res = [{"doc_id": doc["doc_id"], "url": doc["url"]} for doc in cursor]
-        print(res)
-        return res
-        
-    def search(self, query, offset=0, limit=100):
-        doc_ids = self.index.search(process_query(query)["terms"])
-        return self._fetch_urls_by_doc_ids(doc_ids, offset, limit)
-    
+        self._add_docs(batch)
+
+    def _add_docs(self, docs):
+        terms = self.codec.terms_many(docs)
+        self.index.apply_batch([("add", doc["doc_id"], doc_terms) for doc, doc_terms in zip(docs, terms)])
+
+    def _replay(self, watermark):
+        # Pages written shortly before the snapshot may have reached the index
+        # only after it was saved, so replay a safety margin before it.
+        since = datetime.fromtimestamp(watermark - self.replay_margin, timezone.utc)
+        docs = [
+            doc for doc in self.collection.find(
+                {"indexed_at": {"$gt": since}},
+                {"doc_id": 1, "terms": 1, "url": 1, "title": 1, "domain": 1, "duplicate_of": 1},
+            )
+            if doc.get("doc_id") is not None
+        ]
+        # A replace without terms removes pages found to be near-duplicates.
+        self.index.apply_batch([
+            ("replace", doc["doc_id"], [] if doc.get("duplicate_of") else self.codec.terms(doc))
+            for doc in docs
+        ])
+        for doc in docs:
+            if doc.get("duplicate_of"):
+                self.docs.remove(doc["doc_id"])
+            else:
+                self._store_doc(doc)
+        print(f"  Replayed {len(docs)} docs written after {since}")
+
+    def save_snapshot(self):
+        if not self.snapshot_path:
+            return False
+        os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+        # Taken first: changes applied while saving are replayed on resume.
+        checkpoint = self.sync.checkpoint() if self.sync is not None else None
+        self.index.save_snapshot(self.snapshot_path, time.time())
+        self.docs.save(self.docs_path)
+        if checkpoint is not None:
+            self.sync.save_checkpoint(checkpoint)
+        return True
+
+    # Results come from the document store in the order given; only
+    # documents it does not know yet are fetched from Mongo, and kept.
+    def _missing_query(self, missing):
+        return {"doc_id": {"$in": missing}}, {"doc_id": 1, "url": 1, "title": 1, "domain": 1}
+
+    def _fetched_doc(self, doc):
+        self._store_doc(doc)
+        return {"doc_id": doc["doc_id"], **{field: doc.get(field, "") for field in DocStore.FIELDS}}
+
+    def _hydrate(self, doc_ids, found):
+        missing = [doc_id for doc_id in doc_ids if doc_id not in found]
+        if missing:
+            for doc in self.collection.find(*self._missing_query(missing)):
+                found[doc["doc_id"]] = self._fetched_doc(doc)
+        return found
+
+    async def _hydrate_async(self, doc_ids, found):
+        missing = [doc_id for doc_id in doc_ids if doc_id not in found]
+        if missing:
+            if self.async_collection is None:
+                return await asyncio.get_running_loop().run_in_executor(
+                    self.executor, self._hydrate, doc_ids, found
+                )
+            async for doc in self.async_collection.find(*self._missing_query(missing)):
+                found[doc["doc_id"]] = self._fetched_doc(doc)
+        return found
+
+    def _results(self, page, found, next_cursor):
+        # page holds doc ids, or (doc_id, score) pairs for ranked results.
+        results = []
+        for hit in page:
+            doc = found.get(hit[0] if isinstance(hit, tuple) else hit)
+            if doc is not None:
+                results.append({**doc, "score": hit[1]} if isinstance(hit, tuple) else doc)
+        return {"results": results, "next_cursor": next_cursor}
+
+    # Cursors carry the processed query and where the next page starts:
+    # the last doc_id returned for boolean results, which come in doc_id
+    # order, and the offset for ranked ones.
+    def _encode_cursor(self, mode, terms, position):
+        raw = json.dumps([mode, terms, position], ensure_ascii=False, separators=(",", ":"))
+        return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+    def _decode_cursor(self, cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            mode, terms, position = json.loads(raw)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"invalid cursor: {e}")
+        max_position = self.MAX_OFFSET if mode == "ranked" else MAX_DOC_ID
+        if mode not in ("boolean", "ranked") or not isinstance(position, int) or not 0 <= position <= max_position \
+                or not isinstance(terms, list) or not all(isinstance(term, str) for term in terms):
+            raise ValueError("invalid cursor")
+        return mode, terms, position
+
+    # Everything a search does before going to Mongo: the page of hits,
+    # the next cursor and the documents of the page the store knows. With
+    # cached_only, None unless the hits are in the result cache.
+    def _page(self, query, offset, limit, mode, cursor, cached_only=False):
+        position = None
+        if cursor:
+            mode, terms, position = self._decode_cursor(cursor)
+        else:
+            terms = process_query(query)["terms"]
+        if mode == "ranked":
+            hits = self._search_ranked(terms, offset if position is None else position, limit, cached_only)
+        else:
+            hits = self._search_boolean(terms, offset, limit, position, cached_only)
+        if hits is None:
+            return None
+        page, next_cursor = hits
+        doc_ids = [doc_id for doc_id, _ in page] if mode == "ranked" else page
+        return page, doc_ids, self.docs.get_many(doc_ids), next_cursor
+
+    def search(self, query, offset=0, limit=100, mode="boolean", cursor=None):
+        page, doc_ids, found, next_cursor = self._page(query, offset, limit, mode, cursor)
+        return self._results(page, self._hydrate(doc_ids, found), next_cursor)
+
+    # The same for the event loop: cached hits are paged on the loop, the
+    # index work runs on the executor (the C++ index releases the GIL),
+    # missing documents come from the async client, and identical searches
+    # in flight are computed once.
+    async def search_async(self, query, offset=0, limit=100, mode="boolean", cursor=None):
+        key = (query, offset, limit, mode, cursor)
+        return await self.coalescer.run(key, lambda: self._search_async(query, offset, limit, mode, cursor))
+
+    async def _search_async(self, query, offset, limit, mode, cursor):
+        planned = self._page(query, offset, limit, mode, cursor, cached_only=True)
+        if planned is None:
+            planned = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self._page, query, offset, limit, mode, cursor
+            )
+        page, doc_ids, found, next_cursor = planned
+        return self._results(page, await self._hydrate_async(doc_ids, found), next_cursor)
+
+    def _search_boolean(self, terms, offset, limit, after, cached_only=False):
+        generation = self.generation
+        key = ("boolean", tuple(terms))
+        doc_ids = self.cache.get(key, generation, not cached_only)
+        if doc_ids is None:
+            if cached_only:
+                return None
+            doc_ids = array("i", self.index.search(terms))
+            self.cache.put(key, generation, doc_ids, doc_ids.itemsize * len(doc_ids))
+
+        start = offset if after is None else bisect.bisect_right(doc_ids, after)
+        page = doc_ids[start:start + limit].tolist()
+        next_cursor = None
+        if page and start + limit < len(doc_ids):
+            next_cursor = self._encode_cursor("boolean", terms, page[-1])
+        return page, next_cursor
+
+    def _search_ranked(self, terms, offset, limit, cached_only=False):
+        generation = self.generation
+        depth = max(self.RANKED_DEPTH, 1 << max(offset + limit - 1, 0).bit_length())
+        depth = min(depth, self.MAX_RANKED_DEPTH)
+        key = ("ranked", tuple(terms), depth)
+        hits = self.cache.get(key, generation, not cached_only)
+        if hits is None:
+            if cached_only:
+                return None
+            ranked = self.index.search_ranked(terms, depth)
+            hits = (array("i", [doc_id for doc_id, _ in ranked]), array("d", [score for _, score in ranked]))
+            self.cache.put(key, generation, hits, 12 * len(ranked))
+
+        doc_ids, scores = hits
+        page = list(zip(doc_ids[offset:offset + limit], scores[offset:offset + limit]))
+        next_cursor = None
+        # A full depth may hide more hits, which the next page fetches deeper.
+        if page and (offset + limit < len(doc_ids) or len(doc_ids) == depth < self.MAX_RANKED_DEPTH):
+            next_cursor = self._encode_cursor("ranked", terms, offset + limit)
+        return page, next_cursor
+
+    def cache_stats(self):
+        return {**self.cache.stats(), "generation": self.generation, "coalesced": self.coalescer.stats()}
+
+    def sync_stats(self):
+        return self.sync.sync_stats() if self.sync is not None else None
+
+    def segment_stats(self):
+        if isinstance(self.index, (SegmentedIndex, ShardedIndex)):
+            return self.index.segment_stats()
+        return None
+
+    def _bump_generation(self):
+        with self.generation_lock:
+            self.generation += 1
+
+    def explain(self, query):
+        terms = process_query(query)["terms"]
+        return {"terms": terms, "plan": self.index.explain(terms)}
+
     def get_document_count(self):
         return self.index.get_document_count()
-    
+
     def get_term_count(self):
         return self.index.get_term_count()
-    
+
     def get_document_terms(self, doc_id):
         return self.index.get_document_terms(doc_id)
-    
+
     def add_document(self, doc_id, terms):
         self.index.add_document(doc_id, terms)
-        
-    def remove_document(self, doc_id, terms):
-        self.index.remove_document(doc_id, terms)
-        
+        self._bump_generation()
+
+    def remove_document(self, doc_id):
+        self.index.remove_document(doc_id)
+        self.docs.remove(doc_id)
+        self._bump_generation()
+
+    def apply_batch(self, ops):
+        self.index.apply_batch([(op["op"], op["doc_id"], op.get("terms", [])) for op in ops])
+        for op in ops:
+            if op["op"] == "remove":
+                self.docs.remove(op["doc_id"])
+            elif op.get("url") is not None:
+                self._store_doc(op)
+        self._bump_generation()
+
+    def close(self):
+        if self.sync is not None:
+            self.sync.stop()
+        self.executor.shutdown(wait=False)
+        if isinstance(self.index, (SegmentedIndex, ShardedIndex)):
+            self.index.close()
+
     def clear(self):
         self.index.clear()
-        
-        
-        
-    
-        
-        
-    
\ No newline at end of file
+        self.docs.clear()
+        self._bump_generation()
+        self.cache.clear()
@@ -0,0 +1,33 @@
+import asyncio
+
+
+class RequestCoalescer:
+    # Identical requests that arrive while one is being computed wait for
+    # its result instead of computing it again. Only for use on one event
+    # loop. A waiter that is cancelled does not cancel the shared work.
+    def __init__(self):
+        self.inflight = {}
+        self.started = 0
+        self.shared = 0
+
+    async def run(self, key, factory):
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self.inflight[key] = task
+            self.started += 1
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _finished(self, key, task):
+        if self.inflight.get(key) is task:
+            del self.inflight[key]
+        # Nobody may be left waiting for a failed task.
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        return {"started": self.started, "shared": self.shared, "inflight": len(self.inflight)}
+
@@ -1,9 +1,11 @@
 
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient, MongoClient
 from redis import Redis
 
 mongo_client = None
 mongo_collection = None
+async_mongo_client = None
+async_mongo_collection = None
 redis = None
 
 def get_mongo(mongo_uri: str, database: str, collection: str):
@@ -14,6 +16,17 @@ def get_mongo(mongo_uri: str, database: str, collection: str):
         mongo_collection = mongo_client[database][collection] 
     return mongo_client, mongo_collection
 
+# Used by the API on its event loop; pool holds client options such as
+# maxPoolSize, which api/main.py maps from the pool_* and timeout_ms keys of
+# the db config (POOL_OPTIONS).
+def get_async_mongo(mongo_uri: str, database: str, collection: str, pool: dict = None):
+    global async_mongo_client
+    global async_mongo_collection
+    if async_mongo_client is None:
+        async_mongo_client = AsyncMongoClient(mongo_uri, **(pool or {}))
+        async_mongo_collection = async_mongo_client[database][collection]
+    return async_mongo_client, async_mongo_collection
+
 def get_redis(redis_url):
     global redis
     if redis is None:
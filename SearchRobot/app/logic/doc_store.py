@@ -0,0 +1,159 @@
+import os
+import mmap
+import struct
+import threading
+from array import array
+
+
+class DocStore:
+    # url/title/domain of every indexed document, stored back to back in one
+    # string arena. offsets holds, per doc_id, where each field starts and
+    # where the last one ends (-1 for an unknown doc_id). A store loaded
+    # from disk reads from the mapped file until the first change copies it
+    # into memory.
+    FIELDS = ("url", "title", "domain")
+    STRIDE = len(FIELDS) + 1
+    MAGIC = b"SRDOCS01"
+    HEADER = struct.Struct("<8sQQ")
+    COMPACT_MIN = 1 << 20
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.mapped = None
+        self.offsets = array("q")
+        self.arena = bytearray()
+        self.garbage = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _slots(self):
+        return len(self.offsets) // self.STRIDE
+
+    def _entry(self, doc_id):
+        if doc_id < 0 or doc_id >= self._slots():
+            return None
+        base = doc_id * self.STRIDE
+        if self.offsets[base] < 0:
+            return None
+        bounds = self.offsets[base:base + self.STRIDE]
+        doc = {"doc_id": doc_id}
+        for i, field in enumerate(self.FIELDS):
+            doc[field] = str(self.arena[bounds[i]:bounds[i + 1]], "utf-8")
+        return doc
+
+    def get(self, doc_id):
+        with self.lock:
+            return self._entry(doc_id)
+
+    def get_many(self, doc_ids):
+        with self.lock:
+            found = {}
+            for doc_id in doc_ids:
+                doc = self._entry(doc_id)
+                if doc is not None:
+                    found[doc_id] = doc
+            return found
+
+    def _materialize(self):
+        if self.mapped is None:
+            return
+        offsets = array("q")
+        with self.offsets.cast("B") as raw:
+            offsets.frombytes(raw)
+        arena = bytearray(self.arena)
+        self.offsets.release()
+        self.arena.release()
+        self.mapped.close()
+        self.mapped = None
+        self.offsets = offsets
+        self.arena = arena
+
+    def _drop(self, doc_id):
+        base = doc_id * self.STRIDE
+        if doc_id < self._slots() and self.offsets[base] >= 0:
+            self.garbage += self.offsets[base + self.STRIDE - 1] - self.offsets[base]
+            self.offsets[base] = -1
+            self.count -= 1
+
+    def set(self, doc_id, url, title="", domain=""):
+        with self.lock:
+            self._materialize()
+            self._drop(doc_id)
+            slots = self._slots()
+            if doc_id >= slots:
+                grow = max(doc_id + 1, slots * 2) - slots
+                self.offsets.extend([-1] * (grow * self.STRIDE))
+            base = doc_id * self.STRIDE
+            for i, value in enumerate((url, title, domain)):
+                self.offsets[base + i] = len(self.arena)
+                self.arena += (value or "").encode("utf-8")
+            self.offsets[base + self.STRIDE - 1] = len(self.arena)
+            self.count += 1
+            self._maybe_compact()
+
+    def remove(self, doc_id):
+        with self.lock:
+            self._materialize()
+            self._drop(doc_id)
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        if self.garbage < self.COMPACT_MIN or self.garbage * 2 < len(self.arena):
+            return
+        arena = bytearray()
+        for base in range(0, len(self.offsets), self.STRIDE):
+            start = self.offsets[base]
+            if start < 0:
+                continue
+            shift = len(arena) - start
+            arena += self.arena[start:self.offsets[base + self.STRIDE - 1]]
+            for i in range(self.STRIDE):
+                self.offsets[base + i] += shift
+        self.arena = arena
+        self.garbage = 0
+
+    def clear(self):
+        with self.lock:
+            self._materialize()
+            self.offsets = array("q")
+            self.arena = bytearray()
+            self.garbage = 0
+            self.count = 0
+
+    def save(self, path):
+        with self.lock:
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(self.HEADER.pack(self.MAGIC, self._slots(), len(self.arena)))
+                f.write(self.offsets)
+                f.write(self.arena)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+
+    def load(self, path):
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+        try:
+            magic, slots, arena_size = self.HEADER.unpack_from(view)
+            offsets_end = self.HEADER.size + slots * self.STRIDE * 8
+            if magic != self.MAGIC or offsets_end + arena_size != len(view):
+                raise ValueError(f"not a document store: {path}")
+            offsets = view[self.HEADER.size:offsets_end].cast("q")
+            arena = view[offsets_end:]
+        except (ValueError, struct.error):
+            view.release()
+            mapped.close()
+            raise
+        count = sum(1 for base in range(0, len(offsets), self.STRIDE) if offsets[base] >= 0)
+        view.release()
+        with self.lock:
+            self._materialize()
+            self.mapped = mapped
+            self.offsets = offsets
+            self.arena = arena
+            self.garbage = 0
+            self.count = count
@@ -0,0 +1,99 @@
+import re
+from hashlib import sha256
+from lxml import etree
+
+CLASS_NAME = re.compile(r"^[\w-]+$")
+
+# Text that get_text() of the old BeautifulSoup extraction skipped.
+TEXT = etree.XPath(
+    "descendant-or-self::text()[not(ancestor::script or ancestor::style or ancestor::template)]",
+    smart_strings=False,
+)
+TITLE = etree.XPath("(//title)[1]")
+
+
+def _checked(name):
+    if not isinstance(name, str) or not CLASS_NAME.match(name):
+        raise ValueError(f"bad class or id in extraction rules: {name!r}")
+    return name
+
+
+def _has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {_checked(name)} ')"
+
+
+def _has_class_prefix(prefix):
+    return f"contains(concat(' ', normalize-space(@class)), ' {_checked(prefix)}')"
+
+
+class SiteRule:
+    # One entry of the `extraction.sites` config: the article container,
+    # found by `class` or `id`, and optionally `parts` - class prefixes of
+    # the blocks inside it that make up the text (the rest is dropped).
+    def __init__(self, rule):
+        if "id" in rule:
+            root = f"@id = '{_checked(rule['id'])}'"
+        elif "class" in rule:
+            root = _has_class(rule["class"])
+        else:
+            raise ValueError(f"extraction rule needs a class or an id: {rule!r}")
+        self.root = etree.XPath(f"(//*[{root}])[1]")
+        self.parts = None
+        if rule.get("parts"):
+            test = " or ".join(_has_class_prefix(p) for p in rule["parts"])
+            self.parts = etree.XPath(f"descendant::*[{test}]")
+
+    def extract(self, tree):
+        found = self.root(tree)
+        if not found:
+            return ""
+        if self.parts is None:
+            return element_text(found[0])
+        return "".join(element_text(part) + "\n" for part in self.parts(found[0]))
+
+
+def element_text(element):
+    return "\n".join(s for s in (t.strip() for t in TEXT(element)) if s)
+
+
+class ContentExtractor:
+    def __init__(self, sites=None):
+        self.rules = {domain: SiteRule(rule) for domain, rule in (sites or {}).items()}
+        # Pages arrive decoded; they are re-encoded as utf-8 so the parser
+        # must not trust a <meta charset> from the page.
+        self.parser = etree.HTMLParser(encoding="utf-8", remove_comments=True, remove_pis=True)
+
+    def parse(self, html):
+        if not html or html.isspace():
+            return None
+        try:
+            return etree.fromstring(html.encode("utf-8"), self.parser)
+        except etree.XMLSyntaxError:
+            return None
+
+    def extract(self, html, domain):
+        tree = self.parse(html)
+        if tree is None:
+            return {"title": "", "content": "", "content_hash": hash_content("")}
+        title = TITLE(tree)
+        title = title[0].text.strip() if title and len(title[0]) == 0 and title[0].text else ""
+        rule = self.rules.get(domain)
+        content = rule.extract(tree) if rule is not None else element_text(tree)
+        return {"title": title, "content": content, "content_hash": hash_content(content)}
+
+
+def hash_content(content):
+    return sha256(content.encode("utf-8")).hexdigest()
+
+
+# Process pool entry points: every worker compiles the rules once.
+_worker_extractor = None
+
+
+def init_worker(sites):
+    global _worker_extractor
+    _worker_extractor = ContentExtractor(sites)
+
+
+def extract_page(html, domain):
+    return _worker_extractor.extract(html, domain)
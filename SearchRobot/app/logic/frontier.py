@@ -0,0 +1,92 @@
+import time
+
+# Moves at most ARGV[2] urls due by ARGV[1] to the crawl queue in one step,
+# so several drainers never push the same url twice. Moved urls stay in
+# the frontier, due again ARGV[3] seconds later: the crawl of a page puts
+# its real next visit in place, and a page whose crawl failed is retried.
+# Lua's unpack takes only about 8000 values, so the urls are written 500
+# at a time.
+DRAIN_SCRIPT = """
+local urls = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #urls == 0 then
+    return 0
+end
+local retry = tonumber(ARGV[1]) + tonumber(ARGV[3])
+for start = 1, #urls, 500 do
+    local due = {}
+    local queued = {}
+    for i = start, math.min(start + 499, #urls) do
+        due[#due + 1] = retry
+        due[#due + 1] = urls[i]
+        queued[#queued + 1] = cjson.encode({url = urls[i]})
+    end
+    redis.call('ZADD', KEYS[1], unpack(due))
+    redis.call('LPUSH', KEYS[2], unpack(queued))
+end
+return #urls
+"""
+
+
+class RecrawlFrontier:
+    # Pages waiting for their next visit, in a sorted set scored by the
+    # time the visit is due. The revisit interval of a page follows how
+    # often it changes: halved after a visit that found new content,
+    # doubled after one that did not, within [min_interval, max_interval].
+    SCHEDULE_CHUNK = 10000
+
+    def __init__(self, redis, key="crawler:frontier", queue_key="crawler:queue",
+                 initial_interval=7 * 86400, min_interval=6 * 3600, max_interval=60 * 86400):
+        self.redis = redis
+        self.key = key
+        self.queue_key = queue_key
+        self.initial_interval = initial_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.drain_script = redis.register_script(DRAIN_SCRIPT)
+
+    def __len__(self):
+        return self.redis.zcard(self.key)
+
+    def next_interval(self, interval, changed):
+        if not interval:
+            return self.initial_interval
+        interval = interval / 2 if changed else interval * 2
+        return int(min(self.max_interval, max(self.min_interval, interval)))
+
+    def schedule(self, due):
+        items = list(due.items())
+        for start in range(0, len(items), self.SCHEDULE_CHUNK):
+            self.redis.zadd(self.key, dict(items[start:start + self.SCHEDULE_CHUNK]))
+
+    def drain(self, limit=1000, now=None):
+        return self.drain_script(
+            keys=[self.key, self.queue_key],
+            args=[now or time.time(), limit, self.initial_interval],
+        )
+
+    # Fills an empty frontier from the stored pages, e.g. the first time
+    # the crawler starts with it or after Redis lost its data.
+    def seed(self, docs):
+        due = {}
+        total = 0
+        for doc in docs:
+            last = doc.get("last_crawled")
+            if not doc.get("url") or not last:
+                continue
+            due[doc["url"]] = last.timestamp() + (doc.get("revisit_interval") or self.initial_interval)
+            if len(due) == self.SCHEDULE_CHUNK:
+                total += len(due)
+                self.schedule(due)
+                due = {}
+        total += len(due)
+        self.schedule(due)
+        return total
+
+
+def frontier_from_settings(redis, settings):
+    return RecrawlFrontier(
+        redis,
+        initial_interval=settings.getint("RECRAWL_INITIAL_INTERVAL", 7 * 86400),
+        min_interval=settings.getint("RECRAWL_MIN_INTERVAL", 6 * 3600),
+        max_interval=settings.getint("RECRAWL_MAX_INTERVAL", 60 * 86400),
+    )
@@ -0,0 +1,289 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from pymongo.errors import OperationFailure, PyMongoError
+
+# Fields of a page that the index or the document store use; updates that
+# touch none of them (a re-crawl of an unchanged page) are not streamed.
+INDEXED_FIELDS = ("doc_id", "terms", "duplicate_of", "url", "title", "domain")
+# Change stream errors after which the stream is reopened from scratch
+# rather than resumed: the token is unknown or the oplog no longer has it.
+RESUME_ERRORS = {260, 280, 286}
+# Standalone servers have no change streams.
+NOT_REPLICA_SET = 40573
+
+
+def change_pipeline():
+    return [
+        {"$match": {"$or": [
+            {"operationType": {"$in": ["insert", "replace", "delete"]}},
+            *({f"updateDescription.updatedFields.{field}": {"$exists": True}} for field in INDEXED_FIELDS),
+        ]}},
+        {"$project": {
+            "operationType": 1,
+            "clusterTime": 1,
+            **{f"fullDocument.{field}": 1 for field in INDEXED_FIELDS},
+            "fullDocumentBeforeChange.doc_id": 1,
+        }},
+    ]
+
+
+# indexed_at is set by the server on every write of the indexed fields and
+# comes back as a naive UTC datetime.
+def written_at(doc):
+    return doc["indexed_at"].replace(tzinfo=timezone.utc).timestamp()
+
+
+def index_op(doc, codec):
+    # A page found to be a near-duplicate leaves the index.
+    if doc.get("duplicate_of") is not None:
+        return {"op": "remove", "doc_id": doc["doc_id"]}
+    return {
+        "op": "replace",
+        "doc_id": doc["doc_id"],
+        "terms": codec.terms(doc),
+        "url": doc.get("url", ""),
+        "title": doc.get("title", ""),
+        "domain": doc.get("domain", ""),
+    }
+
+
+class IndexSync:
+    # Applies the writes to the pages collection to a MongoBooleanIndex in
+    # batches. Tails a change stream where the server has one, otherwise
+    # polls for pages by indexed_at, the server time of their last write,
+    # re-reading margin seconds back since a write may become visible a
+    # little after that time. Polling cannot see deleted pages; they leave
+    # the index at its next rebuild.
+    #
+    # The position reached (resume token or polling time) is saved next to
+    # the index snapshot, so a restart continues from the snapshot instead
+    # of rebuilding or replaying.
+    def __init__(self, index, collection, checkpoint_path=None, mode="auto", batch_size=500,
+                 batch_interval=1.0, poll_interval=5.0, poll_margin=60.0):
+        if mode not in ("auto", "stream", "poll"):
+            raise ValueError(f"unknown index sync mode {mode}")
+        self.index = index
+        self.collection = collection
+        self.checkpoint_path = checkpoint_path
+        self.mode = mode
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.poll_interval = poll_interval
+        self.poll_margin = poll_margin
+        self.stream = None
+        self.resume_token = None
+        self.polled_until = None
+        # indexed_at of the pages applied in the last margin window, so that
+        # re-reading the window does not apply them again.
+        self.recent = {}
+        # clusterTime / indexed_at of the oldest change read but not yet
+        # applied.
+        self.oldest_pending = None
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.stats = {"applied": 0, "batches": 0, "errors": 0, "unresolved_deletes": 0, "last_applied_at": None}
+
+    # Checkpoints
+
+    def load_checkpoint(self):
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return None
+        try:
+            with open(self.checkpoint_path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Index sync checkpoint {self.checkpoint_path} is not usable: {e}")
+            return None
+
+    def checkpoint(self):
+        if self.stream is not None:
+            return {"mode": "stream", "resume_token": self.resume_token}
+        return {"mode": "poll", "polled_until": self.polled_until}
+
+    def save_checkpoint(self, checkpoint):
+        if not self.checkpoint_path:
+            return
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    # Opening
+
+    def _watch(self, resume_token=None):
+        stream = self.collection.watch(
+            change_pipeline(),
+            full_document="updateLookup",
+            full_document_before_change="whenAvailable",
+            resume_after=resume_token,
+            max_await_time_ms=int(self.batch_interval * 1000),
+        )
+        self.resume_token = stream.resume_token
+        return stream
+
+    def _enable_pre_images(self):
+        # Deletes carry only the _id; the pre-image has the doc_id.
+        try:
+            self.collection.database.command(
+                "collMod", self.collection.name, changeStreamPreAndPostImages={"enabled": True}
+            )
+        except OperationFailure as e:
+            print(f"Index sync: no pre-images for deletes ({e})")
+
+    def open(self, checkpoint=None):
+        # Opens the change stream or sets up polling before the index is
+        # built or loaded, so nothing written meanwhile is missed. Returns
+        # whether the checkpoint was resumed, i.e. the index needs no replay.
+        if self.mode != "poll":
+            try:
+                token = checkpoint.get("resume_token") if checkpoint and checkpoint.get("mode") == "stream" else None
+                try:
+                    self.stream = self._watch(token)
+                except OperationFailure as e:
+                    if token is None or e.code not in RESUME_ERRORS:
+                        raise
+                    print(f"Index sync: cannot resume the change stream ({e}), starting from now")
+                    self.stream = self._watch()
+                    token = None
+                self._enable_pre_images()
+                print("Index sync: following the change stream")
+                return token is not None
+            except OperationFailure as e:
+                if self.mode == "stream" or e.code != NOT_REPLICA_SET:
+                    raise
+                print("Index sync: no change streams on a standalone server, polling")
+        if checkpoint and checkpoint.get("mode") == "poll" and checkpoint.get("polled_until"):
+            self.polled_until = checkpoint["polled_until"]
+            return True
+        self.polled_until = time.time()
+        return False
+
+    def start(self):
+        target = self._follow_stream if self.stream is not None else self._poll
+        self.thread = threading.Thread(target=target, name="index-sync", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(10.0)
+        if self.stream is not None:
+            self.stream.close()
+
+    # Applying
+
+    def _apply(self, ops, count):
+        if ops:
+            self.index.apply_batch(ops)
+        self.stats["applied"] += count
+        self.stats["batches"] += 1
+        self.stats["last_applied_at"] = time.time()
+        self.oldest_pending = None
+
+    def _change_op(self, change):
+        if change["operationType"] == "delete":
+            doc_id = (change.get("fullDocumentBeforeChange") or {}).get("doc_id")
+            if doc_id is None:
+                self.stats["unresolved_deletes"] += 1
+                return None
+            return {"op": "remove", "doc_id": doc_id}
+        doc = change.get("fullDocument")
+        # Gone by the time of the lookup: its delete follows in the stream.
+        if not doc or doc.get("doc_id") is None:
+            return None
+        return index_op(doc, self.index.codec)
+
+    def _follow_stream(self):
+        while not self.stop_event.is_set():
+            try:
+                self._drain_stream()
+            except PyMongoError as e:
+                self.stats["errors"] += 1
+                print(f"Index sync: change stream failed: {e}")
+                self.stop_event.wait(self.poll_interval)
+                if self.stop_event.is_set():
+                    return
+                try:
+                    self.stream.close()
+                    self.stream = self._watch(self.resume_token)
+                except PyMongoError as e:
+                    print(f"Index sync: cannot reopen the change stream: {e}")
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"Index sync: cannot apply changes: {e}")
+                self.stop_event.wait(self.poll_interval)
+
+    def _drain_stream(self):
+        ops = []
+        count = 0
+        deadline = time.monotonic() + self.batch_interval
+        while not self.stop_event.is_set():
+            change = self.stream.try_next()
+            if change is not None:
+                count += 1
+                if self.oldest_pending is None:
+                    self.oldest_pending = change["clusterTime"].time
+                op = self._change_op(change)
+                if op is not None:
+                    ops.append(op)
+            if count and (count >= self.batch_size or change is None or time.monotonic() >= deadline):
+                self._apply(ops, count)
+                ops = []
+                count = 0
+                deadline = time.monotonic() + self.batch_interval
+            if count == 0:
+                # Only past applied changes (or none at all).
+                self.resume_token = self.stream.resume_token
+
+    def _poll(self):
+        while not self.stop_event.is_set():
+            try:
+                self._poll_once()
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"Index sync: polling failed: {e}")
+            self.stop_event.wait(self.poll_interval)
+
+    def _poll_once(self):
+        since = datetime.fromtimestamp(self.polled_until - self.poll_margin, timezone.utc)
+        cursor = self.collection.find(
+            {"indexed_at": {"$gte": since}},
+            {field: 1 for field in (*INDEXED_FIELDS, "indexed_at")},
+            batch_size=self.batch_size,
+        ).sort("indexed_at", 1)
+        ops = []
+        newest = self.polled_until
+        for doc in cursor:
+            if doc.get("doc_id") is None:
+                continue
+            written = written_at(doc)
+            if self.recent.get(doc["doc_id"]) == written:
+                continue
+            if self.oldest_pending is None:
+                self.oldest_pending = written
+            self.recent[doc["doc_id"]] = written
+            newest = max(newest, written)
+            ops.append(index_op(doc, self.index.codec))
+            if len(ops) == self.batch_size:
+                self._apply(ops, len(ops))
+                ops = []
+        if ops:
+            self._apply(ops, len(ops))
+        self.polled_until = newest
+        horizon = newest - self.poll_margin
+        self.recent = {doc_id: written for doc_id, written in self.recent.items() if written >= horizon}
+
+    def lag(self):
+        # Age of the oldest change read but not applied yet; 0 when caught up.
+        oldest = self.oldest_pending
+        return max(0.0, time.time() - oldest) if oldest is not None else 0.0
+
+    def sync_stats(self):
+        return {
+            "mode": "stream" if self.stream is not None else "poll",
+            "lag_seconds": round(self.lag(), 3),
+            **self.stats,
+        }
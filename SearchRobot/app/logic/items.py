@@ -11,6 +11,7 @@ class PageItem(Item):
     content = Field()
     content_hash = Field()
     terms = Field()
-    terms_count = Field()    
+    terms_count = Field()
+    duplicate_of = Field()    
 
     
\ No newline at end of file
@@ -0,0 +1,80 @@
+import numpy as np
+
+
+class MinHashIndex:
+    # MinHash signatures of canonical pages by url, banded for LSH: pages
+    # that share all rows of at least one band become candidates, and a
+    # candidate is a near-duplicate when the share of equal signature
+    # positions (the estimated Jaccard similarity) reaches the threshold.
+    def __init__(self, threshold=0.6, num_hashes=128, bands=32):
+        if num_hashes % bands:
+            raise ValueError(f"num_hashes ({num_hashes}) must be a multiple of bands ({bands})")
+        self.threshold = threshold
+        self.num_hashes = num_hashes
+        self.bands = bands
+        self.rows = num_hashes // bands
+        self.signatures = {}
+        self.buckets = {}
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def _keys(self, signature):
+        raw = signature.tobytes()
+        width = self.rows * signature.itemsize
+        return [(band, raw[band * width:(band + 1) * width]) for band in range(self.bands)]
+
+    def find(self, signature, url=None):
+        best = None
+        seen = set()
+        for key in self._keys(signature):
+            for other in self.buckets.get(key, ()):
+                if other == url or other in seen:
+                    continue
+                seen.add(other)
+                similarity = float(np.count_nonzero(self.signatures[other] == signature)) / self.num_hashes
+                if similarity >= self.threshold and (best is None or similarity > best[1]):
+                    best = (other, similarity)
+        return best
+
+    def add(self, url, signature):
+        self.remove(url)
+        self.signatures[url] = signature
+        for key in self._keys(signature):
+            self.buckets.setdefault(key, []).append(url)
+
+    def remove(self, url):
+        signature = self.signatures.pop(url, None)
+        if signature is None:
+            return
+        for key in self._keys(signature):
+            bucket = self.buckets[key]
+            bucket.remove(url)
+            if not bucket:
+                del self.buckets[key]
+
+
+class RedisMinHashIndex(MinHashIndex):
+    # The same index kept in memory and written through to a Redis hash
+    # (url -> signature bytes), from which every crawler process loads it
+    # at start.
+    def __init__(self, redis, key, threshold=0.6, num_hashes=128, bands=32):
+        super().__init__(threshold, num_hashes, bands)
+        self.redis = redis
+        self.key = key
+
+    def load(self):
+        for url, raw in self.redis.hscan_iter(self.key, count=1000):
+            signature = np.frombuffer(raw, dtype=np.uint32)
+            if len(signature) == self.num_hashes:
+                super().add(url.decode("utf-8"), signature)
+        return len(self)
+
+    def add(self, url, signature):
+        super().add(url, signature)
+        self.redis.hset(self.key, url, signature.tobytes())
+
+    def remove(self, url):
+        if url in self.signatures:
+            self.redis.hdel(self.key, url)
+        super().remove(url)
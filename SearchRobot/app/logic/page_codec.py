@@ -0,0 +1,204 @@
+import threading
+import numpy as np
+import zstandard
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+
+DUPLICATE_KEY = 11000
+
+
+def encode_varints(ids):
+    # LEB128: 7 bits per byte, the high bit set on all bytes but the last.
+    values = np.asarray(ids, dtype=np.int64)
+    if not len(values):
+        return b""
+    lengths = np.ones(len(values), dtype=np.int64)
+    for shift in range(7, 63, 7):
+        lengths += values >= (1 << shift)
+    starts = np.cumsum(lengths) - lengths
+    out = np.empty(int(starts[-1] + lengths[-1]), dtype=np.uint8)
+    for k in range(int(lengths.max())):
+        mask = lengths > k
+        more = np.where(lengths[mask] > k + 1, 0x80, 0)
+        out[starts[mask] + k] = ((values[mask] >> (7 * k)) & 0x7f) | more
+    return out.tobytes()
+
+
+def decode_varints(blob):
+    data = np.frombuffer(blob, dtype=np.uint8)
+    if not len(data):
+        return np.empty(0, dtype=np.int64)
+    last = (data & 0x80) == 0
+    starts = np.flatnonzero(np.concatenate(([True], last[:-1])))
+    # Place of every byte within its value.
+    place = np.arange(len(data)) - np.repeat(starts, np.diff(np.append(starts, len(data))))
+    return np.add.reduceat((data & 0x7f).astype(np.int64) << (7 * place), starts)
+
+
+class TermDictionary:
+    # Global term ids of the compact page format: a collection of
+    # {_id: id, term} with ids from the "term_id" counter, cached in memory.
+    # Writers that race on a new term keep the id that was stored first.
+    def __init__(self, database, name="terms"):
+        self.collection = database[name]
+        self.counter = database["counter"]
+        self.ids = {}
+        self.terms = []
+        self.vocab = None
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def ensure_index(self):
+        self.collection.create_index("term", unique=True)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _remember(self, term_id, term):
+        if term_id >= len(self.terms):
+            self.terms.extend([None] * (term_id + 1 - len(self.terms)))
+        self.terms[term_id] = term
+        self.ids[term] = term_id
+        self.vocab = None
+
+    def load(self):
+        with self.lock:
+            for doc in self.collection.find({}, {"term": 1}):
+                self._remember(doc["_id"], doc["term"])
+            self.loaded = True
+
+    def assign(self, terms):
+        # Gives ids to the terms that have none yet, in the order given.
+        new = [term for term in dict.fromkeys(terms) if term not in self.ids]
+        if not new:
+            return
+        with self.lock:
+            for doc in self.collection.find({"term": {"$in": new}}, {"term": 1}):
+                self._remember(doc["_id"], doc["term"])
+            new = [term for term in new if term not in self.ids]
+            if not new:
+                return
+            seq = self.counter.find_one_and_update(
+                {"_id": "term_id"},
+                {"$inc": {"seq": len(new)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )["seq"]
+            docs = [{"_id": seq - len(new) + i, "term": term} for i, term in enumerate(new)]
+            lost = []
+            try:
+                self.collection.insert_many(docs, ordered=False)
+            except BulkWriteError as e:
+                if any(error["code"] != DUPLICATE_KEY for error in e.details["writeErrors"]):
+                    raise
+                lost = [docs[error["index"]]["term"] for error in e.details["writeErrors"]]
+            for doc in docs:
+                if doc["term"] not in lost:
+                    self._remember(doc["_id"], doc["term"])
+            if lost:
+                for doc in self.collection.find({"term": {"$in": lost}}, {"term": 1}):
+                    self._remember(doc["_id"], doc["term"])
+
+    def encode(self, terms):
+        self.assign(terms)
+        return encode_varints([self.ids[term] for term in terms])
+
+    def _fetch(self, ids):
+        with self.lock:
+            if not self.loaded:
+                self.loaded = True
+                query = {}
+            else:
+                query = {"_id": {"$in": [int(term_id) for term_id in ids]}}
+            for doc in self.collection.find(query, {"term": 1}):
+                self._remember(doc["_id"], doc["term"])
+
+    def decode(self, blob):
+        return self.lookup(decode_varints(blob))
+
+    def lookup(self, ids):
+        if not len(ids):
+            return []
+        for attempt in range(2):
+            vocab = self.vocab
+            if vocab is None:
+                vocab = self.vocab = np.array(self.terms + [None], dtype=object)
+            # Ids past the end map to the trailing None.
+            terms = vocab[np.minimum(ids, len(vocab) - 1)]
+            unknown = terms == None  # noqa: E711
+            if not unknown.any():
+                return terms.tolist()
+            if attempt == 0:
+                # The first unknown id loads the whole dictionary, later
+                # ones (terms added since) only what is missing.
+                self._fetch(np.unique(ids[unknown]))
+        raise ValueError(f"unknown term ids {np.unique(ids[unknown])[:10].tolist()}")
+
+
+class PageCodec:
+    # Reads and writes the terms and content of pages. In the compact
+    # format terms are a varint blob of TermDictionary ids and content is
+    # zstd-compressed UTF-8; plain pages keep the string array and text.
+    # Readers accept both, so a collection can be migrated in place.
+    def __init__(self, database, compact=False, zstd_level=3):
+        self.compact = compact
+        self.zstd_level = zstd_level
+        self.dictionary = TermDictionary(database)
+        self.local = threading.local()
+
+    def _compressor(self):
+        # zstd contexts are not thread-safe.
+        if not hasattr(self.local, "compressor"):
+            self.local.compressor = zstandard.ZstdCompressor(level=self.zstd_level)
+            self.local.decompressor = zstandard.ZstdDecompressor()
+        return self.local.compressor, self.local.decompressor
+
+    def encode_terms(self, terms, compact=None):
+        if compact if compact is not None else self.compact:
+            return self.dictionary.encode(terms)
+        return list(terms)
+
+    def encode_content(self, content, compact=None):
+        if compact if compact is not None else self.compact:
+            return self._compressor()[0].compress(content.encode("utf-8"))
+        return content
+
+    def decode_terms(self, value):
+        if value is None:
+            return []
+        if isinstance(value, bytes):
+            return self.dictionary.decode(value)
+        return value
+
+    def decode_content(self, value):
+        if value is None:
+            return ""
+        if isinstance(value, bytes):
+            return str(self._compressor()[1].decompress(value), "utf-8")
+        return value
+
+    def terms(self, doc):
+        return self.decode_terms(doc.get("terms"))
+
+    def terms_many(self, docs):
+        # The terms of many pages; their blobs are decoded in one go, which
+        # saves the per-call overhead of numpy on short pages.
+        values = [doc.get("terms") for doc in docs]
+        blobs = [value for value in values if isinstance(value, bytes)]
+        if len(blobs) < 2:
+            return [self.decode_terms(value) for value in values]
+        joined = b"".join(blobs)
+        ends = np.flatnonzero(np.frombuffer(joined, dtype=np.uint8) < 0x80)
+        bounds = np.searchsorted(ends, np.cumsum([len(blob) for blob in blobs]) - 1, side="right").tolist()
+        terms = self.dictionary.decode(joined)
+        decoded = iter(terms[start:end] for start, end in zip([0] + bounds[:-1], bounds))
+        return [next(decoded) if isinstance(value, bytes) else self.decode_terms(value) for value in values]
+
+    def content(self, doc):
+        return self.decode_content(doc.get("content"))
+
+    def same_terms(self, stored, encoded, terms):
+        # Compares without decoding when both are in the same format.
+        if isinstance(stored, bytes) == isinstance(encoded, bytes):
+            return stored == encoded
+        return self.decode_terms(stored) == list(terms)
@@ -1,63 +1,78 @@
-import re
-import requests
-from pymongo import MongoClient
-from bs4 import BeautifulSoup
-from hashlib import sha256
-from scrapy.exceptions import DropItem
-from cpp.text_processor_cpp import process_document
+import time
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+from scrapy.exceptions import DropItem, NotConfigured
+from collections import deque
+from twisted.internet import defer, threads
+from cpp.text_processor_cpp import process_document, minhash
+from logic.db import get_redis
+from logic.frontier import frontier_from_settings
+from logic.near_duplicates import RedisMinHashIndex
+from logic.page_codec import PageCodec
+from logic.extractor import ContentExtractor, init_worker, extract_page
 
 class ExtractContentPipeline:
-    def _extract_title(self, soup):
-        title_tag = soup.find('title')
-        if title_tag and title_tag.string:
-            return title_tag.string.strip()
-        return ''
-    
-    def _extract_content(self, soup, domain):
-        if domain == 'www.sport-express.ru':
-            main_content = soup.find(class_='se-material-page__body')
-            if not main_content:
-                return ''
-            return main_content.get_text(separator='\n', strip=True)
-        if domain == 'www.championat.com':
-            main_content = soup.find(class_='page-main')
-            if not main_content:
-                return ''
-            return main_content.get_text(separator='\n', strip=True)
-        if domain == 'www.sovsport.ru':
-            main_content = soup.find(id='content-column')
-            if not main_content:
-                return ''
-            prefixes = ['news-by-id_navigation',
-                        'news-by-id_header',
-                        'content-controller_text-editor']
-            pattern = re.compile(rf'^({"|".join(re.escape(p) for p in prefixes)})')
-            matching_elements = main_content.find_all(class_=pattern)
-            all_text = ""
-            for elem in matching_elements:
-                all_text += elem.get_text(separator='\n', strip=True) + '\n'
-            return all_text
-        
-        main_content = soup.get_text(separator='\n', strip=True)
-        if main_content:
-            return main_content
-        return ''
-        
-    def _hash_content(self, content):
-        if not isinstance(content, str):
-            return ''
-        return sha256(content.encode('utf-8')).hexdigest()
-    
-    def process_item(self, item):
-        html = item['html']
-        soup = BeautifulSoup(html, 'html.parser')
-        
-        item['title'] = self._extract_title(soup)
-        item['content'] = self._extract_content(soup, item['domain'])
-        item['content_hash'] = self._hash_content(item['content'])
-        
+    # Pages are parsed with lxml using the per-site rules from the
+    # `extraction` config. With workers > 0 the parsing runs in a process
+    # pool and the item waits on a Deferred, so the reactor keeps downloading.
+    def __init__(self, sites=None, workers=0):
+        self.sites = sites or {}
+        self.workers = workers
+        self.extractor = ContentExtractor(self.sites)
+        self.pool = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            crawler.settings.getdict("EXTRACTION_SITES"),
+            crawler.settings.getint("EXTRACTION_WORKERS", 0),
+        )
+
+    def open_spider(self):
+        if self.workers > 0:
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker,
+                initargs=(self.sites,),
+            )
+
+    def close_spider(self):
+        if self.pool is not None:
+            return threads.deferToThread(self.pool.shutdown)
+
+    def _fill(self, extracted, item):
+        item['title'] = extracted['title']
+        item['content'] = extracted['content']
+        item['content_hash'] = extracted['content_hash']
         return item
 
+    def process_item(self, item):
+        if self.pool is None:
+            return self._fill(self.extractor.extract(item['html'], item['domain']), item)
+        d = _deferred_from_future(self.pool.submit(extract_page, item['html'], item['domain']))
+        d.addCallback(self._fill, item)
+        return d
+
+
+def _deferred_from_future(future):
+    from twisted.internet import reactor
+    d = defer.Deferred()
+
+    def done(f):
+        error = f.exception()
+        if error is not None:
+            reactor.callFromThread(d.errback, error)
+        else:
+            reactor.callFromThread(d.callback, f.result())
+
+    future.add_done_callback(done)
+    return d
+
 
 class TextProcessorPipeline:
     def process_item(self, item):
@@ -67,12 +82,96 @@ class TextProcessorPipeline:
         return item
 
 
+class NearDuplicatePipeline:
+    # Pages whose MinHash similarity to an already seen page reaches the
+    # threshold are stored as a link to that canonical page (`duplicate_of`)
+    # and are kept out of the index. Short pages are not checked. The index
+    # writes through to Redis, so checks run in the reactor's thread pool,
+    # with the index under a lock.
+    def __init__(self, redis_url, key="crawler:minhash", threshold=0.6,
+                 num_hashes=128, bands=32, shingle_size=3, min_terms=50, stats=None):
+        self.redis_url = redis_url
+        self.key = key
+        self.threshold = threshold
+        self.num_hashes = num_hashes
+        self.bands = bands
+        self.shingle_size = shingle_size
+        self.min_terms = min_terms
+        self.stats = stats
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("NEAR_DUPLICATES_ENABLED", False):
+            raise NotConfigured
+        return cls(
+            crawler.settings["REDIS_URL"],
+            crawler.settings.get("NEAR_DUPLICATES_KEY", "crawler:minhash"),
+            crawler.settings.getfloat("NEAR_DUPLICATES_THRESHOLD", 0.6),
+            crawler.settings.getint("NEAR_DUPLICATES_NUM_HASHES", 128),
+            crawler.settings.getint("NEAR_DUPLICATES_BANDS", 32),
+            crawler.settings.getint("NEAR_DUPLICATES_SHINGLE_SIZE", 3),
+            crawler.settings.getint("NEAR_DUPLICATES_MIN_TERMS", 50),
+            crawler.stats,
+        )
+
+    def open_spider(self):
+        self.index = RedisMinHashIndex(
+            get_redis(self.redis_url), self.key, self.threshold, self.num_hashes, self.bands
+        )
+        print(f"Loaded {self.index.load()} page signatures")
+
+    def _inc_stat(self, key):
+        if self.stats is not None:
+            self.stats.inc_value(f"near_duplicates/{key}")
+
+    def _check(self, item):
+        self._inc_stat("checked")
+        signature = minhash(item['terms'], self.num_hashes, self.shingle_size)
+        with self.lock:
+            match = self.index.find(signature, item['url'])
+            if match is None:
+                self.index.add(item['url'], signature)
+                return item
+            self.index.remove(item['url'])
+        self._inc_stat("found")
+        item['duplicate_of'] = match[0]
+        item['terms'] = []
+        item['terms_count'] = 0
+        return item
+
+    def process_item(self, item):
+        item['duplicate_of'] = None
+        if len(item['terms']) < self.min_terms:
+            return item
+        return threads.deferToThread(self._check, item)
+
+
 class SaveMongoBooleanIndexPipeline:
-    def __init__(self, uri, db, collection, index_api_url):
+    # Items are handed to a writer thread through a bounded queue. The
+    # thread stores them in Mongo with one bulk_write per batch; the index
+    # in the API follows the collection by itself (logic.index_sync).
+    STOP = object()
+    ADMIT_INTERVAL = 0.1
+
+    def __init__(self, uri, db, collection,
+                 batch_size=100, flush_interval=5.0, stats=None,
+                 queue_size=1000, doc_id_block=1000, frontier=None,
+                 compact_storage=False, zstd_level=3):
         self.uri = uri
         self.db = db
         self.collection_name = collection
-        self.index_api_url = index_api_url
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stats = stats
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.waiting = deque()
+        self.doc_id_block = doc_id_block
+        self.next_doc_id = 0
+        self.last_doc_id = -1
+        self.frontier = frontier
+        self.compact_storage = compact_storage
+        self.zstd_level = zstd_level
     
     @classmethod
     def from_crawler(cls, crawler):
@@ -80,7 +179,14 @@ class SaveMongoBooleanIndexPipeline:
             crawler.settings["MONGO_URI"],
             crawler.settings["MONGO_DATABASE"],
             crawler.settings["MONGO_COLLECTION"],
-            crawler.settings.get("INDEX_API_URL", "http://localhost:8000"),
+            crawler.settings.getint("INDEX_BATCH_SIZE", 100),
+            crawler.settings.getfloat("INDEX_FLUSH_INTERVAL", 5.0),
+            crawler.stats,
+            crawler.settings.getint("WRITE_QUEUE_SIZE", 1000),
+            crawler.settings.getint("DOC_ID_BLOCK_SIZE", 1000),
+            frontier_from_settings(get_redis(crawler.settings["REDIS_URL"]), crawler.settings),
+            crawler.settings.getbool("COMPACT_STORAGE", False),
+            crawler.settings.getint("CONTENT_ZSTD_LEVEL", 3),
         )
         
     def open_spider(self):
@@ -88,91 +194,201 @@ class SaveMongoBooleanIndexPipeline:
         self.collection = self.client[self.db][self.collection_name]
         self.collection.create_index("url", unique=True)
         self.collection.create_index("doc_id", unique=True)
+        self.collection.create_index("indexed_at")
         
+        # Terms and content are written in the compact format if enabled;
+        # pages stored in either format are read.
+        self.codec = PageCodec(self.client[self.db], self.compact_storage, self.zstd_level)
+        if self.compact_storage:
+            self.codec.dictionary.ensure_index()
+
         self.counter = self.client[self.db]['counter']
         self.counter.update_one(
             {'_id': 'doc_id'},
             {'$setOnInsert': {'seq': 0}},
             upsert=True
         )
+
+        self.started = time.monotonic()
+        self.writer = threading.Thread(target=self._write_loop, name="mongo-writer", daemon=True)
+        self.writer.start()
+
+    def close_spider(self):
+        return threads.deferToThread(self._stop_writer)
+
+    def _stop_writer(self):
+        self.queue.put(self.STOP)
+        self.writer.join()
+        self.client.close()
+        elapsed = time.monotonic() - self.started
+        if self.stats is not None and elapsed > 0:
+            items = self.stats.get_value("index_pipeline/items", 0)
+            self.stats.set_value("index_pipeline/items_per_second", round(items / elapsed, 2))
     
-    def _get_next_doc_id(self):
-        counter = self.counter.find_one_and_update(
-            {'_id': 'doc_id'},
-            {'$inc': {'seq': 1}},
-            return_document=True
-        )
-        if not counter:
-            raise DropItem("Counter not found")
-        return counter['seq']
-        
-    def _index_add(self, doc_id: int, terms: list[str]):
-        url = f"{self.index_api_url}/document/{doc_id}"
-        try:
-            resp = requests.post(url, json=terms)
-            resp.raise_for_status()
-        except Exception as e:
-            spider_logger = getattr(self, 'logger', None)
-            if spider_logger:
-                spider_logger.error(f"Error adding in index (doc_id={doc_id}): {e}")
-            else:
-                print(f"Error adding in index: {e}")
-
-    def _index_remove(self, doc_id: int, terms: list[str]):
-        url = f"{self.index_api_url}/document/{doc_id}"
-        try:
-            resp = requests.delete(url, json=terms)
-            resp.raise_for_status()
-        except Exception as e:
-            spider_logger = getattr(self, 'logger', None)
-            if spider_logger:
-                spider_logger.error(f"Error removing from index (doc_id={doc_id}): {e}")
-            else:
-                print(f"Error removing from index: {e}")
-    
-    def process_item(self, item):
-        url = item["url"]
-        new_hash = item["content_hash"]
-        new_terms = item["terms"]
-        
-        existing = self.collection.find_one({"url": url})
-        
-        if not existing:
-            doc_id = self._get_next_doc_id()
-            save_dict = {
-                "doc_id": doc_id,
-                "url": url,
+    def _allocate_doc_ids(self, count):
+        # Ids are reserved doc_id_block at a time; the unused rest of a
+        # block is skipped after a restart.
+        if self.last_doc_id - self.next_doc_id + 1 < count:
+            block = max(self.doc_id_block, count)
+            counter = self.counter.find_one_and_update(
+                {'_id': 'doc_id'},
+                {'$inc': {'seq': block}},
+                return_document=True
+            )
+            if not counter:
+                raise DropItem("Counter not found")
+            self.last_doc_id = counter['seq']
+            self.next_doc_id = self.last_doc_id - block + 1
+        ids = list(range(self.next_doc_id, self.next_doc_id + count))
+        self.next_doc_id += count
+        return ids
+
+    def _inc_stat(self, key, count=1):
+        if self.stats is not None:
+            self.stats.inc_value(f"index_pipeline/{key}", count)
+
+    def _write_loop(self):
+        from twisted.internet import reactor
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                # An item can be parked after the queue was drained, while
+                # this thread waits on it, so the wait is cut into slices
+                # that each end with a look at the parked items.
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self.queue.get(timeout=max(0.0, min(remaining, self.ADMIT_INTERVAL)))
+                except queue.Empty:
+                    if self.waiting:
+                        reactor.callFromThread(self._admit_waiting)
+                    if remaining <= self.ADMIT_INTERVAL:
+                        break
+                    continue
+                if item is self.STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                if self.waiting:
+                    reactor.callFromThread(self._admit_waiting)
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except Exception as e:
+                    self._inc_stat("batch_errors")
+                    self._inc_stat("dropped_items", len(batch))
+                    print(f"Error writing {len(batch)} items: {e}")
+            if self.waiting:
+                reactor.callFromThread(self._admit_waiting)
+
+    def _write_batch(self, batch):
+        existing = {
+            doc["url"]: doc for doc in self.collection.find(
+                {"url": {"$in": [item["url"] for item in batch]}},
+                {"url": 1, "doc_id": 1, "content_hash": 1, "terms": 1, "duplicate_of": 1, "revisit_interval": 1},
+            )
+        }
+        new_urls = {item["url"] for item in batch} - existing.keys()
+        new_ids = iter(self._allocate_doc_ids(len(new_urls)))
+
+        updates = {}
+        due = {}
+        for item in batch:
+            url = item["url"]
+            terms = self.codec.encode_terms(item["terms"])
+            fields = {
                 "normalized_url": item["normalized_url"],
                 "domain": item["domain"],
                 "title": item["title"],
-                "content": item["content"],
-                "terms": new_terms,
+                "content": self.codec.encode_content(item["content"]),
+                "terms": terms,
                 "terms_count": item["terms_count"],
-                "content_hash": new_hash,
+                "content_hash": item["content_hash"],
                 "last_crawled": item["last_crawled"],
+                "duplicate_of": item.get("duplicate_of"),
             }
-            self.collection.insert_one(save_dict)
-            self._index_add(doc_id, new_terms)
-        else:
-            old_hash = existing.get("content_hash")
-            old_terms = existing.get("terms", [])
-            doc_id = existing["doc_id"]
+            duplicate = fields["duplicate_of"] is not None
+            doc = existing.get(url)
+            if self.frontier is not None:
+                fields["revisit_interval"] = self.frontier.next_interval(
+                    doc and doc.get("revisit_interval"),
+                    doc is not None and doc.get("content_hash") != item["content_hash"],
+                )
+                due[url] = item["last_crawled"].timestamp() + fields["revisit_interval"]
+            if not doc:
+                doc_id = next(new_ids)
+                updates[url] = {"$set": fields, "$setOnInsert": {"doc_id": doc_id}}
+                self._inc_stat("duplicates" if duplicate else "added")
+            elif (doc.get("content_hash") == item["content_hash"]
+                  and self.codec.same_terms(doc.get("terms", []), terms, item["terms"])
+                  and doc.get("duplicate_of") == fields["duplicate_of"]):
+                self._inc_stat("unchanged")
+                visit = {"last_crawled": fields["last_crawled"]}
+                if "revisit_interval" in fields:
+                    visit["revisit_interval"] = doc["revisit_interval"] = fields["revisit_interval"]
+                updates.setdefault(url, {"$set": {}})["$set"].update(visit)
+                continue
+            else:
+                doc_id = doc["doc_id"]
+                if url in updates:
+                    updates[url]["$set"] = fields
+                else:
+                    updates[url] = {"$set": fields}
+                self._inc_stat("duplicates" if duplicate else "changed")
+            # Server time of the last write of the indexed fields, which the
+            # index follows when it polls (logic.index_sync).
+            updates[url]["$currentDate"] = {"indexed_at": True}
+            existing[url] = {
+                "doc_id": doc_id,
+                "content_hash": item["content_hash"],
+                "terms": terms,
+                "duplicate_of": fields["duplicate_of"],
+                "revisit_interval": fields.get("revisit_interval"),
+            }
+
+        if updates:
+            urls = list(updates)
+            errors = []
+            # Unordered: the other upserts land even when some fail, and
+            # only the failed pages stay out of the frontier.
+            try:
+                self.collection.bulk_write(
+                    [UpdateOne({"url": url}, updates[url], upsert=True) for url in urls],
+                    ordered=False,
+                )
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                self._inc_stat("batch_errors")
+                self._inc_stat("dropped_items", len(errors))
+                print(f"Error writing {len(errors)} of {len(urls)} items: {errors[:1]}")
+                for error in errors:
+                    due.pop(urls[error["index"]], None)
+            self._inc_stat("mongo_batches")
+            self._inc_stat("mongo_writes", len(updates) - len(errors))
+        if due:
+            self.frontier.schedule(due)
+    
+    def _admit_waiting(self):
+        while self.waiting:
+            d, item = self.waiting[0]
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                return
+            self.waiting.popleft()
+            d.callback(item)
 
-            if old_hash == new_hash and old_terms == new_terms:
+    def process_item(self, item):
+        self._inc_stat("items")
+        if not self.waiting:
+            try:
+                self.queue.put_nowait(item)
+                return item
+            except queue.Full:
                 pass
-            else:
-                self._index_remove(doc_id, old_terms)
-                update_fields = {
-                    "normalized_url": item["normalized_url"],
-                    "domain": item["domain"],
-                    "title": item["title"],
-                    "content": item["content"],
-                    "terms": new_terms,
-                    "terms_count": item["terms_count"],
-                    "content_hash": new_hash,
-                    "last_crawled": item["last_crawled"],
-                }
-                self.collection.update_one({"url": url}, {"$set": update_fields})
-                self._index_add(doc_id, new_terms)
-        
-        return item
\ No newline at end of file
+        # Backpressure: the item stays in flight until the writer makes room.
+        self._inc_stat("queue_full")
+        d = defer.Deferred()
+        self.waiting.append((d, item))
+        return d
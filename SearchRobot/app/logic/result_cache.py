@@ -0,0 +1,64 @@
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    # LRU over query results, bounded by the bytes of the stored results.
+    # Every entry remembers the index generation it was computed at and is
+    # dropped on lookup once the index has changed since.
+    ENTRY_OVERHEAD = 256
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    # A lookup that is retried with count_miss on a miss does not count it.
+    def get(self, key, generation, count_miss=True):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] != generation:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += count_miss
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, generation, value, nbytes):
+        nbytes += self.ENTRY_OVERHEAD
+        if nbytes > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (generation, value, nbytes)
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                _, (_, _, dropped) = self.entries.popitem(last=False)
+                self.size -= dropped
+
+    def _drop(self, key):
+        self.size -= self.entries.pop(key)[2]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+            }
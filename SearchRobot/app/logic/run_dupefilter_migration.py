@@ -0,0 +1,51 @@
+import sys
+import time
+import yaml
+from logic.bloom import RedisBloomFilter
+from logic.db import get_redis
+from logic.dupefilter import bloom_key
+from logic.spiders.redis_sitemap_spider import DUPEFILTER_KEY, RedisSitemapSpider
+
+SCAN_COUNT = 10000
+
+
+# Copies the fingerprints of the old set-based dupefilters into their Bloom
+# filters; with --delete the sets are dropped afterwards.
+def migrate(redis, key, capacity, error_rate, delete=False):
+    if redis.type(key) != b"set":
+        print(f"{key}: no fingerprint set")
+        return 0
+    bloom = RedisBloomFilter(redis, bloom_key(key), capacity, error_rate)
+    total = 0
+    started = time.monotonic()
+    batch = []
+    for member in redis.sscan_iter(key, count=SCAN_COUNT):
+        # The spider stored raw sha1 digests, scrapy_redis stores hex ones.
+        batch.append(member.hex() if len(member) == 20 else member.decode("ascii"))
+        if len(batch) == SCAN_COUNT:
+            bloom.add_many(batch)
+            total += len(batch)
+            batch = []
+    bloom.add_many(batch)
+    total += len(batch)
+    print(f"{key}: moved {total} fingerprints in {time.monotonic() - started:.1f}s, {bloom.stats()}")
+    if delete:
+        redis.unlink(key)
+    return total
+
+
+def main():
+    config_path = sys.argv[1]
+    delete = "--delete" in sys.argv[2:]
+    with open(config_path) as f:
+        cfg = yaml.safe_load(f)
+
+    redis = get_redis(cfg["redis"]["redis_url"])
+    capacity = cfg.get("dupefilter", {}).get("capacity", 1_000_000)
+    error_rate = cfg.get("dupefilter", {}).get("error_rate", 0.001)
+    for key in (DUPEFILTER_KEY, f"{RedisSitemapSpider.name}:dupefilter"):
+        migrate(redis, key, capacity, error_rate, delete)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import sys
+import time
+import requests
+import yaml
+from pymongo import UpdateOne
+from cpp.text_processor_cpp import process_documents
+from logic.db import get_mongo
+from logic.page_codec import PageCodec
+
+BATCH_SIZE = 2000
+
+
+# Re-tokenizes every stored page (after a tokenizer or stemmer change),
+# writes the new terms back and sends them to the index as replacements.
+def reprocess(collection, index_api_url, n_threads=0):
+    codec = PageCodec(collection.database)
+    session = requests.Session()
+    total = 0
+    started = time.monotonic()
+    cursor = collection.find({"duplicate_of": None}, {"doc_id": 1, "content": 1}, batch_size=BATCH_SIZE)
+    batch = []
+    for doc in cursor:
+        if doc.get("doc_id") is not None:
+            batch.append(doc)
+        if len(batch) == BATCH_SIZE:
+            total += _reprocess_batch(collection, session, index_api_url, batch, n_threads, codec)
+            batch = []
+            print(f"  Reprocessed {total} docs ({total / (time.monotonic() - started):.0f} docs/s)")
+    if batch:
+        total += _reprocess_batch(collection, session, index_api_url, batch, n_threads, codec)
+    session.close()
+    print(f"Reprocessed {total} docs in {time.monotonic() - started:.1f}s")
+
+
+def _reprocess_batch(collection, session, index_api_url, batch, n_threads, codec):
+    terms = process_documents([codec.content(doc) for doc in batch], n_threads)
+    collection.bulk_write(
+        [
+            UpdateOne({"_id": doc["_id"]}, {
+                "$set": {
+                    # Written back in the format the page is stored in.
+                    "terms": codec.encode_terms(doc_terms, isinstance(doc.get("content"), bytes)),
+                    "terms_count": len(doc_terms),
+                },
+                "$currentDate": {"indexed_at": True},
+            })
+            for doc, doc_terms in zip(batch, terms)
+        ],
+        ordered=False,
+    )
+    resp = session.post(
+        f"{index_api_url}/documents/batch",
+        json=[
+            {"op": "replace", "doc_id": doc["doc_id"], "terms": doc_terms}
+            for doc, doc_terms in zip(batch, terms)
+        ],
+    )
+    resp.raise_for_status()
+    return len(batch)
+
+
+def main():
+    config_path = sys.argv[1]
+    n_threads = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    with open(config_path) as f:
+        cfg = yaml.safe_load(f)
+
+    client, collection = get_mongo(
+        mongo_uri=cfg["db"]["mongo_uri"],
+        database=cfg["db"]["database"],
+        collection=cfg["db"]["collection"],
+    )
+    reprocess(collection, cfg["logic"].get("index_api_url", "http://localhost:8000"), n_threads)
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
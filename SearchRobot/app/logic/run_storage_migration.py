@@ -0,0 +1,83 @@
+import sys
+import time
+from collections import Counter
+import yaml
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+from logic.db import get_mongo
+from logic.page_codec import PageCodec
+
+BATCH_SIZE = 1000
+
+
+def collection_size(collection):
+    try:
+        stats = collection.database.command("collStats", collection.name)
+    except OperationFailure:
+        return None
+    return {"count": stats["count"], "size": stats["size"], "storage_size": stats["storageSize"]}
+
+
+def assign_by_frequency(collection, codec):
+    # Most frequent terms get the smallest ids, i.e. one or two bytes.
+    counts = Counter()
+    for doc in collection.find({"terms": {"$type": "array"}}, {"terms": 1}, batch_size=BATCH_SIZE):
+        counts.update(doc["terms"])
+    codec.dictionary.assign([term for term, _ in counts.most_common()])
+    print(f"Term dictionary: {len(codec.dictionary)} terms")
+
+
+# Rewrites the terms and content of every page into the compact format, or
+# back into the plain one with --plain. Pages already in the target format
+# are skipped, so an interrupted run can be restarted.
+def migrate(collection, codec, compact=True):
+    if compact:
+        codec.dictionary.ensure_index()
+        if not len(codec.dictionary):
+            codec.dictionary.load()
+        if not len(codec.dictionary):
+            assign_by_frequency(collection, codec)
+        pending = {"$or": [{"terms": {"$type": "array"}}, {"content": {"$type": "string"}}]}
+    else:
+        pending = {"$or": [{"terms": {"$type": "binData"}}, {"content": {"$type": "binData"}}]}
+    total = 0
+    started = time.monotonic()
+    batch = []
+    for doc in collection.find(pending, {"terms": 1, "content": 1}, batch_size=BATCH_SIZE):
+        batch.append(UpdateOne({"_id": doc["_id"]}, {"$set": {
+            "terms": codec.encode_terms(codec.terms(doc), compact),
+            "content": codec.encode_content(codec.content(doc), compact),
+        }}))
+        if len(batch) == BATCH_SIZE:
+            collection.bulk_write(batch, ordered=False)
+            total += len(batch)
+            batch = []
+            print(f"  Migrated {total} pages ({total / (time.monotonic() - started):.0f} pages/s)")
+    if batch:
+        collection.bulk_write(batch, ordered=False)
+        total += len(batch)
+    print(f"Migrated {total} pages to the {'compact' if compact else 'plain'} format "
+          f"in {time.monotonic() - started:.1f}s")
+    return total
+
+
+def main():
+    config_path = sys.argv[1]
+    compact = "--plain" not in sys.argv[2:]
+    with open(config_path) as f:
+        cfg = yaml.safe_load(f)
+
+    client, collection = get_mongo(
+        mongo_uri=cfg["db"]["mongo_uri"],
+        database=cfg["db"]["database"],
+        collection=cfg["db"]["collection"],
+    )
+    codec = PageCodec(collection.database, zstd_level=cfg["db"].get("content_zstd_level", 3))
+    print(f"Before: {collection_size(collection)}")
+    migrate(collection, codec, compact)
+    print(f"After: {collection_size(collection)}, dictionary: {collection_size(codec.dictionary.collection)}")
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+import math
+import threading
+import time
+import weakref
+from itertools import chain
+from cpp.boolean_index_cpp import BooleanIndex
+
+
+def combine_term_stats(parts):
+    # Sums term_stats() of indexes holding disjoint documents into the
+    # statistics of their union, as taken by search_ranked(stats=...).
+    n_docs, total_length, df = 0, 0, {}
+    for part_docs, part_length, part_df in parts:
+        n_docs += part_docs
+        total_length += part_length
+        for term, count in part_df.items():
+            df[term] = df.get(term, 0) + count
+    return n_docs, total_length, df
+
+
+def combine_live_changes(changes, probe):
+    # The (gained, lost) of apply_batch for the union of indexes holding
+    # disjoint documents, from the (gained, lost) of every index. A term
+    # gained in one index and lost in another stays; any other changes
+    # unless an index where it did not change has a live document with it.
+    # probe takes the terms to look up in every index and returns their
+    # document frequencies there, as in term_stats()[2].
+    changes = [(set(gained), set(lost)) for gained, lost in changes]
+    all_gained = set().union(*(index_gained for index_gained, _ in changes))
+    all_lost = set().union(*(index_lost for _, index_lost in changes))
+    gained, lost = all_gained - all_lost, all_lost - all_gained
+    candidates = gained | lost
+    if candidates:
+        for df in probe([list(candidates - index_gained - index_lost) for index_gained, index_lost in changes]):
+            gained -= df.keys()
+            lost -= df.keys()
+    return list(gained), list(lost)
+
+
+def merge_ranked(parts, k):
+    hits = [hit for part in parts for hit in part]
+    hits.sort(key=lambda hit: (-hit[1], hit[0]))
+    return hits[:k]
+
+
+class SegmentedIndex:
+    # Stands in for a BooleanIndex as a mutable write buffer plus frozen
+    # segments, each a BooleanIndex of its own and every document live in
+    # exactly one of them. Updates only touch the buffer, which becomes a
+    # segment once it holds buffer_docs documents, and tombstone the older
+    # copies in the segments. A background thread merges segments of
+    # similar size merge_factor at a time (tiered), dropping their
+    # tombstones; a segment with more than max_deletes of its documents
+    # removed is rewritten on its own.
+    #
+    # A document cannot span segments, so adding terms to one that lives
+    # in a frozen segment replaces it there instead of extending it.
+    def __init__(self, store_positions=False, buffer_docs=10000, merge_factor=4, max_deletes=0.3):
+        if buffer_docs < 1 or merge_factor < 2:
+            raise ValueError(f"bad segment parameters: buffer_docs={buffer_docs}, merge_factor={merge_factor}")
+        self.store_positions = store_positions
+        self.buffer_docs = buffer_docs
+        self.merge_factor = merge_factor
+        self.max_deletes = max_deletes
+        # (frozen segments, buffer), replaced as a whole so that searches
+        # need no lock.
+        self.view = ((), self._new_buffer())
+        # Indexes replaced in the view that searches begun before may still
+        # be reading; they keep getting tombstones until those finish.
+        self.retired = weakref.WeakSet()
+        self.write_lock = threading.Lock()
+        # Serialises merges, forced ones included.
+        self.merge_lock = threading.Lock()
+        # Segments being merged and the documents removed from them since.
+        self.merging = ()
+        self.merge_removed = []
+        # Bumped by clear and load_snapshot so that a merge running across
+        # them does not publish its result.
+        self.epoch = 0
+        # Terms with a live document in any index. Merges keep the union of
+        # the live documents, so only updates change it.
+        self.term_count = 0
+        self.stats = {
+            "flushes": 0, "merges": 0, "merged_docs": 0, "merge_seconds": 0.0,
+            "merge_bytes_read": 0, "merge_bytes_written": 0, "last_merge": None,
+        }
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.merger = threading.Thread(target=self._merge_loop, name="segment-merger", daemon=True)
+        self.merger.start()
+
+    def _new_buffer(self):
+        # Frozen as it is once full, so it never compacts itself either.
+        return BooleanIndex(self.store_positions, False)
+
+    def _indexes(self):
+        # Newest first: documents only move into the buffer, and their older
+        # copies are tombstoned before, so a search that finds one there
+        # cannot find it again in a segment it reads afterwards.
+        segments, buffer = self.view
+        return (buffer,) + segments[::-1]
+
+    def _segment_docs(self, segment):
+        stats = segment.storage_stats()
+        return stats["docs"], stats["tombstones"]
+
+    # Write path
+
+    def apply_batch(self, ops):
+        ops = list(ops)
+        with self.write_lock:
+            segments, buffer = self.view
+            removed = [("remove", op[1], []) for op in ops]
+            changes = []
+
+            # Older copies go first, so that a search never sees two.
+            def tombstone():
+                for segment in segments:
+                    changes.append(segment.apply_batch(removed))
+                for index in list(self.retired):
+                    index.apply_batch(removed)
+
+            # The buffer validates the whole batch before changing anything.
+            changes.insert(0, buffer.apply_batch(ops, tombstone))
+            gained, lost = self._live_changes((buffer,) + segments, changes)
+            self.term_count += len(gained) - len(lost)
+            if self.merging:
+                self.merge_removed.extend(op[1] for op in ops)
+            if buffer.get_document_count() >= self.buffer_docs:
+                self.view = (segments + (buffer,), self._new_buffer())
+                self.stats["flushes"] += 1
+                self.wakeup.set()
+        return gained, lost
+
+    def _live_changes(self, indexes, changes):
+        if len(indexes) == 1:
+            return changes[0]
+        return combine_live_changes(changes, lambda terms: [
+            index.term_stats(index_terms)[2] if index_terms else {}
+            for index, index_terms in zip(indexes, terms)
+        ])
+
+    def add_document(self, doc_id, terms):
+        self.apply_batch([("add", doc_id, terms)])
+
+    def remove_document(self, doc_id):
+        self.apply_batch([("remove", doc_id, [])])
+
+    def remove_documents(self, doc_ids):
+        self.apply_batch([("remove", doc_id, []) for doc_id in doc_ids])
+
+    # Merges
+
+    def _tier(self, docs):
+        return max(0, round(math.log(max(docs, 1) / self.buffer_docs, self.merge_factor)))
+
+    def _pick_merge(self):
+        segments, _ = self.view
+        tiers = {}
+        for segment in segments:
+            docs, tombstones = self._segment_docs(segment)
+            if tombstones > self.max_deletes * (docs + tombstones):
+                return [segment]
+            tiers.setdefault(self._tier(docs + tombstones), []).append((docs, segment))
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= self.merge_factor:
+                tiers[tier].sort(key=lambda item: item[0])
+                return [segment for _, segment in tiers[tier][:self.merge_factor]]
+        return None
+
+    def _merge(self, picked):
+        with self.write_lock:
+            self.merging = tuple(picked)
+            self.merge_removed = []
+            epoch = self.epoch
+        started = time.monotonic()
+        merged = BooleanIndex(self.store_positions, False)
+        try:
+            io = merged.merge(list(picked))
+        except Exception:
+            with self.write_lock:
+                self.merging = ()
+            raise
+        with self.write_lock:
+            if self.merge_removed:
+                merged.apply_batch([("remove", doc_id, []) for doc_id in self.merge_removed])
+            self.merging = ()
+            self.merge_removed = []
+            if epoch != self.epoch:
+                return None
+            segments, buffer = self.view
+            kept = tuple(segment for segment in segments if all(segment is not p for p in picked))
+            self.view = (kept + ((merged,) if io["docs"] else ()), buffer)
+            self.retired.update(picked)
+            elapsed = time.monotonic() - started
+            self.stats["merges"] += 1
+            self.stats["merged_docs"] += io["docs"]
+            self.stats["merge_seconds"] += elapsed
+            self.stats["merge_bytes_read"] += io["bytes_read"]
+            self.stats["merge_bytes_written"] += io["bytes_written"]
+            self.stats["last_merge"] = {"segments": len(picked), "seconds": round(elapsed, 3), **io}
+        return merged
+
+    def _merge_loop(self):
+        while not self.closed:
+            self.wakeup.wait(5.0)
+            self.wakeup.clear()
+            try:
+                while not self.closed:
+                    with self.merge_lock:
+                        picked = self._pick_merge()
+                        if not picked:
+                            break
+                        self._merge(picked)
+            except Exception as e:
+                print(f"Segment merge failed: {e}")
+
+    def force_merge(self):
+        # Freezes the buffer and merges everything written so far into one
+        # segment, which is returned; None only when the index is empty. A
+        # merge overtaken by clear or load_snapshot is redone on the new
+        # contents.
+        with self.merge_lock:
+            while True:
+                with self.write_lock:
+                    segments, buffer = self.view
+                    if buffer.get_document_count():
+                        segments += (buffer,)
+                        self.view = (segments, self._new_buffer())
+                if len(segments) > 1 or any(self._segment_docs(segment)[1] for segment in segments):
+                    merged = self._merge(list(segments))
+                    if merged is None:
+                        continue
+                    return merged
+                return segments[0] if segments else None
+
+    def segment_stats(self):
+        segments, buffer = self.view
+        return {
+            "buffer": buffer.storage_stats(),
+            "segments": [segment.storage_stats() for segment in segments],
+            **self.stats,
+            "merge_seconds": round(self.stats["merge_seconds"], 3),
+        }
+
+    # Read path: every live document is in exactly one index.
+
+    def search(self, terms):
+        parts = [index.search(terms) for index in self._indexes()]
+        parts = [part for part in parts if part]
+        if len(parts) == 1:
+            return parts[0]
+        return sorted(chain.from_iterable(parts))
+
+    def term_stats(self, terms):
+        return combine_term_stats(index.term_stats(terms) for index in self._indexes())
+
+    def search_ranked(self, terms, k=10, stats=None):
+        indexes = self._indexes()
+        if stats is None:
+            stats = combine_term_stats(index.term_stats(terms) for index in indexes)
+        if stats[0] == 0:
+            return []
+        return merge_ranked((index.search_ranked(terms, k, stats) for index in indexes), k)
+
+    def explain(self, terms):
+        return [index.explain(terms) for index in self._indexes()]
+
+    def get_document_count(self):
+        return sum(index.get_document_count() for index in self._indexes())
+
+    def get_terms(self):
+        terms = set()
+        for index in self._indexes():
+            terms.update(index.get_terms())
+        return list(terms)
+
+    def get_term_count(self):
+        return self.term_count
+
+    def get_document_terms(self, doc_id):
+        for index in self._indexes():
+            terms = index.get_document_terms(doc_id)
+            if terms:
+                return terms
+        return []
+
+    # Snapshots hold the whole index as one segment.
+
+    def save_snapshot(self, path, watermark):
+        segment = self.force_merge() or BooleanIndex(self.store_positions)
+        segment.save_snapshot(path, watermark)
+
+    def load_snapshot(self, path):
+        segment = BooleanIndex(self.store_positions, False)
+        watermark = segment.load_snapshot(path)
+        with self.write_lock:
+            self.epoch += 1
+            self.retired.update(self._indexes())
+            self.view = ((segment,) if segment.get_document_count() else (), self._new_buffer())
+            self.term_count = segment.get_term_count()
+        return watermark
+
+    def compact(self):
+        self.force_merge()
+
+    def clear(self):
+        with self.write_lock:
+            self.epoch += 1
+            self.retired.update(self._indexes())
+            self.view = ((), self._new_buffer())
+            self.term_count = 0
+
+    def close(self):
+        self.closed = True
+        self.wakeup.set()
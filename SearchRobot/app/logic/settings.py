@@ -18,16 +18,38 @@ def scrapy_settings(cfg: dict) -> dict:
         "ITEM_PIPELINES": {
             "logic.pipelines.ExtractContentPipeline": 100,
             "logic.pipelines.TextProcessorPipeline": 200,
+            "logic.pipelines.NearDuplicatePipeline": 250,
             "logic.pipelines.SaveMongoBooleanIndexPipeline": 300,
         },
 
         "MONGO_URI": cfg["db"]["mongo_uri"],
         "MONGO_DATABASE": cfg["db"]["database"],
         "MONGO_COLLECTION": cfg["db"]["collection"],
+        "COMPACT_STORAGE": cfg["db"].get("compact_storage", False),
+        "CONTENT_ZSTD_LEVEL": cfg["db"].get("content_zstd_level", 3),
+        "INDEX_BATCH_SIZE": cfg["logic"].get("index_batch_size", 100),
+        "INDEX_FLUSH_INTERVAL": cfg["logic"].get("index_flush_interval", 5.0),
+        "WRITE_QUEUE_SIZE": cfg["logic"].get("write_queue_size", 1000),
+        "DOC_ID_BLOCK_SIZE": cfg["logic"].get("doc_id_block_size", 1000),
+        "EXTRACTION_SITES": cfg.get("extraction", {}).get("sites", {}),
+        "EXTRACTION_WORKERS": cfg.get("extraction", {}).get("workers", 0),
+        "RECRAWL_INITIAL_INTERVAL": cfg["logic"]["reindex_after_days"] * 86400,
+        "RECRAWL_MIN_INTERVAL": int(cfg.get("recrawl", {}).get("min_interval_hours", 6) * 3600),
+        "RECRAWL_MAX_INTERVAL": int(cfg.get("recrawl", {}).get("max_interval_days", 60) * 86400),
+        "RECRAWL_DRAIN_INTERVAL": cfg.get("recrawl", {}).get("drain_interval_seconds", 10.0),
+        "RECRAWL_DRAIN_BATCH_SIZE": cfg.get("recrawl", {}).get("drain_batch_size", 1000),
+        "NEAR_DUPLICATES_ENABLED": cfg.get("near_duplicates", {}).get("enabled", False),
+        "NEAR_DUPLICATES_THRESHOLD": cfg.get("near_duplicates", {}).get("threshold", 0.6),
+        "NEAR_DUPLICATES_NUM_HASHES": cfg.get("near_duplicates", {}).get("num_hashes", 128),
+        "NEAR_DUPLICATES_BANDS": cfg.get("near_duplicates", {}).get("bands", 32),
+        "NEAR_DUPLICATES_SHINGLE_SIZE": cfg.get("near_duplicates", {}).get("shingle_size", 3),
+        "NEAR_DUPLICATES_MIN_TERMS": cfg.get("near_duplicates", {}).get("min_terms", 50),
         
         "REDIS_URL": cfg["redis"]["redis_url"],
         "SCHEDULER": "scrapy_redis.scheduler.Scheduler",
-        "DUPEFILTER_CLASS": "scrapy_redis.dupefilter.RFPDupeFilter",
+        "DUPEFILTER_CLASS": "logic.dupefilter.BloomDupeFilter",
+        "DUPEFILTER_BLOOM_CAPACITY": cfg.get("dupefilter", {}).get("capacity", 1_000_000),
+        "DUPEFILTER_BLOOM_ERROR_RATE": cfg.get("dupefilter", {}).get("error_rate", 0.001),
         "SCHEDULER_PERSIST": True,
         "REDIS_DUPEFILTER_KEY": "crawler:dupefilter",
         
@@ -0,0 +1,327 @@
+import os
+import queue
+import secrets
+import threading
+import time
+import multiprocessing
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Client, Listener
+import numpy as np
+from pymongo import MongoClient
+from cpp.boolean_index_cpp import BooleanIndex
+from logic.page_codec import PageCodec
+from logic.segmented_index import SegmentedIndex, combine_live_changes, combine_term_stats, merge_ranked
+
+# Methods of BooleanIndex a shard worker serves as they are.
+SHARD_METHODS = {
+    "search_ranked", "term_stats", "explain", "get_document_count", "get_term_count", "get_terms",
+    "get_document_terms", "apply_batch",
+    "save_snapshot", "load_snapshot", "compact", "clear", "segment_stats",
+}
+# Methods that may take long on a large shard, waited for without a timeout.
+SLOW_METHODS = {"build", "save_snapshot", "load_snapshot", "compact"}
+# Exceptions passed on to the caller as they are, anything else becomes
+# a RuntimeError.
+FORWARDED_ERRORS = {error.__name__: error for error in (ValueError, KeyError, IndexError, RuntimeError)}
+
+
+def shard_of(doc_id, shards):
+    return doc_id % shards
+
+
+class MongoShardSource:
+    # Yields the (doc_id, terms) of one shard's partition; runs inside the
+    # shard worker, so every shard reads its documents in parallel.
+    def __init__(self, mongo_uri, database, collection):
+        self.mongo_uri = mongo_uri
+        self.database = database
+        self.collection = collection
+
+    def __call__(self, shard, shards):
+        client = MongoClient(self.mongo_uri)
+        codec = PageCodec(client[self.database])
+        try:
+            cursor = client[self.database][self.collection].find(
+                {"duplicate_of": None, "doc_id": {"$mod": [shards, shard]}},
+                {"doc_id": 1, "terms": 1},
+                batch_size=1000
+            )
+            batch = []
+            for doc in cursor:
+                if doc.get("doc_id") is not None:
+                    batch.append(doc)
+                if len(batch) == 1000:
+                    yield from zip((doc["doc_id"] for doc in batch), codec.terms_many(batch))
+                    batch = []
+            yield from zip((doc["doc_id"] for doc in batch), codec.terms_many(batch))
+        finally:
+            client.close()
+
+
+def _build(index, source, shard, shards):
+    index.clear()
+    started = time.monotonic()
+    batch = []
+    for doc_id, terms in source(shard, shards):
+        batch.append(("add", doc_id, terms))
+        if len(batch) == 1000:
+            index.apply_batch(batch)
+            batch = []
+    index.apply_batch(batch)
+    print(f"  Shard {shard}: built {index.get_document_count()} docs in {time.monotonic() - started:.1f}s")
+    return index.get_document_count()
+
+
+def _dispatch(index, shard, shards, method, args):
+    if method == "search":
+        return array("i", index.search(*args))
+    if method == "build":
+        return _build(index, args[0], shard, shards)
+    if method not in SHARD_METHODS:
+        raise ValueError(f"unknown shard method {method}")
+    return getattr(index, method)(*args)
+
+
+def _serve_connection(index, shard, shards, conn):
+    with conn:
+        while True:
+            try:
+                method, args = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                reply = ("ok", _dispatch(index, shard, shards, method, args))
+            except Exception as e:
+                reply = ("error", type(e).__name__, str(e))
+            conn.send(reply)
+
+
+def _watch_parent(parent):
+    # Daemon workers are only terminated on a clean exit of the API process.
+    while os.getppid() == parent:
+        time.sleep(1.0)
+    os._exit(0)
+
+
+def serve_shard(shard, shards, address, authkey, store_positions, segments, parent):
+    index = SegmentedIndex(store_positions, **segments) if segments is not None else BooleanIndex(store_positions)
+    if os.path.exists(address):
+        os.unlink(address)
+    listener = Listener(address, family="AF_UNIX", authkey=authkey)
+    threading.Thread(target=_watch_parent, args=(parent,), daemon=True).start()
+    while True:
+        try:
+            conn = listener.accept()
+        except (OSError, multiprocessing.AuthenticationError) as e:
+            print(f"Shard {shard}: rejected connection: {e}")
+            continue
+        threading.Thread(target=_serve_connection, args=(index, shard, shards, conn), daemon=True).start()
+
+
+class ShardedIndex:
+    # Stands in for a BooleanIndex whose documents are partitioned by
+    # doc_id % shards over worker processes, each owning one BooleanIndex
+    # and serving it over a Unix socket. Queries go to every shard at once
+    # and their partial results are merged; updates go to the shard of
+    # their document.
+    def __init__(self, shards, socket_dir, source, store_positions=False, segments=None, start_timeout=30.0,
+                 call_timeout=30.0):
+        if shards < 1:
+            raise ValueError(f"bad shard count {shards}")
+        self.shards = shards
+        self.call_timeout = call_timeout
+        self.source = source
+        self.segments = segments
+        self.addresses = [os.path.join(socket_dir, f"shard{i}.sock") for i in range(shards)]
+        self.authkey = secrets.token_bytes(32)
+        self.pools = [queue.LifoQueue() for _ in range(shards)]
+        self.executor = ThreadPoolExecutor(max_workers=shards * 8, thread_name_prefix="shard")
+        # Terms with a live document on any shard, kept up to date from the
+        # changes every shard reports for its part of a batch.
+        self.term_count = 0
+        self.write_lock = threading.Lock()
+        os.makedirs(socket_dir, exist_ok=True)
+
+        context = multiprocessing.get_context("spawn")
+        self.processes = [
+            context.Process(
+                target=serve_shard,
+                args=(i, shards, self.addresses[i], self.authkey, store_positions, segments, os.getpid()),
+                name=f"index-shard-{i}",
+                daemon=True,
+            )
+            for i in range(shards)
+        ]
+        for process in self.processes:
+            process.start()
+        self._wait_ready(start_timeout)
+
+    def _wait_ready(self, timeout):
+        deadline = time.monotonic() + timeout
+        for i in range(self.shards):
+            while True:
+                try:
+                    self.pools[i].put(self._connect(i))
+                    break
+                except OSError:
+                    if not self.processes[i].is_alive() or time.monotonic() > deadline:
+                        self.close()
+                        raise RuntimeError(f"index shard {i} did not start")
+                    time.sleep(0.05)
+
+    def _connect(self, shard):
+        return Client(self.addresses[shard], family="AF_UNIX", authkey=self.authkey)
+
+    def _call(self, shard, method, *args):
+        pool = self.pools[shard]
+        try:
+            conn = pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect(shard)
+        timeout = None if method in SLOW_METHODS else self.call_timeout
+        try:
+            conn.send((method, args))
+            if not conn.poll(timeout):
+                raise TimeoutError(f"no reply to {method} within {timeout}s")
+            reply = conn.recv()
+        except BaseException as e:
+            # The connection may be left in the middle of a message or with
+            # a late reply to come, so it is never reused.
+            conn.close()
+            if isinstance(e, (EOFError, OSError)):
+                raise RuntimeError(f"index shard {shard} failed: {e}") from e
+            raise
+        pool.put(conn)
+        if reply[0] == "error":
+            raise FORWARDED_ERRORS.get(reply[1], RuntimeError)(reply[2])
+        return reply[1]
+
+    def _scatter(self, method, *args):
+        if self.shards == 1:
+            return [self._call(0, method, *args)]
+        futures = [self.executor.submit(self._call, i, method, *args) for i in range(self.shards)]
+        return [future.result() for future in futures]
+
+    def _route(self, doc_id, method, *args):
+        return self._call(shard_of(doc_id, self.shards), method, doc_id, *args)
+
+    def build(self):
+        with self.write_lock:
+            docs = sum(self._scatter("build", self.source))
+            self._recount()
+        return docs
+
+    def _recount(self):
+        # After a build or a snapshot load, the only time the term lists
+        # of the shards are sent over.
+        if self.shards == 1:
+            self.term_count = self._call(0, "get_term_count")
+            return
+        terms = set()
+        for part in self._scatter("get_terms"):
+            terms.update(part)
+        self.term_count = len(terms)
+
+    def search(self, terms):
+        # Shards hold disjoint doc_ids, so the sorted union is their concatenation sorted.
+        parts = [np.frombuffer(part, dtype=np.int32) for part in self._scatter("search", terms) if len(part)]
+        merged = array("i")
+        if parts:
+            merged.frombytes(np.sort(np.concatenate(parts)).tobytes())
+        return merged
+
+    def search_ranked(self, terms, k=10):
+        # BM25 on every shard with the document count, length and document
+        # frequencies of all of them, so the merged top k is the one an
+        # unsharded index returns.
+        stats = combine_term_stats(self._scatter("term_stats", terms))
+        if stats[0] == 0:
+            return []
+        return merge_ranked(self._scatter("search_ranked", terms, k, stats), k)
+
+    def explain(self, terms):
+        return self._scatter("explain", terms)
+
+    def get_document_count(self):
+        return sum(self._scatter("get_document_count"))
+
+    def get_term_count(self):
+        return self.term_count
+
+    def get_document_terms(self, doc_id):
+        return self._route(doc_id, "get_document_terms")
+
+    def add_document(self, doc_id, terms):
+        self.apply_batch([("add", doc_id, terms)])
+
+    def remove_document(self, doc_id):
+        self.apply_batch([("remove", doc_id, [])])
+
+    def apply_batch(self, ops):
+        parts = [[] for _ in range(self.shards)]
+        for op in ops:
+            parts[shard_of(op[1], self.shards)].append(op)
+        with self.write_lock:
+            futures = [self.executor.submit(self._call, i, "apply_batch", part) if part else None
+                       for i, part in enumerate(parts)]
+            changes = [future.result() if future else ([], []) for future in futures]
+            if self.shards == 1:
+                gained, lost = changes[0]
+            else:
+                gained, lost = combine_live_changes(changes, self._probe_terms)
+            self.term_count += len(gained) - len(lost)
+        return gained, lost
+
+    def _probe_terms(self, terms):
+        futures = [self.executor.submit(self._call, i, "term_stats", shard_terms) if shard_terms else None
+                   for i, shard_terms in enumerate(terms)]
+        return [future.result()[2] if future else {} for future in futures]
+
+    def snapshot_paths(self, path):
+        return [f"{path}.shard{i}of{self.shards}" for i in range(self.shards)]
+
+    def save_snapshot(self, path, watermark):
+        futures = [
+            self.executor.submit(self._call, i, "save_snapshot", shard_path, watermark)
+            for i, shard_path in enumerate(self.snapshot_paths(path))
+        ]
+        for future in futures:
+            future.result()
+
+    def load_snapshot(self, path):
+        with self.write_lock:
+            futures = [
+                self.executor.submit(self._call, i, "load_snapshot", shard_path)
+                for i, shard_path in enumerate(self.snapshot_paths(path))
+            ]
+            watermark = min(future.result() for future in futures)
+            self._recount()
+        return watermark
+
+    def compact(self):
+        self._scatter("compact")
+
+    def segment_stats(self):
+        # Workers without segments hold a plain BooleanIndex.
+        if self.segments is None:
+            return None
+        return self._scatter("segment_stats")
+
+    def clear(self):
+        with self.write_lock:
+            self._scatter("clear")
+            self.term_count = 0
+
+    def close(self):
+        for pool in self.pools:
+            while not pool.empty():
+                pool.get_nowait().close()
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+            process.join(5.0)
+        for address in self.addresses:
+            if os.path.exists(address):
+                os.unlink(address)
+        self.executor.shutdown(wait=False)
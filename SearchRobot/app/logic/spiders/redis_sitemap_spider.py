@@ -1,13 +1,35 @@
 from datetime import timedelta, datetime
 import json
+from gzip import GzipFile
+from io import BytesIO
 from urllib.parse import urlparse, urlunparse
 from lxml import etree
-from scrapy import Request
+from redis.exceptions import RedisError
+from twisted.internet import task, threads
+from scrapy import Request, signals
 from scrapy_redis.spiders import RedisSpider
+from scrapy.utils.gz import gzip_magic_number
 from scrapy.utils.request import fingerprint
+from logic.bloom import RedisBloomFilter
+from logic.dupefilter import bloom_key
+from logic.frontier import frontier_from_settings
 from logic.items import PageItem
-from logic.tasks import enqueue_url
-from rq_scheduler import Scheduler
+
+DUPEFILTER_KEY = "crawler:dupefilter"
+LASTMOD_KEY = "crawler:lastmod"
+SITEMAPS_KEY = "crawler:sitemaps"
+
+
+def parse_lastmod(value):
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
 
 
 class RedisSitemapSpider(RedisSpider):
@@ -22,39 +44,152 @@ class RedisSitemapSpider(RedisSpider):
         self.reindex_after = timedelta(
             days=kwargs["config"]["logic"]["reindex_after_days"]
         )
+        self.sitemap_batch_size = kwargs["config"]["logic"].get("sitemap_batch_size", 1000)
         
-        self.recheck_scheduler = None
+        self.frontier = None
+        self.dupefilter = None
+        self.frontier_loop = None
         
     @classmethod
     def from_crawler(cls, crawler, *args, **kwargs):
         spider = super().from_crawler(crawler, *args, **kwargs)
-        spider.recheck_scheduler = Scheduler(connection=spider.server)
+        spider.frontier = frontier_from_settings(spider.server, crawler.settings)
+        spider.dupefilter = RedisBloomFilter(
+            spider.server,
+            bloom_key(DUPEFILTER_KEY),
+            crawler.settings.getint("DUPEFILTER_BLOOM_CAPACITY", 1_000_000),
+            crawler.settings.getfloat("DUPEFILTER_BLOOM_ERROR_RATE", 0.001),
+        )
+        crawler.signals.connect(spider._start_frontier, signal=signals.spider_opened)
+        crawler.signals.connect(spider._stop_frontier, signal=signals.spider_closed)
         return spider
+
+    def _start_frontier(self):
+        d = threads.deferToThread(self._seed_frontier)
+        d.addCallback(lambda _: self._drain_frontier_loop())
+        return d
+
+    def _seed_frontier(self):
+        if len(self.frontier) == 0:
+            seeded = self.frontier.seed(self.mongo.find(
+                {}, {"url": 1, "last_crawled": 1, "revisit_interval": 1}, batch_size=10000
+            ))
+            print(f"Seeded recrawl frontier with {seeded} pages")
+
+    def _drain_frontier_loop(self):
+        self.frontier_loop = task.LoopingCall(self._drain_frontier)
+        self.frontier_loop.start(self.settings.getfloat("RECRAWL_DRAIN_INTERVAL", 10.0))
+
+    # A LoopingCall stops for good once its function raises, so a Redis
+    # error only skips this tick.
+    def _drain_frontier(self):
+        limit = self.settings.getint("RECRAWL_DRAIN_BATCH_SIZE", 1000)
+        try:
+            while True:
+                moved = self.frontier.drain(limit)
+                self.crawler.stats.inc_value("frontier/drained", moved)
+                if moved < limit:
+                    return
+        except RedisError as e:
+            self.crawler.stats.inc_value("frontier/drain_errors")
+            print(f"Recrawl frontier drain failed: {e}")
+
+    def _stop_frontier(self):
+        if self.frontier_loop is not None and self.frontier_loop.running:
+            self.frontier_loop.stop()
     
-    def _should_enqueue(self, url):
-        doc = self.mongo.find_one({"url": url})
-        if not doc:
-            return True
-        last = doc.get("last_crawled")
-        if not last or (datetime.now() - last > self.reindex_after):
-            return True
-        return False
-    
-    def _enqueue(self, url, ignore_dupefilter=False):
-        if not self._should_enqueue(url):
+    def _sitemap_entries(self, response):
+        # Streams (kind, loc, lastmod) out of a sitemap or a sitemap index,
+        # gzipped or not, dropping every entry once it has been read.
+        body = BytesIO(response.body)
+        source = GzipFile(fileobj=body) if gzip_magic_number(response) else body
+        events = etree.iterparse(
+            source, events=("end",), resolve_entities=False, no_network=True,
+            huge_tree=True, remove_comments=True, remove_pis=True,
+        )
+        for _, element in events:
+            kind = etree.QName(element).localname
+            if kind not in ("url", "sitemap"):
+                continue
+            fields = {etree.QName(child).localname: (child.text or "").strip() for child in element}
+            if fields.get("loc"):
+                yield kind, fields["loc"], fields.get("lastmod") or None
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+    def _parse_sitemap(self, response, lastmod=None):
+        batch = []
+        try:
+            for kind, loc, entry_lastmod in self._sitemap_entries(response):
+                if kind == "sitemap":
+                    if entry_lastmod is None or self.server.hget(SITEMAPS_KEY, loc) != entry_lastmod.encode():
+                        yield Request(
+                            loc,
+                            callback=self._parse_sitemap,
+                            cb_kwargs={"lastmod": entry_lastmod},
+                            dont_filter=True,
+                        )
+                    continue
+                batch.append((loc, entry_lastmod))
+                if len(batch) >= self.sitemap_batch_size:
+                    self._enqueue_batch(batch)
+                    batch = []
+        except (etree.XMLSyntaxError, OSError, EOFError) as e:
+            print(f"Broken sitemap {response.url}: {e}")
+            lastmod = None
+        if batch:
+            self._enqueue_batch(batch)
+        if lastmod is not None:
+            self.server.hset(SITEMAPS_KEY, response.request.url, lastmod)
+
+    def _enqueue_batch(self, entries):
+        entries = list(dict(entries).items())
+        self.crawler.stats.inc_value("sitemap/urls", len(entries))
+
+        # A page whose <lastmod> is the one seen last time is unchanged.
+        seen = self.server.hmget(LASTMOD_KEY, [url for url, _ in entries])
+        entries = [
+            (url, lastmod) for (url, lastmod), known in zip(entries, seen)
+            if lastmod is None or known != lastmod.encode()
+        ]
+        if not entries:
             return
-        req = Request(url)
-        fp = fingerprint(req)
-        if ignore_dupefilter or self.server.sadd("crawler:dupefilter", fp):
-            self.server.lpush(self.redis_key, json.dumps({"url": url}))
-    
-    def _parse_sitemap(self, response):
-        tree = etree.fromstring(response.body)
-        ns = {'sm': 'http://www.sitemaps.org/schemas/sitemap/0.9'}
-        
-        for url in tree.xpath("//sm:loc/text()", namespaces=ns):
-            self._enqueue(url, ignore_dupefilter=False)
-     
+
+        crawled = {
+            doc["url"]: doc.get("last_crawled") for doc in self.mongo.find(
+                {"url": {"$in": [url for url, _ in entries]}},
+                {"url": 1, "last_crawled": 1},
+            )
+        }
+        now = datetime.now()
+        checked = []
+        changed = []
+        for url, lastmod in entries:
+            if url not in crawled:
+                checked.append(url)
+                continue
+            last = crawled[url]
+            modified = parse_lastmod(lastmod)
+            if last and modified and modified > last:
+                # Already crawled once, so only a bypass of the dupefilter
+                # gets the new version fetched.
+                changed.append(url)
+            elif not last or now - last > self.reindex_after:
+                checked.append(url)
+
+        added = self.dupefilter.add_many([fingerprint(Request(url)).hex() for url in checked])
+        urls = [url for url, ok in zip(checked, added) if ok] + changed
+
+        pipe = self.server.pipeline(transaction=False)
+        if urls:
+            pipe.lpush(self.redis_key, *[json.dumps({"url": url}) for url in urls])
+        lastmods = {url: lastmod for url, lastmod in entries if lastmod}
+        if lastmods:
+            pipe.hset(LASTMOD_KEY, mapping=lastmods)
+        pipe.execute()
+        self.crawler.stats.inc_value("sitemap/enqueued", len(urls))
+
     def start_requests(self):
         for sitemap_url in self.sitemap_urls:
             yield Request(
@@ -78,12 +213,6 @@ class RedisSitemapSpider(RedisSpider):
         domain = parsed.netloc.lower()
         html = response.text
 
-        self.recheck_scheduler.enqueue_in(
-            time_delta=self.reindex_after,
-            func=enqueue_url,
-            args=(url, self.reindex_after.days, True),
-        )
-        
         yield PageItem(
             url=url,
             normalized_url=normalized_url,
@@ -0,0 +1,150 @@
+import math
+import random
+import threading
+import time
+import pytest
+from cpp.boolean_index_cpp import MAX_DOC_ID, BooleanIndex
+
+
+def bm25_scores(docs, query, k1=1.2, b=0.75):
+    n = len(docs)
+    avgdl = max(1.0, sum(len(terms) for terms in docs.values()) / n)
+    scores = {}
+    for term in dict.fromkeys(query):
+        df = sum(term in terms for terms in docs.values())
+        if not df:
+            continue
+        idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        for doc_id, terms in docs.items():
+            tf = terms.count(term)
+            if tf:
+                norm = k1 * (1 - b + b * len(terms) / avgdl)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+    return sorted(scores.items(), key=lambda hit: (-hit[1], hit[0]))
+
+
+@pytest.mark.parametrize("auto_compact", [True, False])
+def test_ranked_after_removals_without_compaction(auto_compact):
+    index = BooleanIndex(False, auto_compact)
+    for doc_id in range(100):
+        index.add_document(doc_id, ["a", "b"] if doc_id % 2 else ["a"])
+    for doc_id in range(2, 100):
+        index.remove_document(doc_id)
+
+    hits = index.search_ranked(["a", "b"], 10)
+    assert [doc_id for doc_id, _ in hits] == [1, 0]
+    assert all(score > 0 for _, score in hits)
+    assert index.term_stats(["a", "b"]) == (2, 3, {"a": 2, "b": 1})
+
+
+def test_ranked_matches_brute_force_with_pending_tombstones():
+    rnd = random.Random(5)
+    vocab = [f"t{i}" for i in range(30)]
+    index = BooleanIndex(False, False)
+    docs = {}
+    for doc_id in range(300):
+        docs[doc_id] = rnd.choices(vocab, k=rnd.randint(1, 20))
+        index.add_document(doc_id, docs[doc_id])
+    for doc_id in rnd.sample(range(300), 150):
+        index.remove_document(doc_id)
+        del docs[doc_id]
+    for doc_id in rnd.sample(sorted(docs), 30):
+        docs[doc_id] = rnd.choices(vocab, k=rnd.randint(1, 20))
+        index.apply_batch([("replace", doc_id, docs[doc_id])])
+
+    for _ in range(20):
+        query = rnd.sample(vocab, 3)
+        expected = bm25_scores(docs, query)[:10]
+        hits = index.search_ranked(query, 10)
+        assert [doc_id for doc_id, _ in hits] == [doc_id for doc_id, _ in expected]
+        assert [score for _, score in hits] == pytest.approx([score for _, score in expected])
+
+
+def test_apply_batch_reports_live_term_changes():
+    index = BooleanIndex(False, False)
+    gained, lost = index.apply_batch([("add", 1, ["a", "b"]), ("add", 2, ["b", "c"])])
+    assert (sorted(gained), lost) == (["a", "b", "c"], [])
+    gained, lost = index.apply_batch([("replace", 1, ["a", "d"]), ("remove", 2, [])])
+    assert (sorted(gained), sorted(lost)) == (["d"], ["b", "c"])
+    assert index.apply_batch([("remove", 1, []), ("add", 1, ["a", "d"])]) == ([], [])
+    assert index.get_term_count() == 2
+    assert sorted(index.get_terms()) == ["a", "d"]
+
+
+@pytest.mark.parametrize("doc_id", [-1, MAX_DOC_ID + 1])
+def test_out_of_range_doc_ids_are_rejected(doc_id):
+    index = BooleanIndex()
+    index.add_document(1, ["a"])
+    with pytest.raises(ValueError):
+        index.add_document(doc_id, ["a"])
+    with pytest.raises(ValueError):
+        index.apply_batch([("add", 2, ["b"]), ("add", doc_id, ["b"])])
+    with pytest.raises(ValueError):
+        index.remove_document(doc_id)
+    assert index.get_document_count() == 1
+    assert index.search(["b"]) == []
+
+
+def test_not_queries_walk_the_live_bitmap():
+    # Dense ids fill bitmap containers, the sparse tail array ones.
+    rnd = random.Random(9)
+    doc_ids = list(range(70000)) + rnd.sample(range(70000, 400000), 5000)
+    index = BooleanIndex(False, False)
+    docs = {}
+    for doc_id in doc_ids:
+        docs[doc_id] = set(rnd.sample("abcd", rnd.randint(1, 3)))
+        index.add_document(doc_id, sorted(docs[doc_id]))
+    for doc_id in rnd.sample(doc_ids, 20000):
+        index.remove_document(doc_id)
+        del docs[doc_id]
+
+    def having(term):
+        return {doc_id for doc_id, terms in docs.items() if term in terms}
+
+    everything = set(docs)
+    a, b, c, d = having("a"), having("b"), having("c"), having("d")
+    cases = [
+        ("NOT a", everything - a),
+        ("NOT ( a OR b )", everything - (a | b)),
+        ("NOT a AND NOT b", everything - a - b),
+        ("c AND NOT ( a AND b )", c - (a & b)),
+        ("( NOT a OR b ) AND c", ((everything - a) | b) & c),
+        ("( NOT ( a b ) OR d ) AND ( NOT c OR a )", ((everything - (a & b)) | d) & ((everything - c) | a)),
+    ]
+    for query, expected in cases:
+        assert index.search(query.split()) == sorted(expected), query
+
+
+def test_readers_wait_for_a_writer_without_holding_the_gil():
+    source = BooleanIndex(False, False)
+    source.apply_batch([("add", doc_id, [f"t{doc_id % 5000}", "x"]) for doc_id in range(500000)])
+    index = BooleanIndex(False, False)
+    index.add_document(1, ["x"])
+    merging = threading.Event()
+    done = threading.Event()
+    elapsed = []
+
+    def merge():
+        merging.set()
+        started = time.perf_counter()
+        index.merge([source])
+        elapsed.append(time.perf_counter() - started)
+        done.set()
+
+    def read():
+        while not done.is_set():
+            index.term_stats(["x"])
+            index.storage_stats()
+
+    threads = [threading.Thread(target=merge), threading.Thread(target=read)]
+    for thread in threads:
+        thread.start()
+    merging.wait()
+    longest, last = 0.0, time.perf_counter()
+    while not done.is_set():
+        now = time.perf_counter()
+        longest, last = max(longest, now - last), now
+        time.sleep(0.001)
+    for thread in threads:
+        thread.join()
+    assert longest < elapsed[0] / 2
@@ -0,0 +1,57 @@
+import time
+from datetime import datetime, timedelta, timezone
+from logic.index_sync import IndexSync
+from logic.page_codec import PageCodec
+
+
+class FakeCursor(list):
+    def sort(self, field, direction):
+        return FakeCursor(sorted(self, key=lambda doc: doc[field]))
+
+
+class FakePages:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query, projection=None, batch_size=None):
+        ((field, condition),) = query.items()
+        since = condition["$gte"].astimezone(timezone.utc).replace(tzinfo=None)
+        return FakeCursor(dict(doc) for doc in self.docs if doc.get(field) and doc[field] >= since)
+
+
+class FakeIndex:
+    def __init__(self):
+        self.codec = PageCodec({"terms": None, "counter": None})
+        self.ops = []
+
+    def apply_batch(self, ops):
+        self.ops.extend(ops)
+
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def test_poll_follows_write_time_not_crawl_time():
+    # Crawled long before it reached Mongo, e.g. held up in the write queue.
+    page = {
+        "doc_id": 1, "url": "u1", "title": "", "domain": "", "terms": ["a"], "duplicate_of": None,
+        "last_crawled": utcnow() - timedelta(hours=1),
+    }
+    pages = FakePages([page])
+    index = FakeIndex()
+    sync = IndexSync(index, pages, mode="poll", poll_margin=60.0)
+    sync.open()
+
+    page["indexed_at"] = utcnow()
+    sync._poll_once()
+    assert [op["doc_id"] for op in index.ops] == [1]
+
+    sync._poll_once()
+    assert len(index.ops) == 1
+
+    page["indexed_at"] = utcnow() + timedelta(seconds=1)
+    page["terms"] = ["b"]
+    sync._poll_once()
+    assert index.ops[-1]["terms"] == ["b"]
+    assert sync.polled_until >= time.time()
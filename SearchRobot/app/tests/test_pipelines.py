@@ -0,0 +1,218 @@
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+import pytest
+from pymongo.errors import BulkWriteError
+from twisted.internet import reactor
+from logic.page_codec import PageCodec
+from logic.pipelines import SaveMongoBooleanIndexPipeline
+
+
+class FakeCollection:
+    # The part of a pymongo collection the writer uses. Upserts of urls in
+    # fail_urls fail like a duplicate key, the others land.
+    def __init__(self):
+        self.docs = {}
+        self.fail_urls = set()
+        self.bulk_writes = 0
+
+    def find(self, query, projection=None):
+        urls = query["url"]["$in"]
+        return [dict(self.docs[url]) for url in urls if url in self.docs]
+
+    def bulk_write(self, ops, ordered=True):
+        self.bulk_writes += 1
+        errors = []
+        for i, op in enumerate(ops):
+            url = op._filter["url"]
+            if url in self.fail_urls:
+                errors.append({"index": i, "code": 11000, "errmsg": f"duplicate key: {url}"})
+                continue
+            doc = self.docs.get(url)
+            if doc is None:
+                doc = self.docs[url] = {"url": url, **op._doc.get("$setOnInsert", {})}
+            doc.update(op._doc["$set"])
+            for field in op._doc.get("$currentDate", {}):
+                doc[field] = datetime.now(timezone.utc).replace(tzinfo=None)
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nUpserted": len(ops) - len(errors)})
+
+
+class FakeCounter:
+    def __init__(self):
+        self.seq = 0
+        self.calls = 0
+
+    def find_one_and_update(self, query, update, return_document=None):
+        self.calls += 1
+        self.seq += update["$inc"]["seq"]
+        return {"_id": "doc_id", "seq": self.seq}
+
+
+class StatsCollector:
+    def __init__(self):
+        self.values = {}
+
+    def inc_value(self, key, count=1):
+        self.values[key] = self.values.get(key, 0) + count
+
+    def get(self, key):
+        return self.values.get(key, 0)
+
+
+class FakeFrontier:
+    def __init__(self):
+        self.scheduled = {}
+
+    def next_interval(self, interval, changed):
+        return 3600
+
+    def schedule(self, due):
+        self.scheduled.update(due)
+
+
+def page(url, terms=("a", "b"), content_hash=None):
+    return {
+        "url": url,
+        "normalized_url": url,
+        "domain": "example.com",
+        "title": url,
+        "content": " ".join(terms),
+        "terms": list(terms),
+        "terms_count": len(terms),
+        "content_hash": content_hash or f"hash:{url}",
+        "last_crawled": datetime(2026, 1, 1),
+    }
+
+
+def make_pipeline(**kwargs):
+    pipeline = SaveMongoBooleanIndexPipeline("mongodb://unused", "db", "pages", **kwargs)
+    pipeline.collection = FakeCollection()
+    pipeline.counter = FakeCounter()
+    pipeline.codec = PageCodec({"terms": None, "counter": None})
+    return pipeline
+
+
+def start_writer(pipeline):
+    pipeline.writer = threading.Thread(target=pipeline._write_loop, daemon=True)
+    pipeline.writer.start()
+
+
+def stop_writer(pipeline):
+    pipeline.queue.put(pipeline.STOP)
+    pipeline.writer.join(timeout=5)
+    assert not pipeline.writer.is_alive()
+
+
+@pytest.fixture
+def reactor_calls(monkeypatch):
+    # Stands in for the reactor thread: callFromThread only queues the
+    # call, and the test runs it.
+    calls = queue.Queue()
+    monkeypatch.setattr(reactor, "callFromThread", lambda f, *args: calls.put((f, args)))
+    return calls
+
+
+def run_reactor_until(calls, done, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not done() and time.monotonic() < deadline:
+        try:
+            f, args = calls.get(timeout=0.01)
+        except queue.Empty:
+            continue
+        f(*args)
+    return done()
+
+
+def test_item_parked_after_the_queue_drained_is_admitted(reactor_calls):
+    pipeline = make_pipeline(batch_size=1, flush_interval=5.0, queue_size=1)
+    pipeline.queue.put(page("u1"))
+    put_nowait = pipeline.queue.put_nowait
+
+    def drained_then_full(item):
+        # The writer empties the queue between the failed put and the
+        # item being parked, then waits on the empty queue.
+        pipeline.queue.put_nowait = put_nowait
+        start_writer(pipeline)
+        while "u1" not in pipeline.collection.docs:
+            time.sleep(0.01)
+        raise queue.Full
+
+    pipeline.queue.put_nowait = drained_then_full
+    d = pipeline.process_item(page("u2"))
+    assert pipeline.waiting
+
+    assert run_reactor_until(reactor_calls, lambda: d.called)
+    assert run_reactor_until(reactor_calls, lambda: "u2" in pipeline.collection.docs)
+    stop_writer(pipeline)
+
+
+def test_doc_ids_are_reserved_a_block_at_a_time():
+    pipeline = make_pipeline(doc_id_block=5)
+    pipeline._write_batch([page(f"u{i}") for i in range(3)])
+    pipeline._write_batch([page(f"u{i}") for i in range(3, 6)])
+    pipeline._write_batch([page(f"u{i}") for i in range(6, 20)])
+
+    doc_ids = [pipeline.collection.docs[f"u{i}"]["doc_id"] for i in range(20)]
+    assert len(set(doc_ids)) == 20
+    # A batch that does not fit the rest of a block takes a new one, as
+    # large as the batch if need be.
+    assert pipeline.counter.calls == 3
+    assert doc_ids[:6] == [1, 2, 3, 6, 7, 8]
+    assert doc_ids[6:] == list(range(11, 25))
+
+
+def test_repeated_url_in_a_batch_is_written_once_with_its_last_version():
+    pipeline = make_pipeline()
+    pipeline._write_batch([page("u1", ("a",)), page("u2"), page("u1", ("b",), content_hash="new")])
+
+    assert pipeline.collection.bulk_writes == 1
+    assert pipeline.counter.seq == pipeline.doc_id_block
+    assert sorted(pipeline.collection.docs) == ["u1", "u2"]
+    assert pipeline.collection.docs["u1"]["terms"] == ["b"]
+    assert pipeline.collection.docs["u1"]["doc_id"] != pipeline.collection.docs["u2"]["doc_id"]
+
+
+def test_unchanged_page_keeps_its_write_time():
+    pipeline = make_pipeline()
+    pipeline._write_batch([page("u1")])
+    written = pipeline.collection.docs["u1"]["indexed_at"]
+    revisit = {**page("u1"), "last_crawled": datetime(2026, 2, 1)}
+    pipeline._write_batch([revisit])
+
+    assert pipeline.collection.docs["u1"]["last_crawled"] == datetime(2026, 2, 1)
+    assert pipeline.collection.docs["u1"]["indexed_at"] == written
+
+
+def test_failed_upserts_are_dropped_and_the_rest_scheduled():
+    pipeline = make_pipeline(frontier=FakeFrontier())
+    pipeline.stats = stats = StatsCollector()
+    pipeline.collection.fail_urls = {"u2"}
+    pipeline._write_batch([page("u1"), page("u2"), page("u3")])
+
+    assert sorted(pipeline.collection.docs) == ["u1", "u3"]
+    assert sorted(pipeline.frontier.scheduled) == ["u1", "u3"]
+    assert stats.get("index_pipeline/dropped_items") == 1
+    assert stats.get("index_pipeline/mongo_writes") == 2
+
+
+def test_items_wait_for_room_in_the_queue_in_order(reactor_calls):
+    pipeline = make_pipeline(batch_size=2, flush_interval=0.05, queue_size=2)
+    results = [pipeline.process_item(page(f"u{i}")) for i in range(6)]
+    parked = results[2:]
+    assert all(isinstance(item, dict) for item in results[:2])
+    assert len(pipeline.waiting) == 4
+    # Once one is parked, later items queue behind it even if there is room.
+    pipeline.queue.get_nowait()
+    parked.append(pipeline.process_item(page("u6")))
+    assert len(pipeline.waiting) == 5
+
+    start_writer(pipeline)
+    admitted = []
+    for d in parked:
+        d.addCallback(lambda item: admitted.append(item["url"]))
+    assert run_reactor_until(reactor_calls, lambda: not pipeline.waiting)
+    assert admitted == ["u2", "u3", "u4", "u5", "u6"]
+    assert run_reactor_until(reactor_calls, lambda: sorted(pipeline.collection.docs) == [f"u{i}" for i in range(1, 7)])
+    stop_writer(pipeline)
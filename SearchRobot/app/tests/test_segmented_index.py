@@ -0,0 +1,117 @@
+import random
+import threading
+import pytest
+from cpp.boolean_index_cpp import BooleanIndex
+from logic import segmented_index
+from logic.segmented_index import SegmentedIndex
+from test_boolean_index import bm25_scores
+
+
+@pytest.fixture
+def segmented():
+    index = SegmentedIndex(buffer_docs=50, merge_factor=100)
+    yield index
+    index.close()
+
+
+def test_ranked_with_tombstones_in_frozen_segments(segmented):
+    rnd = random.Random(7)
+    vocab = [f"t{i}" for i in range(30)]
+    docs = {}
+    for doc_id in range(300):
+        docs[doc_id] = rnd.choices(vocab, k=rnd.randint(1, 20))
+        segmented.add_document(doc_id, docs[doc_id])
+    for doc_id in rnd.sample(range(300), 150):
+        segmented.remove_document(doc_id)
+        del docs[doc_id]
+    assert all(stats["tombstones"] for stats in segmented.segment_stats()["segments"])
+
+    query = vocab[:3]
+    n_docs, _, df = segmented.term_stats(query)
+    assert n_docs == len(docs)
+    assert df == {term: sum(term in terms for terms in docs.values()) for term in query}
+    expected = bm25_scores(docs, query)[:10]
+    hits = segmented.search_ranked(query, 10)
+    assert [doc_id for doc_id, _ in hits] == [doc_id for doc_id, _ in expected]
+    assert [score for _, score in hits] == pytest.approx([score for _, score in expected])
+
+
+def test_term_count_through_updates_and_merges():
+    rnd = random.Random(11)
+    vocab = [f"t{i}" for i in range(400)]
+    index = SegmentedIndex(buffer_docs=20, merge_factor=2)
+    docs = {}
+    try:
+        for step in range(600):
+            doc_id = rnd.randrange(200)
+            if doc_id in docs and rnd.random() < 0.3:
+                index.remove_document(doc_id)
+                del docs[doc_id]
+            else:
+                docs[doc_id] = rnd.choices(vocab, k=rnd.randint(1, 5))
+                index.apply_batch([("replace", doc_id, docs[doc_id])])
+            if step % 100 == 99:
+                index.force_merge()
+            assert index.get_term_count() == len({term for terms in docs.values() for term in terms})
+    finally:
+        index.close()
+
+
+def test_search_never_sees_both_copies_of_a_replaced_document():
+    index = SegmentedIndex(buffer_docs=100000)
+    index.apply_batch([("add", doc_id, ["a", f"x{doc_id}"]) for doc_id in range(2000)])
+    index.force_merge()
+    duplicated = []
+    done = threading.Event()
+
+    def search():
+        while not done.is_set():
+            hits = index.search(["a"])
+            if len(hits) != len(set(hits)):
+                duplicated.append(len(hits))
+
+    reader = threading.Thread(target=search)
+    reader.start()
+    try:
+        for version in range(10):
+            index.apply_batch([("replace", doc_id, ["a", f"y{version}"]) for doc_id in range(2000)])
+            index.force_merge()
+    finally:
+        done.set()
+        reader.join()
+        index.close()
+    assert not duplicated
+
+
+def test_snapshot_overtaken_by_a_load_saves_the_loaded_index(segmented, tmp_path, monkeypatch):
+    loaded = str(tmp_path / "loaded.snapshot")
+    saved = str(tmp_path / "saved.snapshot")
+    segmented.apply_batch([("add", doc_id, ["a"]) for doc_id in range(120)])
+    segmented.save_snapshot(loaded, 1.0)
+    segmented.apply_batch([("add", doc_id, ["b"]) for doc_id in range(120, 200)])
+
+    class LoadDuringMerge:
+        # A merge target that loads the first snapshot into the index
+        # while the merge runs, once.
+        pending = True
+
+        def __init__(self, *args):
+            self.inner = BooleanIndex(*args)
+
+        def merge(self, sources):
+            if LoadDuringMerge.pending:
+                LoadDuringMerge.pending = False
+                segmented.load_snapshot(loaded)
+            return self.inner.merge(sources)
+
+        def __getattr__(self, name):
+            return getattr(self.inner, name)
+
+    monkeypatch.setattr(segmented_index, "BooleanIndex", LoadDuringMerge)
+    segmented.save_snapshot(saved, 2.0)
+    monkeypatch.undo()
+
+    restored = BooleanIndex()
+    assert restored.load_snapshot(saved) == 2.0
+    assert restored.get_document_count() == 120
+    assert restored.search(["a"]) == list(range(120))
@@ -0,0 +1,39 @@
+import multiprocessing
+import queue
+import pytest
+from logic.sharded_index import ShardedIndex
+
+
+def one_shard(call_timeout):
+    # A ShardedIndex whose only shard is the far end of a pipe.
+    index = ShardedIndex.__new__(ShardedIndex)
+    index.shards = 1
+    index.call_timeout = call_timeout
+    index.pools = [queue.LifoQueue()]
+    conn, shard = multiprocessing.Pipe()
+    index.pools[0].put(conn)
+    return index, conn, shard
+
+
+def test_call_to_a_hung_shard_times_out_and_drops_the_connection():
+    index, conn, shard = one_shard(0.05)
+    with pytest.raises(RuntimeError, match="index shard 0 failed"):
+        index.search(["a"])
+    assert index.pools[0].empty()
+    assert conn.closed
+
+
+def test_call_that_cannot_be_sent_drops_the_connection():
+    index, conn, shard = one_shard(0.05)
+    with pytest.raises(Exception):
+        index.explain([lambda: None])
+    assert index.pools[0].empty()
+    assert conn.closed
+
+
+def test_connection_is_reused_after_a_reply():
+    index, conn, shard = one_shard(1.0)
+    shard.send(("ok", 3))
+    assert index.get_document_count() == 3
+    assert shard.recv() == ("get_document_count", ())
+    assert index.pools[0].get_nowait() is conn
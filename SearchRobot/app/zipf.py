@@ -3,12 +3,13 @@ import matplotlib.pyplot as plt
 import numpy as np
 import yaml
 from logic.db import get_mongo
+from logic.page_codec import PageCodec
 
 def fetch_all_terms(collection):
     all_terms = []
+    codec = PageCodec(collection.database)
     for doc in collection.find({}, {"terms": 1}):
-        terms = doc.get("terms", [])
-        all_terms.extend(terms)
+        all_terms.extend(codec.terms(doc))
     return all_terms
 
 def calculate_zipf_data(terms_list):